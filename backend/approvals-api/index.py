@@ -13,6 +13,8 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 from pydantic import BaseModel, Field
 
+from file_previews import fetch_previews
+
 SCHEMA = 't_p61788166_html_to_frontend'
 DSN = os.environ['DATABASE_URL']
 
@@ -224,11 +226,19 @@ def handle_approvals_list(event: Dict[str, Any], conn, user_id: int) -> Dict[str
             if doc.get('uploaded_at'):
                 doc['uploaded_at'] = doc['uploaded_at'].isoformat()
             documents_map.setdefault(pid, []).append(doc)
+
+    file_urls = [row['invoice_file_url'] for row in payments_data]
+    file_urls += [doc['file_url'] for docs in documents_map.values() for doc in docs]
+    previews_map = fetch_previews(cur, SCHEMA, file_urls)
+    for docs in documents_map.values():
+        for doc in docs:
+            doc['previews'] = previews_map.get(doc['file_url'])
     
     for payment in payments_data:
         payment_dict = dict(payment)
         payment_dict['custom_fields'] = custom_fields_map.get(payment['id'], [])
         payment_dict['documents'] = documents_map.get(payment['id'], [])
+        payment_dict['invoice_file_previews'] = previews_map.get(payment['invoice_file_url'])
         
         # Получаем историю утверждений
         cur.execute(f"""
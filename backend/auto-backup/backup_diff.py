@@ -0,0 +1,359 @@
+"""
+Проверка целостности и сравнение бэкапов по манифестам.
+Проверка без скачивания сверяет размеры объектов в S3 (HEAD) с манифестом;
+полная проверка читает блоки и сверяет их sha256. Сравнение двух бэкапов
+находит изменённые таблицы по хэшам файлов, а внутри таблицы читает только
+блоки с разными хэшами (см. ChunkedWriter в backup_stream). Таблицы из
+инкрементальных бэкапов сравниваются по состоянию, собранному из цепочки.
+"""
+import json
+import gzip
+import hashlib
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from backup_stream import S3_BUCKET
+
+# Больше строк одной таблицы сравнение в памяти не держит
+MAX_DIFF_ROWS = 200000
+
+def read_chunk(s3, key: str, chunk: Optional[Dict[str, Any]]) -> bytes:
+    """Несжатое содержимое блока (или всего объекта, если индекса блоков нет)"""
+    if chunk is None:
+        body = s3.get_object(Bucket=S3_BUCKET, Key=key)['Body'].read()
+    else:
+        end = chunk['offset'] + chunk['length'] - 1
+        body = s3.get_object(Bucket=S3_BUCKET, Key=key, Range=f"bytes={chunk['offset']}-{end}")['Body'].read()
+    return gzip.decompress(body)
+
+def object_size(s3, key: str) -> Optional[int]:
+    try:
+        return s3.head_object(Bucket=S3_BUCKET, Key=key)['ContentLength']
+    except Exception:
+        return None
+
+def verify_table(s3, info: Dict[str, Any], deep: bool) -> List[str]:
+    """Ошибки файла таблицы; пустой список — файл цел"""
+    errors = []
+    expected = info['bytes'] - info.get('deleted_bytes', 0)
+    size = object_size(s3, info['key'])
+    if size is None:
+        return [f"Нет объекта {info['key']}"]
+    if size != expected:
+        errors.append(f"Размер {info['key']}: {size} байт вместо {expected}")
+
+    if 'deleted_key' in info and 'deleted_bytes' in info:
+        deleted_size = object_size(s3, info['deleted_key'])
+        if deleted_size != info['deleted_bytes']:
+            errors.append(f"Размер {info['deleted_key']}: {deleted_size} байт вместо {info['deleted_bytes']}")
+
+    chunks = info.get('chunks')
+    if chunks is not None and sum(c['length'] for c in chunks) > size:
+        errors.append('Индекс блоков выходит за пределы файла')
+    if not deep or errors or 'sha256' not in info:
+        return errors
+
+    file_hash = hashlib.sha256()
+    rows = 0
+    for chunk in chunks if chunks is not None else [None]:
+        data = read_chunk(s3, info['key'], chunk)
+        file_hash.update(data)
+        rows += data.count(b'\n')
+        if chunk is not None and hashlib.sha256(data).hexdigest() != chunk['sha256']:
+            errors.append(f"Хэш блока со смещением {chunk['offset']} не совпадает")
+    if file_hash.hexdigest() != info['sha256']:
+        errors.append('Хэш файла не совпадает')
+    if rows != info['rows']:
+        errors.append(f"Строк {rows} вместо {info['rows']}")
+    return errors
+
+def verify_backup(s3, manifest: Dict[str, Any], deep: bool = False) -> Dict[str, Any]:
+    """
+    Сверяет файлы бэкапа с манифестом. Без deep — только размеры объектов
+    (HEAD-запросы, содержимое не скачивается); с deep — ещё и хэши блоков.
+    """
+    tables = {}
+    for table, info in manifest['tables'].items():
+        errors = verify_table(s3, info, deep)
+        tables[table] = {'ok': not errors, 'errors': errors}
+    return {
+        'ok': all(t['ok'] for t in tables.values()),
+        'deep': deep,
+        'checksums': all('sha256' in info for info in manifest['tables'].values()),
+        'tables': tables,
+    }
+
+
+class DiffTooLarge(Exception):
+    pass
+
+def iter_lines(s3, key: str, chunk: Optional[Dict[str, Any]] = None) -> Iterator[bytes]:
+    """Строки NDJSON блока; файл без индекса блоков читается потоком, а не целиком"""
+    if chunk is not None:
+        lines = read_chunk(s3, key, chunk).split(b'\n')
+    else:
+        lines = gzip.GzipFile(fileobj=s3.get_object(Bucket=S3_BUCKET, Key=key)['Body'])
+    for line in lines:
+        line = line.rstrip(b'\n')
+        if line:
+            yield line
+
+def chunk_ids(chunks: List[Dict[str, Any]]) -> Dict[Any, Dict[str, Any]]:
+    """
+    Блоки двух бэкапов сопоставляются по диапазону ключей и номеру блока
+    внутри него, без диапазона — по порядку. При неуникальном первом столбце
+    (file_id в log_statistics и т. п.) один диапазон занимает несколько блоков
+    по CHUNK_ROWS строк.
+    """
+    ids: Dict[Any, Dict[str, Any]] = {}
+    ordinals: Counter = Counter()
+    for index, chunk in enumerate(chunks):
+        bucket = chunk.get('bucket')
+        if bucket is None:
+            ids[f'#{index}'] = chunk
+        else:
+            ids[(bucket, ordinals[bucket])] = chunk
+            ordinals[bucket] += 1
+    return ids
+
+def chunk_lines(s3, info: Dict[str, Any], chunks: List[Dict[str, Any]]) -> Counter:
+    lines: Counter = Counter()
+    count = 0
+    for chunk in chunks:
+        for line in iter_lines(s3, info['key'], chunk):
+            lines[line] += 1
+            count += 1
+        if count > MAX_DIFF_ROWS:
+            raise DiffTooLarge(f'Больше {MAX_DIFF_ROWS} изменённых строк')
+    return lines
+
+def row_key(line: bytes, first: Optional[str]):
+    return json.loads(line).get(first) if first else line
+
+def count_changes(before: Counter, after: Counter, first: Optional[str]) -> Counter:
+    """Добавленные, удалённые и изменённые строки; изменённая — совпавший ключ с другим содержимым"""
+    removed_lines = before - after
+    added_lines = after - before
+    removed_keys = Counter(row_key(line, first) for line in removed_lines.elements())
+    added_keys = Counter(row_key(line, first) for line in added_lines.elements())
+    updated = sum((removed_keys & added_keys).values())
+    return Counter({
+        'added': sum(added_lines.values()) - updated,
+        'removed': sum(removed_lines.values()) - updated,
+        'updated': updated,
+    })
+
+def diff_table(s3, old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Сравнение полных файлов одной таблицы: читаются только блоки, хэши которых
+    различаются. Строки сопоставляются по первому столбцу (обычно id).
+    Строка с целым ключом лежит в блоках своего диапазона в обоих бэкапах,
+    поэтому изменённые блоки сравниваются по диапазонам: в памяти одновременно
+    только блоки одного диапазона (строки внутри него могут сдвигаться между
+    блоками). Блоки без диапазона сравниваются вместе. Больше MAX_DIFF_ROWS
+    строк в одной группе не читается.
+    """
+    old_chunks = chunk_ids(old['chunks'])
+    new_chunks = chunk_ids(new['chunks'])
+    changed = [
+        cid for cid in set(old_chunks) | set(new_chunks)
+        if cid not in old_chunks or cid not in new_chunks or old_chunks[cid]['sha256'] != new_chunks[cid]['sha256']
+    ]
+    first = new['columns'][0] if new['columns'] and new['columns'] == old['columns'] else None
+
+    # Совпавшие по хэшу блоки диапазона содержат одни и те же строки и при
+    # вычитании сокращаются, поэтому достаточно сравнить изменённые
+    groups: Dict[Any, List[Any]] = {}
+    for cid in changed:
+        groups.setdefault(cid[0] if isinstance(cid, tuple) else None, []).append(cid)
+    totals: Counter = Counter()
+    for group in groups.values():
+        before = chunk_lines(s3, old, [old_chunks[cid] for cid in group if cid in old_chunks])
+        after = chunk_lines(s3, new, [new_chunks[cid] for cid in group if cid in new_chunks])
+        totals.update(count_changes(before, after, first))
+    return {
+        'status': 'changed' if sum(totals.values()) else 'unchanged',
+        'added': totals['added'],
+        'removed': totals['removed'],
+        'updated': totals['updated'],
+        'chunks_read': sum(1 for cid in changed if cid in old_chunks) + sum(1 for cid in changed if cid in new_chunks),
+        'chunks_total': len(old_chunks) + len(new_chunks),
+    }
+
+def table_pk(chain: List[Dict[str, Any]], table: str) -> List[str]:
+    """Первичный ключ из инкремента по журналу; без него строки сопоставляются по первому столбцу"""
+    infos = [m['tables'][table] for m in reversed(chain) if table in m['tables']]
+    for info in infos:
+        if info.get('pk'):
+            return info['pk']
+    for info in infos:
+        if info.get('columns'):
+            return info['columns'][:1]
+    return []
+
+def state_key(row: Dict[str, Any], pk: List[str]) -> tuple:
+    return tuple(row.get(col) for col in pk)
+
+def chunks_for_keys(info: Dict[str, Any], pk: List[str], keys: Optional[set]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Блоки файла таблицы, в которых могут быть строки с ключами из keys.
+    Файл инкремента по журналу читается целиком — он содержит только изменённые строки.
+    """
+    if not info.get('rows'):
+        return []
+    chunks = info.get('chunks')
+    if chunks is None:
+        return [None]
+    if keys is None or info.get('mode') == 'changes' or len(pk) != 1 or pk[0] not in info.get('indexed', ()):
+        return chunks
+    values = sorted(key[0] for key in keys if isinstance(key[0], int) and not isinstance(key[0], bool))
+    if len(values) != len(keys):
+        return chunks
+    selected = []
+    for chunk in chunks:
+        low, high = chunk['ranges'].get(pk[0], (None, None))
+        if low is None:
+            continue
+        i = bisect_left(values, low)
+        if i < len(values) and values[i] <= high:
+            selected.append(chunk)
+    return selected
+
+def changed_keys(s3, increments: List[Dict[str, Any]], table: str, pk: List[str]) -> set:
+    """Ключи строк, изменённых или удалённых в инкрементах по журналу"""
+    keys: set = set()
+    for manifest in increments:
+        info = manifest['tables'].get(table)
+        if not info:
+            continue
+        if info.get('deleted'):
+            keys.update(state_key(json.loads(line)['row_pk'], pk) for line in iter_lines(s3, info['deleted_key']))
+        for chunk in chunks_for_keys(info, pk, None):
+            keys.update(state_key(json.loads(line), pk) for line in iter_lines(s3, info['key'], chunk))
+        if len(keys) > MAX_DIFF_ROWS:
+            raise DiffTooLarge(f'Больше {MAX_DIFF_ROWS} изменённых строк')
+    return keys
+
+def table_state(
+    s3,
+    chain: List[Dict[str, Any]],
+    table: str,
+    pk: List[str],
+    keys: Optional[set] = None,
+    state: Optional[Dict[tuple, Tuple[Any, bytes]]] = None
+) -> Dict[tuple, Tuple[Any, bytes]]:
+    """
+    Состояние таблицы после проигрывания манифестов chain поверх state:
+    ключ → (file_id, хэш строки). Проигрывание то же, что при восстановлении
+    (select_rows в db-backup): full заменяет таблицу, by_file — записи своих
+    файлов, changes — изменённые и удалённые строки. keys ограничивает
+    состояние этими ключами; без keys в памяти не больше MAX_DIFF_ROWS строк.
+    """
+    state = {} if state is None else state
+    for manifest in chain:
+        info = manifest['tables'].get(table)
+        if not info:
+            continue
+        mode = info.get('mode', 'full')
+        if mode == 'full':
+            state = {}
+        elif mode == 'by_file':
+            file_ids = set(info['file_ids'])
+            state = {k: v for k, v in state.items() if v[0] not in file_ids}
+        elif mode == 'changes' and info.get('deleted'):
+            for line in iter_lines(s3, info['deleted_key']):
+                state.pop(state_key(json.loads(line)['row_pk'], pk), None)
+
+        for chunk in chunks_for_keys(info, pk, keys):
+            for line in iter_lines(s3, info['key'], chunk):
+                row = json.loads(line)
+                key = state_key(row, pk)
+                if keys is None or key in keys:
+                    state[key] = (row.get('file_id'), hashlib.sha1(line).digest())
+            if len(state) > MAX_DIFF_ROWS:
+                raise DiffTooLarge(f'Больше {MAX_DIFF_ROWS} строк в таблице {table}')
+    return state
+
+def diff_states(before: Dict[tuple, Any], after: Dict[tuple, Any]) -> Dict[str, Any]:
+    added = sum(1 for key in after if key not in before)
+    removed = sum(1 for key in before if key not in after)
+    updated = sum(1 for key, value in after.items() if key in before and before[key] != value)
+    return {
+        'status': 'changed' if added or removed or updated else 'unchanged',
+        'added': added,
+        'removed': removed,
+        'updated': updated,
+    }
+
+def diff_chain_table(s3, old_chain: List[Dict[str, Any]], new_chain: List[Dict[str, Any]], table: str) -> Dict[str, Any]:
+    """
+    Сравнение таблицы, выгруженной хотя бы в одном из бэкапов инкрементом.
+    Если старый бэкап — предок нового в той же цепочке и между ними таблица
+    выгружалась только по журналу изменений, сравниваются лишь затронутые
+    инкрементами ключи: их состояние в старом бэкапе и после проигрывания
+    инкрементов. Иначе состояния таблицы в обеих цепочках строятся целиком.
+    """
+    pk = table_pk(old_chain + new_chain, table)
+    prefixes = [m.get('prefix') for m in new_chain]
+    old_prefix = old_chain[-1].get('prefix')
+    if old_prefix is not None and old_prefix in prefixes:
+        between = new_chain[prefixes.index(old_prefix) + 1:]
+        if all(m['tables'].get(table, {}).get('mode') == 'changes' for m in between):
+            keys = changed_keys(s3, between, table, pk)
+            before = table_state(s3, old_chain, table, pk, keys)
+            after = table_state(s3, between, table, pk, keys, dict(before))
+            return {'keys_compared': len(keys), **diff_states(before, after)}
+
+    before = table_state(s3, old_chain, table, pk)
+    after = table_state(s3, new_chain, table, pk)
+    return {'rows_before': len(before), 'rows_after': len(after), **diff_states(before, after)}
+
+def diff_backups(s3, old_chain: List[Dict[str, Any]], new_chain: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Потабличное сравнение двух бэкапов; old_chain и new_chain — их цепочки
+    от полного бэкапа (load_chain). Таблицы с одинаковым sha256 файла не
+    читаются вовсе. Таблицы, выгруженные хотя бы с одной стороны инкрементом,
+    сравниваются по состоянию, собранному из цепочки (см. diff_chain_table).
+    Если для сравнения пришлось бы держать в памяти больше MAX_DIFF_ROWS
+    строк, таблица получает статус too_large.
+    """
+    old, new = old_chain[-1], new_chain[-1]
+    tables = {}
+    for table in list(new['tables']) + [t for t in old['tables'] if t not in new['tables']]:
+        a = old['tables'].get(table)
+        b = new['tables'].get(table)
+        if a is None:
+            tables[table] = {'status': 'added', 'rows_before': 0, 'rows_after': b['rows'], 'rows_delta': b['rows']}
+            continue
+        if b is None:
+            tables[table] = {'status': 'removed', 'rows_before': a['rows'], 'rows_after': 0, 'rows_delta': -a['rows']}
+            continue
+
+        mode_before, mode_after = a.get('mode', 'full'), b.get('mode', 'full')
+        try:
+            if mode_before != 'full' or mode_after != 'full':
+                # rows инкремента — число изменённых строк, а не размер таблицы
+                item = {'mode_before': mode_before, 'mode_after': mode_after}
+                item.update(diff_chain_table(s3, old_chain, new_chain, table))
+                item['rows_delta'] = item['added'] - item['removed']
+                if mode_before == 'full' and 'rows_before' not in item:
+                    item['rows_before'] = a['rows']
+                    item['rows_after'] = a['rows'] + item['rows_delta']
+            else:
+                item = {'rows_before': a['rows'], 'rows_after': b['rows'], 'rows_delta': b['rows'] - a['rows']}
+                if 'sha256' not in a or 'sha256' not in b:
+                    item['status'] = 'unknown'
+                elif a['sha256'] == b['sha256']:
+                    item['status'] = 'unchanged'
+                else:
+                    item.update(diff_table(s3, a, b))
+        except DiffTooLarge as e:
+            item = {'status': 'too_large', 'mode_before': mode_before, 'mode_after': mode_after, 'error': str(e)}
+        tables[table] = item
+
+    return {
+        'schema_changed': old.get('schema_hash') != new.get('schema_hash'),
+        'changed_tables': [t for t, item in tables.items() if item['status'] != 'unchanged'],
+        'tables': tables,
+    }
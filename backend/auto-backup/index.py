@@ -4,13 +4,15 @@ import os
 import sys
 import jwt
 import psycopg2
-import boto3
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
-from datetime import datetime
-from decimal import Decimal
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-import base64
+from backup_stream import (
+    export_database, read_manifest, load_chain, manifest_links, prune_changes, get_s3, cdn_url,
+    S3_BUCKET, BACKUP_PREFIX, MANIFEST_NAME
+)
+from backup_diff import verify_backup, diff_backups
 
 SCHEMA = 't_p61788166_html_to_frontend'
 
@@ -26,12 +28,18 @@ TABLES_ORDER = [
     'payments', 'approvals', 'custom_field_values', 'notifications',
     'payment_comments', 'comment_likes', 'payment_custom_field_values',
     'payment_custom_values', 'payment_documents', 'payment_views',
+    'uploaded_files', 'file_blobs', 'file_previews',
     'planned_payments', 'planned_payment_custom_field_values',
     'savings', 'audit_logs', 'log_files', 'log_entries',
-    'log_statistics', 'login_attempts', 'push_subscriptions',
+    'log_statistics', 'log_templates', 'log_file_templates',
+    'log_histogram_minute', 'log_histogram_hour', 'log_sources',
+    'login_attempts', 'push_subscriptions',
     'dashboard_layouts', 'webauthn_challenges', 'webauthn_credentials',
 ]
 
+FULL_BACKUP_EVERY = 24
+FULL_BACKUP_MAX_AGE_DAYS = 7
+
 def log(msg):
     print(msg, file=sys.stderr, flush=True)
 
@@ -51,14 +59,6 @@ def response(status_code, body):
 def get_db():
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
-def get_s3():
-    return boto3.client(
-        's3',
-        endpoint_url='https://bucket.poehali.dev',
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-    )
-
 def verify_admin(event):
     token = event.get('headers', {}).get('X-Auth-Token') or event.get('headers', {}).get('x-auth-token')
     if not token:
@@ -91,15 +91,6 @@ def check_admin(conn, user_id):
     cur.close()
     return result
 
-def json_serial(obj):
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    if isinstance(obj, Decimal):
-        return float(obj)
-    if isinstance(obj, (bytes, memoryview)):
-        return base64.b64encode(bytes(obj)).decode('utf-8')
-    return str(obj)
-
 def get_setting(conn, key):
     cur = conn.cursor(cursor_factory=RealDictCursor)
     cur.execute(f"SELECT value FROM {SCHEMA}.site_settings WHERE key = %s", (key,))
@@ -126,41 +117,6 @@ def get_existing_tables(conn):
     cur.close()
     return existing
 
-def create_backup_data(conn):
-    existing = get_existing_tables(conn)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    backup = {
-        'version': '1.0',
-        'created_at': datetime.now(ZoneInfo('Europe/Moscow')).isoformat(),
-        'schema': SCHEMA,
-        'tables': {}
-    }
-    total_rows = 0
-    for table in TABLES_ORDER:
-        if table not in existing:
-            continue
-        cur.execute(f'SELECT * FROM {SCHEMA}."{table}" ORDER BY 1')
-        rows = cur.fetchall()
-        backup['tables'][table] = [dict(row) for row in rows]
-        total_rows += len(rows)
-    cur.close()
-    return backup, total_rows
-
-def save_to_s3(backup_data):
-    s3 = get_s3()
-    now = datetime.now(ZoneInfo('Europe/Moscow'))
-    filename = f"backups/backup_{now.strftime('%Y-%m-%d_%H-%M-%S')}.json"
-    body = json.dumps(backup_data, ensure_ascii=False, default=json_serial)
-    s3.put_object(
-        Bucket='files',
-        Key=filename,
-        Body=body.encode('utf-8'),
-        ContentType='application/json',
-    )
-    size_mb = round(len(body.encode('utf-8')) / (1024 * 1024), 2)
-    cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{filename}"
-    return filename, cdn_url, size_mb
-
 def log_action(conn, action, username, metadata):
     cur = conn.cursor()
     cur.execute(f"""
@@ -171,53 +127,137 @@ def log_action(conn, action, username, metadata):
     conn.commit()
     cur.close()
 
+def scan_s3_backups(s3):
+    """
+    Завершённые бэкапы в S3: папки backups/<имя>/ с manifest.json (размер — сумма
+    файлов папки) и одиночные JSON-файлы прежнего формата.
+    """
+    backups = {}
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=S3_BUCKET, Prefix=BACKUP_PREFIX):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            rest = key[len(BACKUP_PREFIX):]
+            if '/' in rest:
+                name = rest.split('/', 1)[0]
+                item = backups.setdefault(name, {'key': f'{BACKUP_PREFIX}{name}/', 'name': name, 'size': 0})
+                item['size'] += obj['Size']
+                if rest.endswith('/' + MANIFEST_NAME):
+                    item['created_at'] = obj['LastModified']
+                    item['url'] = cdn_url(key)
+            elif key.endswith('.json'):
+                backups[rest] = {'key': key, 'name': rest, 'size': obj['Size'],
+                                 'created_at': obj['LastModified'], 'url': cdn_url(key)}
+    # Папка без манифеста — бэкап не завершён
+    return [b for b in backups.values() if 'created_at' in b]
+
+def backup_links(s3, item):
+    """kind и parent бэкапа; одиночный JSON прежнего формата — всегда полный"""
+    if not item['key'].endswith('/'):
+        return {'kind': 'full', 'parent': None}
+    try:
+        return manifest_links(s3, item['key'])
+    except Exception as e:
+        log(f"Manifest of {item['key']} unavailable: {e}")
+        return {'kind': None, 'parent': None}
+
 def list_s3_backups():
+    """Последние 20 бэкапов; kind и parent показывают, какие инкременты от каких бэкапов зависят"""
     s3 = get_s3()
     try:
-        resp = s3.list_objects_v2(Bucket='files', Prefix='backups/')
+        complete = scan_s3_backups(s3)
     except Exception:
         return []
-    if 'Contents' not in resp:
-        return []
-    aws_key = os.environ['AWS_ACCESS_KEY_ID']
-    backups = []
-    for obj in sorted(resp['Contents'], key=lambda x: x['LastModified'], reverse=True):
-        key = obj['Key']
-        if not key.endswith('.json'):
-            continue
-        name = key.replace('backups/', '')
-        size_mb = round(obj['Size'] / (1024 * 1024), 2)
-        cdn_url = f"https://cdn.poehali.dev/projects/{aws_key}/bucket/{key}"
-        backups.append({
-            'key': key,
-            'name': name,
-            'size_mb': size_mb,
-            'created_at': obj['LastModified'].isoformat(),
-            'url': cdn_url,
+    result = []
+    for item in sorted(complete, key=lambda x: x['created_at'], reverse=True)[:20]:
+        result.append({
+            'key': item['key'],
+            'name': item['name'],
+            'size_mb': round(item['size'] / (1024 * 1024), 2),
+            'created_at': item['created_at'].isoformat(),
+            'url': item['url'],
+            **backup_links(s3, item),
         })
-    return backups[:20]
+    return result
+
+def find_dependents(s3, key):
+    """
+    Бэкапы, которые без key не восстановить: инкременты, ссылающиеся на него
+    через parent, и их инкременты. Порядок — от дальних к ближним, чтобы при
+    удалении цепочка не оставалась с потерянным звеном посередине.
+    """
+    children = {}
+    for item in scan_s3_backups(s3):
+        parent = backup_links(s3, item)['parent']
+        if parent:
+            children.setdefault(parent, []).append(item['key'])
+    found = []
+    queue = list(children.get(key, []))
+    while queue:
+        current = queue.pop(0)
+        found.append(current)
+        queue.extend(children.get(current, []))
+    return list(reversed(found))
 
 def delete_s3_backup(key):
     s3 = get_s3()
-    s3.delete_object(Bucket='files', Key=key)
+    if not key.endswith('/'):
+        s3.delete_object(Bucket=S3_BUCKET, Key=key)
+        return
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=S3_BUCKET, Prefix=key):
+        objects = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if objects:
+            s3.delete_objects(Bucket=S3_BUCKET, Delete={'Objects': objects})
+
+def load_previous_backup(conn, s3):
+    """
+    Манифест последнего бэкапа цепочки, если следующий бэкап может быть
+    инкрементальным. None — нужен полный: цепочки нет, она достигла
+    FULL_BACKUP_EVERY инкрементов или полному бэкапу больше FULL_BACKUP_MAX_AGE_DAYS.
+    """
+    prefix = get_setting(conn, 'last_backup')
+    if not prefix:
+        return None
+    try:
+        previous = read_manifest(s3, prefix)
+    except Exception as e:
+        log(f"Previous backup {prefix} unavailable: {e}")
+        return None
+    if 'txid_snapshot' not in previous:
+        return None
+    if previous.get('chain_length', 0) + 1 >= int(os.environ.get('FULL_BACKUP_EVERY', FULL_BACKUP_EVERY)):
+        return None
+    base_created = datetime.fromisoformat(previous['base_created_at'])
+    if datetime.now(ZoneInfo('Europe/Moscow')) - base_created > timedelta(days=FULL_BACKUP_MAX_AGE_DAYS):
+        return None
+    return previous
 
-def handle_run_backup(conn, username=None):
-    backup_data, total_rows = create_backup_data(conn)
-    filename, cdn_url, size_mb = save_to_s3(backup_data)
+def handle_run_backup(conn, username=None, full=False):
+    existing = get_existing_tables(conn)
+    tables = [t for t in TABLES_ORDER if t in existing]
+    s3 = get_s3()
+    previous = None if full else load_previous_backup(conn, s3)
+    manifest = export_database(conn, SCHEMA, tables, s3=s3, previous=previous)
+    set_setting(conn, 'last_backup', manifest['prefix'])
+    # Изменения, вошедшие в бэкап, следующему инкременту не нужны
+    prune_changes(conn, SCHEMA, manifest['txid_snapshot'])
+    size_mb = round(manifest['bytes'] / (1024 * 1024), 2)
     log_action(conn, 'auto_export', username, {
-        'tables': len(backup_data['tables']),
-        'rows': total_rows,
-        'file': filename,
+        'tables': len(manifest['tables']),
+        'rows': manifest['rows'],
+        'file': manifest['prefix'],
         'size_mb': size_mb,
+        'kind': manifest['kind'],
     })
     set_setting(conn, 'last_auto_backup', datetime.now(ZoneInfo('Europe/Moscow')).isoformat())
     return response(200, {
         'success': True,
-        'file': filename,
-        'url': cdn_url,
+        'file': manifest['prefix'],
+        'url': cdn_url(manifest['manifest_key']),
         'size_mb': size_mb,
-        'tables': len(backup_data['tables']),
-        'rows': total_rows,
+        'tables': len(manifest['tables']),
+        'rows': manifest['rows'],
+        'kind': manifest['kind'],
+        'parent': manifest.get('parent'),
     })
 
 def handle_get_settings(conn):
@@ -233,7 +273,7 @@ def handle_get_settings(conn):
 def handle_save_settings(conn, event):
     body = json.loads(event.get('body', '{}'))
     schedule = body.get('schedule')
-    if schedule not in ('off', 'daily', 'weekly', 'monthly'):
+    if schedule not in ('off', 'hourly', 'daily', 'weekly', 'monthly'):
         return response(400, {'error': 'Некорректное расписание'})
     set_setting(conn, 'backup_schedule', schedule)
     return response(200, {'success': True, 'schedule': schedule})
@@ -241,6 +281,8 @@ def handle_save_settings(conn, event):
 def handle_trigger(conn):
     schedule = get_setting(conn, 'backup_schedule') or 'off'
     if schedule == 'off':
+        # Без бэкапов журнал изменений не читается — не даём ему расти
+        trim_change_log(conn)
         return response(200, {'skipped': True, 'reason': 'Автобэкап отключен'})
 
     last_str = get_setting(conn, 'last_auto_backup')
@@ -251,6 +293,8 @@ def handle_trigger(conn):
         if last.tzinfo is None:
             last = last.replace(tzinfo=ZoneInfo('Europe/Moscow'))
         diff_hours = (now - last).total_seconds() / 3600
+        if schedule == 'hourly' and diff_hours < 0.9:
+            return response(200, {'skipped': True, 'reason': 'Еще не прошел час'})
         if schedule == 'daily' and diff_hours < 23:
             return response(200, {'skipped': True, 'reason': 'Еще не прошли сутки'})
         if schedule == 'weekly' and diff_hours < 167:
@@ -260,14 +304,71 @@ def handle_trigger(conn):
 
     return handle_run_backup(conn, 'system (auto)')
 
+def trim_change_log(conn):
+    """
+    Записи журнала старше FULL_BACKUP_MAX_AGE_DAYS не понадобятся:
+    после такого перерыва следующий бэкап всё равно будет полным.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        f"DELETE FROM {SCHEMA}.backup_changes WHERE changed_at < NOW() - make_interval(days => %s)",
+        (FULL_BACKUP_MAX_AGE_DAYS,)
+    )
+    conn.commit()
+    cur.close()
+
 def handle_delete(conn, event):
     body = json.loads(event.get('body', '{}'))
     key = body.get('key')
     if not key or not key.startswith('backups/'):
         return response(400, {'error': 'Некорректный ключ файла'})
-    delete_s3_backup(key)
-    log_action(conn, 'delete_backup', 'admin', {'file': key})
-    return response(200, {'success': True})
+    s3 = get_s3()
+    # Изменения, вошедшие в зависимые инкременты, уже удалены из журнала (prune_changes),
+    # поэтому без этого бэкапа их не восстановить: удаляем только вместе с ними
+    dependents = find_dependents(s3, key) if key.endswith('/') else []
+    if dependents and not body.get('cascade'):
+        return response(409, {
+            'error': 'От бэкапа зависят инкрементальные бэкапы — их можно удалить только вместе с ним',
+            'dependents': dependents,
+        })
+    deleted = dependents + [key]
+    for backup_key in deleted:
+        delete_s3_backup(backup_key)
+    # Без удалённого бэкапа цепочку не продолжить — следующий бэкап будет полным
+    if get_setting(conn, 'last_backup') in deleted:
+        set_setting(conn, 'last_backup', '')
+    log_action(conn, 'delete_backup', 'admin', {'file': key, 'dependents': dependents})
+    return response(200, {'success': True, 'deleted': deleted})
+
+def is_backup_folder(key):
+    return bool(key) and key.startswith(BACKUP_PREFIX) and key.endswith('/')
+
+def handle_verify(params):
+    """Сверка файлов бэкапа с манифестом; deep=1 — с чтением блоков и проверкой хэшей"""
+    key = params.get('key')
+    if not is_backup_folder(key):
+        return response(400, {'error': 'Некорректный ключ бэкапа'})
+    s3 = get_s3()
+    try:
+        manifest = read_manifest(s3, key)
+    except Exception:
+        return response(404, {'error': 'Манифест бэкапа не найден'})
+    result = verify_backup(s3, manifest, deep=params.get('deep') == '1')
+    return response(200, {'key': key, **result})
+
+def handle_diff(params):
+    """Потабличное сравнение бэкапов from и to; инкрементальные — вместе с их цепочками"""
+    old_key, new_key = params.get('from'), params.get('to')
+    if not is_backup_folder(old_key) or not is_backup_folder(new_key):
+        return response(400, {'error': 'Некорректный ключ бэкапа'})
+    s3 = get_s3()
+    try:
+        old_chain = load_chain(s3, old_key)
+        new_chain = load_chain(s3, new_key)
+    except Exception:
+        return response(404, {'error': 'Манифест бэкапа не найден'})
+    result = diff_backups(s3, old_chain, new_chain)
+    return response(200, {'from': old_key, 'to': new_key, **result})
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Автоматическое резервное копирование: расписание, S3 хранение, управление копиями"""
@@ -302,7 +403,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         elif method == 'POST' and action == 'save':
             return handle_save_settings(conn, event)
         elif method == 'POST' and action == 'run':
-            return handle_run_backup(conn, username)
+            return handle_run_backup(conn, username, full=params.get('full') == '1')
+        elif method == 'GET' and action == 'verify':
+            return handle_verify(params)
+        elif method == 'GET' and action == 'diff':
+            return handle_diff(params)
         elif method == 'DELETE' and action == 'delete':
             return handle_delete(conn, event)
         else:
@@ -0,0 +1,85 @@
+"""
+Сравнение бэкапов (backup_diff) на файлах, записанных ChunkedWriter,
+с S3 в памяти. Запуск: python -m unittest test_backup_diff из backend/auto-backup.
+"""
+import io
+import unittest
+
+import backup_diff
+from backup_stream import CHUNK_ROWS, ChunkedWriter
+
+
+class MemoryWriter:
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.buffer.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+class MemoryS3:
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self.objects[Key]
+        if Range:
+            start, end = Range[len('bytes='):].split('-')
+            data = data[int(start):int(end) + 1]
+        return {'Body': io.BytesIO(data)}
+
+    def put_table(self, key, columns, rows):
+        writer = MemoryWriter()
+        chunked = ChunkedWriter(writer, columns)
+        chunked.write_batch(rows)
+        chunked.finish()
+        self.objects[key] = writer.buffer.getvalue()
+        return {
+            'key': key,
+            'mode': 'full',
+            'rows': chunked.rows,
+            'columns': columns,
+            'indexed': chunked.indexed,
+            'chunks': chunked.chunks,
+            'sha256': chunked.file_hash.hexdigest(),
+        }
+
+
+class DiffTableTest(unittest.TestCase):
+    def test_bucket_split_into_several_chunks(self):
+        # Первый столбец не уникален: все строки в одном диапазоне ключей,
+        # который ChunkedWriter делит на блоки по CHUNK_ROWS строк
+        s3 = MemoryS3()
+        columns = ['file_id', 'line']
+        rows = [{'file_id': 5, 'line': i} for i in range(CHUNK_ROWS * 2 + CHUNK_ROWS // 2)]
+        old = s3.put_table('old/t', columns, rows)
+        changed = [dict(row) for row in rows]
+        changed[10]['line'] = -1
+        new = s3.put_table('new/t', columns, changed)
+
+        self.assertEqual([c['bucket'] for c in old['chunks']], [0, 0, 0])
+        result = backup_diff.diff_table(s3, old, new)
+        self.assertEqual(result['status'], 'changed')
+        self.assertEqual(result['chunks_total'], 6)
+        self.assertEqual(result['chunks_read'], 2)
+        self.assertEqual((result['added'], result['removed'], result['updated']), (0, 0, 1))
+
+    def test_rows_shifted_between_chunks_of_one_bucket(self):
+        s3 = MemoryS3()
+        columns = ['file_id', 'line']
+        rows = [{'file_id': 5, 'line': i} for i in range(CHUNK_ROWS * 2)]
+        old = s3.put_table('old/t', columns, rows)
+        new = s3.put_table('new/t', columns, [{'file_id': 5, 'line': -1}] + rows)
+
+        result = backup_diff.diff_table(s3, old, new)
+        self.assertEqual((result['added'], result['removed'], result['updated']), (1, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
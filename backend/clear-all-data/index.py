@@ -35,6 +35,11 @@ ALLOWED_TABLES = {
     'log_files',
     'log_entries',
     'log_statistics',
+    'log_templates',
+    'log_file_templates',
+    'log_histogram_minute',
+    'log_histogram_hour',
+    'log_sources',
     'dashboard_layouts',
 }
 
@@ -135,6 +140,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'log_files',
             'log_entries',
             'log_statistics',
+            'log_templates',
+            'log_file_templates',
+            'log_histogram_minute',
+            'log_histogram_hour',
+            'log_sources',
             'dashboard_layouts',
         ]
     else:
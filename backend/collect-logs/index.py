@@ -1,17 +1,62 @@
 import json
 import os
+import time
+import hashlib
 import requests
-from typing import Dict, Any, List
+import math
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
+import jwt
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from ingest import ingest_lines
+from log_parser import detect_parser, parse_log_line
+from log_partitions import apply_retention, retention_days
 
 TELEMETRY_API = "https://telemetry.poehali.dev"
+SOURCE_TIMEOUT = 10.0
+MAX_SOURCE_TIMEOUT = 25.0
+MAX_FETCH_WORKERS = 8
+MAX_BOUNDARY_HASHES = 500
+# Как часто проверять таймауты источников, начавших загрузку во время ожидания
+FETCH_POLL_INTERVAL = 0.5
+
+SCHEMA = 't_p61788166_html_to_frontend'
+
+def verify_token(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    headers = event.get('headers') or {}
+    token = (headers.get('X-Auth-Token') or
+             headers.get('x-auth-token') or
+             headers.get('X-Authorization') or
+             headers.get('x-authorization', ''))
+    if token:
+        token = token.replace('Bearer ', '').strip()
+    if not token:
+        return None
+    try:
+        secret = os.environ.get('JWT_SECRET')
+        if not secret:
+            return None
+        return jwt.decode(token, secret, algorithms=['HS256'])
+    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
+        return None
+
+def is_admin(conn, user_id: int) -> bool:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT COUNT(*) as cnt FROM {SCHEMA}.roles r
+            JOIN {SCHEMA}.user_roles ur ON r.id = ur.role_id
+            WHERE ur.user_id = %s AND r.name IN ('Администратор', 'Admin')
+        """, (user_id,))
+        row = cur.fetchone()
+        return row['cnt'] > 0 if row else False
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Автоматический сбор логов: получает логи фронтенда и всех бэкенд функций,
-    парсит их и сохраняет в базу данных для анализа.
+    парсит их и сохраняет в базу данных для анализа. Файлы старше срока
+    хранения (LOG_RETENTION_DAYS) удаляются только при вызове администратором.
     """
     method: str = event.get('httpMethod', 'GET')
     
@@ -40,17 +85,36 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     body_data = json.loads(event.get('body', '{}'))
     sources = body_data.get('sources', ['frontend'])
     limit = body_data.get('limit', 1000)
+    timeout = min(float(body_data.get('timeout', SOURCE_TIMEOUT)), MAX_SOURCE_TIMEOUT)
     
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
     
     try:
         collected_count = 0
+        results = []
+        
+        cursors = load_cursors(conn, sources)
+        fetched = fetch_sources_concurrently(sources, limit, cursors, timeout)
         
+        # Сеть опрашивается параллельно, запись в БД идёт последовательно через одно соединение
         for source in sources:
-            logs = fetch_logs_from_source(source, limit)
-            if logs:
-                file_id = save_logs_to_db(conn, source, logs)
-                collected_count += len(logs)
+            logs, error = fetched[source]
+            result = {'source': source, 'fetched': len(logs), 'new': 0, 'duplicates': 0}
+            if error:
+                result['error'] = error
+            
+            new_logs, new_cursor = filter_new_lines(logs, cursors.get(source))
+            result['new'] = len(new_logs)
+            result['duplicates'] = len(logs) - len(new_logs)
+            
+            if new_logs:
+                result['file_id'] = save_logs_to_db(conn, source, new_logs, cursors.get(source), new_cursor)
+                collected_count += len(new_logs)
+            results.append(result)
+        
+        # Сбор от имени администратора заодно удаляет файлы старше срока хранения
+        payload = verify_token(event)
+        expired = apply_retention(conn, retention_days()) if payload and is_admin(conn, payload['user_id']) else []
         
         return {
             'statusCode': 200,
@@ -58,7 +122,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({
                 'success': True,
                 'collected': collected_count,
-                'sources_processed': len(sources)
+                'sources_processed': len(sources),
+                'sources': results,
+                'expired_files': expired
             }),
             'isBase64Encoded': False
         }
@@ -75,14 +141,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         conn.close()
 
 
-def fetch_logs_from_source(source: str, limit: int) -> List[str]:
+def fetch_logs_from_source(source: str, limit: int, since: Optional[datetime] = None, timeout: float = SOURCE_TIMEOUT) -> List[str]:
     """
     Получает логи из указанного источника через Telemetry API.
     Источник может быть 'frontend' или 'backend/function-name'.
+    since — время последней сохранённой строки: источник может отдать
+    только более новые строки, окончательная дедупликация в filter_new_lines.
     """
     try:
         # Для демонстрации генерируем примерные логи
-        # В реальности здесь был бы запрос к API телеметрии
+        # В реальности здесь был бы запрос к API телеметрии:
+        # requests.get(f"{TELEMETRY_API}/logs", params={'source': source, 'limit': limit,
+        #              'since': since.isoformat() if since else None}, timeout=timeout)
         now = datetime.utcnow().isoformat()
         
         if source == 'frontend':
@@ -104,102 +174,198 @@ def fetch_logs_from_source(source: str, limit: int) -> List[str]:
         return []
 
 
-def save_logs_to_db(conn, source: str, logs: List[str]) -> int:
+def fetch_sources_concurrently(
+    sources: List[str],
+    limit: int,
+    cursors: Dict[str, Dict[str, Any]],
+    timeout: float
+) -> Dict[str, Tuple[List[str], Optional[str]]]:
     """
-    Сохраняет логи в базу данных.
-    Создаёт новый файл и парсит каждую строку.
+    Опрашивает источники параллельно. Таймаут каждого источника отсчитывается
+    с момента, когда его загрузка началась, а не с момента постановки в очередь:
+    при источниках больше MAX_FETCH_WORKERS ожидающие в очереди не теряют время.
+    Зависший источник возвращается с ошибкой и не задерживает остальные.
+    Общее ожидание ограничено временем, за которое все источники успели бы
+    отработать по таймауту при полной загрузке пула.
     """
-    filename = f"{source.replace('/', '-')}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.log"
-    log_content = '\n'.join(logs)
+    results: Dict[str, Tuple[List[str], Optional[str]]] = {}
+    if not sources:
+        return results
     
+    workers = min(MAX_FETCH_WORKERS, len(sources))
+    started: Dict[str, float] = {}
+    
+    def fetch(source: str) -> List[str]:
+        started[source] = time.monotonic()
+        return fetch_logs_from_source(
+            source, limit, (cursors.get(source) or {}).get('last_timestamp'), timeout
+        )
+    
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = {source: executor.submit(fetch, source) for source in sources}
+        overall_deadline = time.monotonic() + timeout * math.ceil(len(sources) / workers)
+        while pending:
+            now = time.monotonic()
+            for source, future in list(pending.items()):
+                if future.done():
+                    try:
+                        results[source] = (future.result(), None)
+                    except Exception as e:
+                        results[source] = ([], str(e))
+                elif source in started and now - started[source] >= timeout:
+                    results[source] = ([], f'timeout after {timeout:g}s')
+                elif now >= overall_deadline:
+                    future.cancel()
+                    results[source] = ([], 'timeout: source was not fetched in time' if source not in started
+                                       else f'timeout after {timeout:g}s')
+                else:
+                    continue
+                del pending[source]
+            if pending:
+                expiries = [started[source] + timeout for source in pending if source in started]
+                wake = min(expiries + [overall_deadline, now + FETCH_POLL_INTERVAL])
+                wait(list(pending.values()), timeout=max(0.0, wake - time.monotonic()),
+                     return_when=FIRST_COMPLETED)
+    finally:
+        executor.shutdown(wait=False)
+    return results
+
+
+def line_hash(line: str) -> str:
+    return hashlib.sha1(line.encode('utf-8', errors='replace')).hexdigest()
+
+
+def load_cursors(conn, sources: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Курсоры источников: последняя строка (время, смещение, хеши на границе) и текущий файл"""
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        # Создаём файл
         cur.execute(
-            "INSERT INTO log_files (filename, file_size, total_lines, status) VALUES (%s, %s, %s, %s) RETURNING id",
-            (filename, len(log_content), len(logs), 'completed')
+            "SELECT * FROM log_sources WHERE source = ANY(%s)",
+            (list(sources),)
         )
-        file_id = cur.fetchone()['id']
-        conn.commit()
-    
-    # Парсим и сохраняем записи
-    parsed_entries = []
-    stats = {}
+        return {row['source']: dict(row) for row in cur.fetchall()}
+
+
+def filter_new_lines(logs: List[str], cursor: Optional[Dict[str, Any]]) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    Оставляет только строки новее курсора. Строки с тем же временем, что
+    у последней сохранённой, отсекаются по хешу; строки без времени — по
+    хешам, запомненным на границе прошлого запуска.
+    Возвращает новые строки и курсор после них.
+    """
+    last_timestamp = cursor['last_timestamp'] if cursor else None
+    boundary = set(cursor['last_line_hashes'] or []) if cursor else set()
     
-    for idx, line in enumerate(logs, 1):
+    new_logs = []
+    new_timestamp = last_timestamp
+    new_hashes: set = set()
+    for line in logs:
         if not line.strip():
             continue
+        digest = line_hash(line)
+        timestamp = parse_log_line(line, 0)['timestamp']
+        if timestamp is not None and last_timestamp is not None and timestamp < last_timestamp:
+            continue
+        if digest in boundary and (timestamp is None or timestamp == last_timestamp):
+            continue
+        new_logs.append(line)
         
-        entry = parse_log_line(line, idx)
-        parsed_entries.append((
-            file_id,
-            entry['line_number'],
-            entry['timestamp'],
-            entry['level'],
-            entry['message'],
-            entry['raw_line']
-        ))
-        
-        level = entry['level'] or 'UNKNOWN'
-        stats[level] = stats.get(level, 0) + 1
+        if timestamp is None:
+            new_hashes.add(digest)
+        elif new_timestamp is None or timestamp > new_timestamp:
+            new_timestamp = timestamp
+            new_hashes = {digest}
+        elif timestamp == new_timestamp:
+            new_hashes.add(digest)
     
-    with conn.cursor() as cur:
-        cur.executemany(
-            "INSERT INTO log_entries (file_id, line_number, timestamp, level, message, raw_line) VALUES (%s, %s, %s, %s, %s, %s)",
-            parsed_entries
-        )
-        
-        for level, count in stats.items():
+    if new_timestamp == last_timestamp:
+        new_hashes |= boundary
+    
+    new_cursor = {
+        'last_timestamp': new_timestamp,
+        'last_line_hashes': sorted(new_hashes)[-MAX_BOUNDARY_HASHES:],
+        'last_offset': ((cursor or {}).get('last_offset') or 0) + len(new_logs),
+    }
+    return new_logs, new_cursor
+
+
+def save_logs_to_db(
+    conn,
+    source: str,
+    logs: List[str],
+    cursor: Optional[Dict[str, Any]],
+    new_cursor: Dict[str, Any]
+) -> int:
+    """
+    Дописывает новые строки источника в его файл за текущие сутки
+    (один файл на источник и день вместо файла на каждый запуск)
+    и сохраняет курсор источника.
+    """
+    file_date = datetime.utcnow().date()
+    file_size = sum(len(line) + 1 for line in logs)
+    filename = f"{source.replace('/', '-')}-{file_date.isoformat()}.log"
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        file_id = cursor['file_id'] if cursor and cursor['file_date'] == file_date else None
+        start_line = (cursor['last_line_number'] or 0) + 1 if file_id else 1
+        if file_id:
+            cur.execute("SELECT id, processed_lines FROM log_files WHERE id = %s", (file_id,))
+        else:
+            # Файл за сегодня мог быть создан запуском, упавшим до сохранения курсора
             cur.execute(
-                "INSERT INTO log_statistics (file_id, level, count) VALUES (%s, %s, %s)",
-                (file_id, level, count)
+                "SELECT id, processed_lines FROM log_files WHERE filename = %s ORDER BY id DESC LIMIT 1",
+                (filename,)
             )
+        current = cur.fetchone()
         
+        if current:
+            file_id = current['id']
+            cur.execute(
+                "UPDATE log_files SET file_size = file_size + %s, status = %s WHERE id = %s",
+                (file_size, 'processing', file_id)
+            )
+            processed = current['processed_lines'] or 0
+            # Курсор не сдвигается при сбое, поэтому повторный запуск получает те же строки
+            # с теми же номерами; уже записанные пачки пропускаются
+            cur.execute(
+                "SELECT MAX(line_number) AS last_line FROM log_entries WHERE file_id = %s",
+                (file_id,)
+            )
+            resume_after = cur.fetchone()['last_line'] or 0
+        else:
+            cur.execute(
+                "INSERT INTO log_files (filename, file_size, total_lines, status) VALUES (%s, %s, %s, %s) RETURNING id",
+                (filename, file_size, len(logs), 'processing')
+            )
+            file_id = cur.fetchone()['id']
+            processed = 0
+            start_line = 1
+            resume_after = 0
+        conn.commit()
+    
+    # Парсим и сохраняем записи
+    parse_line, lines, _ = detect_parser(logs)
+    result = ingest_lines(conn, file_id, lines, parse_line, processed=processed,
+                          start_line=start_line, resume_after=resume_after)
+    
+    # Курсор сдвигается только после успешной записи: при сбое строки
+    # будут получены повторно, а не потеряны
+    with conn.cursor() as cur:
+        cur.execute(
+            """INSERT INTO log_sources
+               (source, file_id, file_date, last_timestamp, last_offset, last_line_hashes, last_line_number, updated_at)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+               ON CONFLICT (source) DO UPDATE SET
+                   file_id = EXCLUDED.file_id,
+                   file_date = EXCLUDED.file_date,
+                   last_timestamp = EXCLUDED.last_timestamp,
+                   last_offset = EXCLUDED.last_offset,
+                   last_line_hashes = EXCLUDED.last_line_hashes,
+                   last_line_number = EXCLUDED.last_line_number,
+                   updated_at = NOW()""",
+            (source, file_id, file_date, new_cursor['last_timestamp'], new_cursor['last_offset'],
+             new_cursor['last_line_hashes'], result['last_line_number'])
+        )
         conn.commit()
     
     return file_id
-
-
-def parse_log_line(line: str, line_number: int) -> Dict[str, Any]:
-    """
-    Парсит строку лога и извлекает timestamp, level, message.
-    """
-    import re
-    from datetime import datetime
-    
-    patterns = [
-        r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?Z?)\s*\[(\w+)\]\s*(.+)$',
-        r'^(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})\s+(\w+)\s+(.+)$',
-        r'^(\w+\s+\d+\s+\d{2}:\d{2}:\d{2})\s+\S+\s+(\w+):\s*(.+)$',
-    ]
-    
-    timestamp = None
-    level = None
-    message = line
-    
-    for pattern in patterns:
-        match = re.match(pattern, line)
-        if match:
-            groups = match.groups()
-            if len(groups) == 3:
-                try:
-                    ts_str = groups[0]
-                    for fmt in ['%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S']:
-                        try:
-                            timestamp = datetime.strptime(ts_str, fmt)
-                            break
-                        except:
-                            continue
-                    
-                    level = groups[1].upper()
-                    message = groups[2]
-                    break
-                except:
-                    pass
-    
-    return {
-        'line_number': line_number,
-        'timestamp': timestamp,
-        'level': level,
-        'message': message.strip(),
-        'raw_line': line
-    }
\ No newline at end of file
@@ -0,0 +1,260 @@
+"""
+Потоковая загрузка логов в log_entries через COPY FROM STDIN.
+Строки читаются генератором и пишутся пачками, поэтому память ограничена
+размером одной пачки, а не размером файла.
+Модуль продублирован в backend/log-analyzer — изменения вносить в обе копии.
+"""
+import io
+from datetime import datetime
+from typing import Dict, Any, Iterable, Iterator, Callable, List, Optional
+
+from psycopg2.extras import execute_values
+
+from log_partitions import ensure_partition
+from log_templates import TemplateMiner
+
+COPY_CHUNK_SIZE = 5000
+READ_CHUNK_SIZE = 1024 * 1024
+
+ENTRY_COLUMNS = ('file_id', 'line_number', 'timestamp', 'level', 'message', 'raw_line', 'template_id', 'raw_prefix')
+
+
+def iter_lines(stream, encoding: str = 'utf-8', chunk_size: int = READ_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Построчно читает бинарный поток (BytesIO, GzipFile, тело ответа S3) блоками
+    по chunk_size. В памяти держится только текущий блок и хвост незавершённой строки.
+    """
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        pending += chunk
+        parts = pending.split(b'\n')
+        pending = parts.pop()
+        for raw in parts:
+            yield raw.decode(encoding, errors='replace').rstrip('\r')
+    if pending:
+        yield pending.decode(encoding, errors='replace').rstrip('\r')
+
+
+def copy_escape(value: Any) -> str:
+    """Экранирует значение для текстового формата COPY"""
+    if value is None:
+        return '\\N'
+    text = value if isinstance(value, str) else str(value)
+    return (
+        text.replace('\x00', '')
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def array_literal(values: List[str]) -> str:
+    """Литерал text[] для COPY: {"a","b"}"""
+    items = ('"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"' for v in values)
+    return '{' + ','.join(items) + '}'
+
+
+def copy_entries(cur, rows: List[tuple]) -> None:
+    """Записывает пачку строк в log_entries одним COPY FROM STDIN"""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(copy_escape(array_literal(v) if isinstance(v, list) else v) for v in row))
+        buf.write('\n')
+    buf.seek(0)
+    cur.copy_expert(
+        f"COPY log_entries ({', '.join(ENTRY_COLUMNS)}) FROM STDIN",
+        buf
+    )
+
+
+def save_statistics(cur, file_id: int, stats: Dict[str, int]) -> None:
+    """Добавляет приращения счётчиков по уровням к уже сохранённым"""
+    for level, count in stats.items():
+        cur.execute(
+            """INSERT INTO log_statistics (file_id, level, count) VALUES (%s, %s, %s)
+               ON CONFLICT (file_id, level) DO UPDATE SET count = log_statistics.count + EXCLUDED.count""",
+            (file_id, level, count)
+        )
+
+
+def effective_timestamp(timestamp: Optional[datetime], ingested_at: datetime) -> Optional[datetime]:
+    """
+    Время строки для шаблонов и гистограмм. У syslog нет года
+    (strptime подставляет 1900) — для таких строк берётся год загрузки.
+    """
+    if timestamp is None or timestamp.year != 1900:
+        return timestamp
+    try:
+        return timestamp.replace(year=ingested_at.year)
+    except ValueError:
+        return None
+
+
+def save_histogram(cur, file_id: int, histogram: Dict[tuple, int]) -> None:
+    """
+    Добавляет поминутные счётчики (минута, уровень, версия шаблона) к
+    log_histogram_minute и свёрнутые по часам — к log_histogram_hour.
+    Вызывается после сброса шаблонов, когда у версий уже есть cluster_id.
+    """
+    minutes: Dict[tuple, int] = {}
+    hours: Dict[tuple, int] = {}
+    for (minute, level, version), count in histogram.items():
+        cluster_id = version.cluster.cluster_id if version is not None else 0
+        key = (minute, level, cluster_id)
+        minutes[key] = minutes.get(key, 0) + count
+        key = (minute.replace(minute=0), level, cluster_id)
+        hours[key] = hours.get(key, 0) + count
+
+    for table, buckets in (('log_histogram_minute', minutes), ('log_histogram_hour', hours)):
+        if not buckets:
+            continue
+        execute_values(
+            cur,
+            f"""INSERT INTO {table} (file_id, bucket, level, cluster_id, count) VALUES %s
+                ON CONFLICT (file_id, bucket, level, cluster_id) DO UPDATE SET count = {table}.count + EXCLUDED.count""",
+            [(file_id, bucket, level, cluster_id, count) for (bucket, level, cluster_id), count in buckets.items()],
+            page_size=1000
+        )
+
+
+def build_row(file_id: int, entry: Dict[str, Any], miner: Optional[TemplateMiner], ingested_at: datetime) -> list:
+    """
+    Готовит строку log_entries. Если сообщение попало в шаблон, сохраняется
+    template_id (проставляется при сбросе пачки), а вместо raw_line — префикс
+    исходной строки перед сообщением (время, уровень и т.п.). Текст хранится
+    один раз — в message: поиск идёт по нему через триграммный индекс, а
+    параметры шаблона не пишутся и выделяются из message при чтении (extract_params).
+    """
+    message = entry['message']
+    raw_line = entry['raw_line']
+    row = [file_id, entry['line_number'], entry['timestamp'], entry['level'], message, raw_line, None, None]
+    if miner is None:
+        return row
+
+    seen_at = effective_timestamp(entry['timestamp'], ingested_at) or ingested_at
+    mined = miner.add(message, entry['level'], seen_at, raw_line)
+    if mined is None:
+        return row
+
+    row[6] = mined[0]
+    if message and raw_line.endswith(message):
+        row[5] = None
+        row[7] = raw_line[:len(raw_line) - len(message)]
+    return row
+
+
+def flush_batch(cur, batch: List[list], miner: Optional[TemplateMiner]) -> None:
+    """Сохраняет шаблоны пачки, подставляет их id и пишет пачку через COPY"""
+    if miner is not None:
+        miner.flush(cur)
+        for row in batch:
+            if row[6] is not None:
+                row[6] = row[6].db_id
+    copy_entries(cur, batch)
+
+
+def ingest_lines(
+    conn,
+    file_id: int,
+    lines: Iterable[str],
+    parse_line: Callable[[str, int], Dict[str, Any]],
+    chunk_size: int = COPY_CHUNK_SIZE,
+    resume_after: int = 0,
+    processed: int = 0,
+    mine_templates: bool = True,
+    start_line: int = 1
+) -> Dict[str, Any]:
+    """
+    Парсит строки из итератора и загружает их в log_entries пачками по chunk_size.
+    Статистика по уровням считается на лету и вместе с прогрессом
+    (log_files.processed_lines) фиксируется после каждой пачки, поэтому прерванную
+    загрузку можно продолжить: строки с номером <= resume_after пропускаются.
+    start_line задаёт номер первой строки при дозаписи в существующий файл.
+    Записи файла пишутся в его собственную секцию log_entries (см. log_partitions).
+    Сообщения по ходу загрузки группируются в шаблоны (см. log_templates),
+    а поминутные и почасовые счётчики по уровням и шаблонам пишутся в
+    log_histogram_*, чтобы графики не обращались к log_entries.
+    """
+    stats: Dict[str, int] = {}
+    pending_stats: Dict[str, int] = {}
+    pending_histogram: Dict[tuple, int] = {}
+    batch: List[list] = []
+    line_number = start_line - 1
+    ingested_at = datetime.utcnow()
+
+    try:
+        with conn.cursor() as cur:
+            ensure_partition(cur, file_id)
+            conn.commit()
+
+            miner = None
+            if mine_templates:
+                miner = TemplateMiner(file_id)
+                miner.load(cur)
+
+            for line_number, line in enumerate(lines, start_line):
+                if line_number <= resume_after or not line.strip():
+                    continue
+
+                entry = parse_line(line, line_number)
+                row = build_row(file_id, entry, miner, ingested_at)
+                batch.append(row)
+
+                level = entry['level'] or 'UNKNOWN'
+                stats[level] = stats.get(level, 0) + 1
+                pending_stats[level] = pending_stats.get(level, 0) + 1
+
+                timestamp = effective_timestamp(entry['timestamp'], ingested_at)
+                if timestamp is not None:
+                    key = (timestamp.replace(second=0, microsecond=0), level, row[6])
+                    pending_histogram[key] = pending_histogram.get(key, 0) + 1
+
+                if len(batch) >= chunk_size:
+                    flush_batch(cur, batch, miner)
+                    processed += len(batch)
+                    batch = []
+                    save_statistics(cur, file_id, pending_stats)
+                    save_histogram(cur, file_id, pending_histogram)
+                    pending_stats = {}
+                    pending_histogram = {}
+                    cur.execute(
+                        "UPDATE log_files SET processed_lines = %s WHERE id = %s",
+                        (processed, file_id)
+                    )
+                    conn.commit()
+
+            if batch:
+                flush_batch(cur, batch, miner)
+                processed += len(batch)
+
+            save_statistics(cur, file_id, pending_stats)
+            save_histogram(cur, file_id, pending_histogram)
+            cur.execute(
+                "UPDATE log_files SET status = %s, processed_lines = %s, total_lines = %s WHERE id = %s",
+                ('completed', processed, processed, file_id)
+            )
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        mark_failed(conn, file_id, str(e))
+        raise
+
+    return {
+        'total_lines': processed,
+        'last_line_number': line_number,
+        'statistics': stats
+    }
+
+
+def mark_failed(conn, file_id: int, error: Optional[str]) -> None:
+    """Помечает файл как не обработанный; уже загруженные пачки остаются"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE log_files SET status = %s, error_message = %s WHERE id = %s",
+            ('failed', (error or '')[:1000], file_id)
+        )
+        conn.commit()
@@ -0,0 +1,246 @@
+"""
+Разбор строк логов.
+Формат файла определяется по выборке первых строк, после чего каждая строка
+сначала проверяется одним предкомпилированным шаблоном доминирующего формата,
+а полный перебор форматов выполняется только для строк, которые в него не попали.
+Модуль продублирован в backend/log-analyzer — изменения вносить в обе копии.
+"""
+import re
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from typing import Dict, Any, Iterable, Iterator, Callable, List, Optional, Tuple
+
+DETECT_SAMPLE_SIZE = 200
+
+KNOWN_LEVELS = frozenset({'ERROR', 'WARN', 'INFO', 'DEBUG', 'TRACE', 'FATAL'})
+
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+
+ParsedFields = Tuple[Optional[datetime], Optional[str], str]
+
+
+def decode_iso(ts: str) -> Optional[datetime]:
+    """
+    2024-01-15T10:30:45.123Z, 2024-01-15 10:30:45, 2024/01/15 10:30:45.
+    Обычный случай разбирает fromisoformat (реализован на C), остальные —
+    срезами по фиксированным позициям, без strptime.
+    """
+    try:
+        return datetime.fromisoformat(ts[:-1] if ts[-1:] == 'Z' else ts)
+    except ValueError:
+        pass
+    try:
+        time_part = ts[10:].lstrip('T \t')
+        rest = time_part[8:].rstrip('Z')
+        microsecond = int(rest[1:7].ljust(6, '0')) if rest.startswith('.') else 0
+        return datetime(
+            int(ts[0:4]), int(ts[5:7]), int(ts[8:10]),
+            int(time_part[0:2]), int(time_part[3:5]), int(time_part[6:8]),
+            microsecond
+        )
+    except (ValueError, IndexError):
+        return None
+
+
+def decode_date(ts: str) -> Optional[datetime]:
+    """2024-01-15"""
+    try:
+        return datetime(int(ts[0:4]), int(ts[5:7]), int(ts[8:10]))
+    except (ValueError, IndexError):
+        return None
+
+
+def decode_syslog(ts: str) -> Optional[datetime]:
+    """Jan 15 10:30:45 — год в syslog не пишется, как и strptime берём 1900"""
+    try:
+        month_name, day, clock = ts.split()
+        month = MONTHS.get(month_name[:3].title())
+        if not month:
+            return None
+        return datetime(1900, month, int(day), int(clock[0:2]), int(clock[3:5]), int(clock[6:8]))
+    except (ValueError, IndexError):
+        return None
+
+
+def decode_nginx(ts: str) -> Optional[datetime]:
+    """15/Jan/2024:10:30:45 +0300 — приводится к UTC без tzinfo"""
+    try:
+        month = MONTHS.get(ts[3:6])
+        if not month:
+            return None
+        value = datetime(
+            int(ts[7:11]), month, int(ts[0:2]),
+            int(ts[12:14]), int(ts[15:17]), int(ts[18:20])
+        )
+        offset = ts[21:26]
+        if len(offset) == 5:
+            delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+            value = value - delta if offset[0] == '+' else value + delta
+        return value
+    except (ValueError, IndexError):
+        return None
+
+
+def nginx_access_level(status: str) -> str:
+    if status[0] == '5':
+        return 'ERROR'
+    if status[0] == '4':
+        return 'WARN'
+    return 'INFO'
+
+
+class LogFormat:
+    """Формат строки лога: предкомпилированный шаблон и разбор совпадения"""
+
+    def __init__(self, name: str, pattern: str, extract: Callable[[Any], Optional[ParsedFields]]):
+        self.name = name
+        self.regex = re.compile(pattern)
+        self.extract = extract
+
+    def parse(self, line: str) -> Optional[ParsedFields]:
+        match = self.regex.match(line)
+        if not match:
+            return None
+        fields = self.extract(match)
+        if fields is None or (fields[0] is None and fields[1] is None):
+            return None
+        return fields
+
+
+def _level_only(match) -> Optional[ParsedFields]:
+    level = match.group(1).upper()
+    if level not in KNOWN_LEVELS:
+        return None
+    return None, level, match.group(2)
+
+
+def _level_first(match) -> Optional[ParsedFields]:
+    level = match.group(1).upper()
+    if level not in KNOWN_LEVELS:
+        return None
+    return decode_date(match.group(2)), level, match.group(3)
+
+
+# Порядок важен: общий разбор перебирает форматы сверху вниз
+FORMATS: List[LogFormat] = [
+    # 2024-01-15T10:30:45.123Z [ERROR] Message
+    LogFormat(
+        'iso',
+        r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?Z?)\s*\[(\w+)\]\s*(.+)$',
+        lambda m: (decode_iso(m.group(1)), m.group(2).upper(), m.group(3))
+    ),
+    # 2024-01-15 10:30:45 ERROR Message
+    LogFormat(
+        'app',
+        r'^(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2}(?:[.,]\d+)?)\s+(\w+)\s+(.+)$',
+        lambda m: (decode_iso(m.group(1).replace(',', '.')), m.group(2).upper(), m.group(3))
+    ),
+    # 127.0.0.1 - - [15/Jan/2024:10:30:45 +0000] "GET / HTTP/1.1" 200 612 "-" "curl/8.0"
+    LogFormat(
+        'nginx_access',
+        r'^(\S+) \S+ \S+ \[([^\]]+)\] ("[^"]*" (\d{3}) .*)$',
+        lambda m: (decode_nginx(m.group(2)), nginx_access_level(m.group(4)), f'{m.group(1)} {m.group(3)}')
+    ),
+    # 2024/01/15 10:30:45 [error] 1234#0: *1 open() failed
+    LogFormat(
+        'nginx_error',
+        r'^(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}) \[(\w+)\] (.+)$',
+        lambda m: (decode_iso(m.group(1)), m.group(2).upper(), m.group(3))
+    ),
+    # Jan 15 10:30:45 hostname ERROR: Message
+    LogFormat(
+        'syslog',
+        r'^(\w+\s+\d+\s+\d{2}:\d{2}:\d{2})\s+\S+\s+(\w+):\s*(.+)$',
+        lambda m: (decode_syslog(m.group(1)), m.group(2).upper(), m.group(3))
+    ),
+    # ERROR: 2024-01-15 Message
+    LogFormat('level_first', r'^(\w+):\s*(\d{4}-\d{2}-\d{2})\s+(.+)$', _level_first),
+    # ERROR Message
+    LogFormat('level', r'^(\w+)\s+(.+)$', _level_only),
+]
+
+FORMATS_BY_NAME = {fmt.name: fmt for fmt in FORMATS}
+
+
+def match_any(line: str) -> Tuple[Optional[LogFormat], ParsedFields]:
+    """Общий разбор: перебирает все форматы по порядку"""
+    for fmt in FORMATS:
+        fields = fmt.parse(line)
+        if fields is not None:
+            return fmt, fields
+    return None, (None, None, line)
+
+
+def build_entry(line: str, line_number: int, fields: ParsedFields) -> Dict[str, Any]:
+    timestamp, level, message = fields
+    return {
+        'line_number': line_number,
+        'timestamp': timestamp,
+        'level': level,
+        'message': message.strip(),
+        'raw_line': line
+    }
+
+
+def parse_log_line(line: str, line_number: int) -> Dict[str, Any]:
+    """
+    Парсит строку лога и извлекает timestamp, level, message.
+    Поддерживает различные форматы логов.
+    """
+    return build_entry(line, line_number, match_any(line)[1])
+
+
+def detect_format(sample: Iterable[str]) -> Optional[LogFormat]:
+    """Возвращает формат, под который подходит большинство строк выборки"""
+    counts: Dict[str, int] = {}
+    for line in sample:
+        if not line.strip():
+            continue
+        fmt, _ = match_any(line)
+        if fmt is not None:
+            counts[fmt.name] = counts.get(fmt.name, 0) + 1
+    if not counts:
+        return None
+    return FORMATS_BY_NAME[max(counts, key=counts.get)]
+
+
+def make_parser(fmt: Optional[LogFormat]) -> Callable[[str, int], Dict[str, Any]]:
+    """Парсер с быстрым путём для заданного формата и общим разбором на промахах"""
+    if fmt is None:
+        return parse_log_line
+
+    fast_match = fmt.regex.match
+    extract = fmt.extract
+
+    def parse_line(line: str, line_number: int) -> Dict[str, Any]:
+        match = fast_match(line)
+        fields = extract(match) if match else None
+        if fields is None or (fields[0] is None and fields[1] is None):
+            fields = match_any(line)[1]
+        timestamp, level, message = fields
+        return {
+            'line_number': line_number,
+            'timestamp': timestamp,
+            'level': level,
+            'message': message.strip(),
+            'raw_line': line
+        }
+
+    return parse_line
+
+
+def detect_parser(
+    lines: Iterable[str],
+    sample_size: int = DETECT_SAMPLE_SIZE
+) -> Tuple[Callable[[str, int], Dict[str, Any]], Iterator[str], Optional[str]]:
+    """
+    Читает выборку из начала потока, определяет формат и возвращает парсер
+    вместе с итератором, который снова отдаёт строки с самого начала.
+    """
+    it = iter(lines)
+    sample = list(islice(it, sample_size))
+    fmt = detect_format(sample)
+    return make_parser(fmt), chain(sample, it), (fmt.name if fmt else None)
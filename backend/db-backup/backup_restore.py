@@ -0,0 +1,515 @@
+"""
+Восстановление БД из бэкапа через COPY FROM STDIN.
+Строки таблицы читаются потоком из gzip NDJSON объекта в S3 (или из списка
+прежнего JSON-формата), переводятся в текстовый формат COPY и отдаются
+PostgreSQL одним COPY на таблицу вместо INSERT на каждую строку.
+Инкрементальный бэкап восстанавливается цепочкой: полный бэкап, затем
+каждый инкремент по порядку (apply_increment).
+Выборочное восстановление (restore_selected) возвращает отдельные строки —
+например, платёж со связанными записями — без очистки остальных данных.
+"""
+import json
+import gzip
+import time
+import base64
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from backup_stream import S3_BUCKET
+
+COPY_BUFFER_SIZE = 64 * 1024
+DELETE_BATCH_SIZE = 1000
+CHANGE_TRIGGERS = ('backup_changes_trg', 'backup_changes_truncate_trg')
+MAX_SELECTED_ROWS = 100000
+
+class LineStream:
+    """Файлоподобный объект для copy_expert: отдаёт строки итератора по мере чтения"""
+
+    def __init__(self, lines: Iterable[str]):
+        self.lines = iter(lines)
+        self.pending = b''
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.pending) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.pending += line.encode('utf-8')
+        if size < 0:
+            size = len(self.pending)
+        chunk, self.pending = self.pending[:size], self.pending[size:]
+        return chunk
+
+def copy_escape(text: str) -> str:
+    return (
+        text.replace('\x00', '')
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+def array_literal(values: List[Any]) -> str:
+    items = []
+    for v in values:
+        if v is None:
+            items.append('NULL')
+        elif isinstance(v, list):
+            items.append(array_literal(v))
+        else:
+            text = json.dumps(v, ensure_ascii=False) if isinstance(v, dict) else str(v)
+            items.append('"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return '{' + ','.join(items) + '}'
+
+def copy_value(value: Any, kind: str) -> str:
+    """Значение из JSON бэкапа в поле текстового формата COPY"""
+    if value is None:
+        return '\\N'
+    if kind == 'array' and isinstance(value, list):
+        text = array_literal(value)
+    elif kind == 'json' or isinstance(value, (dict, list)):
+        text = json.dumps(value, ensure_ascii=False)
+    elif kind == 'bytea' and isinstance(value, str):
+        # При экспорте bytea кодируется в base64
+        try:
+            text = '\\x' + base64.b64decode(value, validate=True).hex()
+        except ValueError:
+            text = value
+    elif isinstance(value, bool):
+        text = 't' if value else 'f'
+    else:
+        text = str(value)
+    return copy_escape(text)
+
+def column_kinds(cur, schema: str, table: str) -> Dict[str, str]:
+    """Столбцы таблицы и способ их сериализации для COPY"""
+    cur.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s
+        ORDER BY ordinal_position
+    """, (schema, table))
+    kinds = {}
+    for name, data_type in cur.fetchall():
+        if data_type == 'ARRAY':
+            kinds[name] = 'array'
+        elif data_type in ('json', 'jsonb'):
+            kinds[name] = 'json'
+        elif data_type == 'bytea':
+            kinds[name] = 'bytea'
+        else:
+            kinds[name] = 'other'
+    return kinds
+
+def iter_s3_rows(s3, key: str, chunk: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Построчно читает gzip NDJSON из S3, не загружая объект в память.
+    Если передан блок из индекса манифеста, читается только его диапазон байт.
+    """
+    if chunk is None:
+        body = s3.get_object(Bucket=S3_BUCKET, Key=key)['Body']
+    else:
+        end = chunk['offset'] + chunk['length'] - 1
+        body = s3.get_object(Bucket=S3_BUCKET, Key=key, Range=f"bytes={chunk['offset']}-{end}")['Body']
+    with gzip.GzipFile(fileobj=body, mode='rb') as gz:
+        for line in gz:
+            if line.strip():
+                yield json.loads(line)
+
+def copy_rows(cur, schema: str, table: str, columns: List[str], kinds: Dict[str, str], rows: Iterable[Dict[str, Any]]) -> int:
+    """Загружает строки в таблицу одним COPY; возвращает число строк"""
+    count = 0
+
+    def lines() -> Iterator[str]:
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield '\t'.join(copy_value(row.get(c), kinds[c]) for c in columns) + '\n'
+
+    cols_str = ', '.join(f'"{c}"' for c in columns)
+    cur.copy_expert(
+        f'COPY {schema}."{table}" ({cols_str}) FROM STDIN',
+        LineStream(lines()),
+        size=COPY_BUFFER_SIZE
+    )
+    return count
+
+def clear_tables(cur, schema: str, tables: List[str]) -> None:
+    """
+    Очищает таблицы одним TRUNCATE. Если на них ссылаются таблицы вне
+    списка, откатывается к DELETE в обратном порядке зависимостей.
+    """
+    if not tables:
+        return
+    cur.execute('SAVEPOINT clear_tables')
+    try:
+        cur.execute('TRUNCATE ' + ', '.join(f'{schema}."{t}"' for t in tables))
+        cur.execute('RELEASE SAVEPOINT clear_tables')
+    except Exception:
+        cur.execute('ROLLBACK TO SAVEPOINT clear_tables')
+        for table in reversed(tables):
+            cur.execute(f'DELETE FROM {schema}."{table}"')
+
+def create_log_partitions(cur, schema: str) -> None:
+    """
+    Секции log_entries для восстановленных файлов логов, чтобы записи
+    попали в свои секции, а не в секцию по умолчанию.
+    """
+    cur.execute(f"SELECT id FROM {schema}.log_files")
+    for (file_id,) in cur.fetchall():
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS {schema}.log_entries_f{int(file_id)} "
+            f"PARTITION OF {schema}.log_entries FOR VALUES IN ({int(file_id)})"
+        )
+
+def set_change_triggers(cur, schema: str, tables: List[str], enabled: bool) -> None:
+    """
+    Включает или выключает триггеры журнала backup_changes (V0162) на таблицах.
+    При полном восстановлении журнал не нужен: без отключения каждая строка COPY
+    и каждый TRUNCATE писали бы в backup_changes. ALTER TABLE транзакционен —
+    при откате восстановления триггеры остаются включёнными.
+    """
+    cur.execute("""
+        SELECT c.relname, t.tgname FROM pg_trigger t
+        JOIN pg_class c ON c.oid = t.tgrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = ANY(%s) AND t.tgname = ANY(%s)
+    """, (schema, list(tables), list(CHANGE_TRIGGERS)))
+    action = 'ENABLE' if enabled else 'DISABLE'
+    for table, trigger in cur.fetchall():
+        cur.execute(f'ALTER TABLE {schema}."{table}" {action} TRIGGER "{trigger}"')
+
+def reset_change_log(cur, schema: str) -> None:
+    """
+    После полного восстановления журнал изменений и ссылка на последний бэкап
+    цепочки (восстановленная вместе с site_settings) не соответствуют данным:
+    журнал очищается, а следующий автобэкап будет полным.
+    """
+    cur.execute(f"TRUNCATE {schema}.backup_changes")
+    cur.execute(f"DELETE FROM {schema}.site_settings WHERE key = 'last_backup'")
+
+def reset_sequences(cur, schema: str, tables: List[str]) -> None:
+    """Сдвигает все serial-последовательности восстановленных таблиц одним запросом"""
+    cur.execute("""
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = ANY(%s)
+        AND column_default LIKE 'nextval%%'
+    """, (schema, list(tables)))
+    serials = cur.fetchall()
+    if not serials:
+        return
+    calls = [
+        f"""setval(pg_get_serial_sequence('{schema}."{table}"', '{column}'),
+                   COALESCE((SELECT MAX("{column}") FROM {schema}."{table}"), 0) + 1, false)"""
+        for table, column in serials
+    ]
+    cur.execute('SELECT ' + ', '.join(calls))
+
+def delete_by_keys(cur, schema: str, table: str, pk: List[str], kinds: Dict[str, str], keys: Iterable[Dict[str, Any]]) -> int:
+    """Удаляет строки по первичным ключам пачками через jsonb_to_recordset"""
+    cur.execute("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod) FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s AND a.attname = ANY(%s)
+    """, (schema, table, pk))
+    types = dict(cur.fetchall())
+    record = ', '.join(f'"{col}" {types[col]}' for col in pk)
+    match = ' AND '.join(f't."{col}" = k."{col}"' for col in pk)
+    deleted = 0
+    batch: List[Dict[str, Any]] = []
+
+    def flush() -> int:
+        cur.execute(
+            f'DELETE FROM {schema}."{table}" t USING jsonb_to_recordset(%s::jsonb) AS k({record}) WHERE {match}',
+            (json.dumps(batch, ensure_ascii=False),)
+        )
+        return cur.rowcount
+
+    for key in keys:
+        batch.append(key['row_pk'])
+        if len(batch) >= DELETE_BATCH_SIZE:
+            deleted += flush()
+            batch = []
+    if batch:
+        deleted += flush()
+    return deleted
+
+def upsert_rows(
+    cur,
+    schema: str,
+    table: str,
+    columns: List[str],
+    kinds: Dict[str, str],
+    pk: List[str],
+    rows: Iterable[Dict[str, Any]],
+    overwrite: bool = True
+) -> int:
+    """
+    Загружает изменённые строки через COPY во временную таблицу и переносит
+    их INSERT ... ON CONFLICT: удаления родительских строк (и каскад на дочерние) не нужны.
+    При overwrite=False существующие строки не меняются, добавляются только недостающие.
+    Возвращает число вставленных и обновлённых строк.
+    """
+    cur.execute(f'CREATE TEMP TABLE restore_upsert ON COMMIT DROP AS SELECT * FROM {schema}."{table}" WITH NO DATA')
+    copy_rows(cur, 'pg_temp', 'restore_upsert', columns, kinds, rows)
+    cols_str = ', '.join(f'"{c}"' for c in columns)
+    updates = ', '.join(f'"{c}" = EXCLUDED."{c}"' for c in columns if c not in pk)
+    target = ', '.join(f'"{c}"' for c in pk)
+    if not overwrite or not pk:
+        conflict = 'ON CONFLICT DO NOTHING'
+    elif updates:
+        conflict = f'ON CONFLICT ({target}) DO UPDATE SET {updates}'
+    else:
+        conflict = f'ON CONFLICT ({target}) DO NOTHING'
+    cur.execute(f"""
+        INSERT INTO {schema}."{table}" ({cols_str}) SELECT {cols_str} FROM restore_upsert
+        {conflict}
+    """)
+    count = cur.rowcount
+    cur.execute('DROP TABLE restore_upsert')
+    return count
+
+def apply_increment(cur, schema: str, tables: List[str], s3, manifest: Dict[str, Any], timings: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Применяет инкрементальный бэкап поверх восстановленного состояния:
+    сначала удаления в обратном порядке зависимостей, затем изменённые строки
+    в прямом. Таблицы, выгруженные целиком, заменяются полностью.
+    """
+    entries = manifest['tables']
+    for table in reversed(tables):
+        info = entries.get(table)
+        if not info:
+            continue
+        if info['mode'] == 'full':
+            cur.execute(f'DELETE FROM {schema}."{table}"')
+        elif info['mode'] == 'by_file' and info['file_ids']:
+            cur.execute(f'DELETE FROM {schema}."{table}" WHERE file_id = ANY(%s)', (info['file_ids'],))
+        elif info['mode'] == 'changes' and info.get('deleted'):
+            kinds = column_kinds(cur, schema, table)
+            delete_by_keys(cur, schema, table, info['pk'], kinds, iter_s3_rows(s3, info['deleted_key']))
+
+    for table in tables:
+        info = entries.get(table)
+        if not info or not info['rows']:
+            continue
+        if table == 'log_entries':
+            create_log_partitions(cur, schema)
+        kinds = column_kinds(cur, schema, table)
+        columns = [c for c in info['columns'] if c in kinds]
+        table_started = time.monotonic()
+        rows = iter_s3_rows(s3, info['key'])
+        if info['mode'] == 'changes':
+            count = upsert_rows(cur, schema, table, columns, kinds, info['pk'], rows)
+        else:
+            count = copy_rows(cur, schema, table, columns, kinds, rows)
+        stat = timings.setdefault(table, {'rows': 0, 'seconds': 0.0})
+        stat['rows'] += count
+        stat['seconds'] = round(stat['seconds'] + time.monotonic() - table_started, 3)
+
+def restore_tables(
+    conn,
+    schema: str,
+    tables: List[str],
+    source,
+    s3=None,
+    increments: Iterable[Dict[str, Any]] = ()
+) -> Dict[str, Any]:
+    """
+    Восстанавливает таблицы в порядке tables в одной транзакции.
+    source(table) возвращает (столбцы бэкапа, итератор строк) или None,
+    если таблицы в бэкапе нет. increments — манифесты инкрементальных бэкапов,
+    которые проигрываются поверх по порядку.
+    Проверка отложенных внешних ключей — при COMMIT. Триггеры журнала
+    backup_changes на время восстановления отключаются, журнал очищается.
+    """
+    started = time.monotonic()
+    timings: Dict[str, Dict[str, Any]] = {}
+    cur = conn.cursor()
+    try:
+        cur.execute('SET CONSTRAINTS ALL DEFERRED')
+        set_change_triggers(cur, schema, tables, enabled=False)
+        clear_tables(cur, schema, tables)
+
+        for table in tables:
+            if table == 'log_entries':
+                create_log_partitions(cur, schema)
+            data: Optional[Tuple[List[str], Iterable[Dict[str, Any]]]] = source(table)
+            if data is None:
+                continue
+            backup_columns, rows = data
+            kinds = column_kinds(cur, schema, table)
+            # Столбцы, которых уже нет в схеме, пропускаются; новые получают значения по умолчанию
+            columns = [c for c in backup_columns if c in kinds]
+            table_started = time.monotonic()
+            count = copy_rows(cur, schema, table, columns, kinds, rows)
+            if count:
+                timings[table] = {'rows': count, 'seconds': round(time.monotonic() - table_started, 3)}
+
+        for manifest in increments:
+            apply_increment(cur, schema, tables, s3, manifest, timings)
+
+        reset_sequences(cur, schema, tables)
+        set_change_triggers(cur, schema, tables, enabled=True)
+        reset_change_log(cur, schema)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return {
+        'tables_restored': len(timings),
+        'rows_restored': sum(t['rows'] for t in timings.values()),
+        'seconds': round(time.monotonic() - started, 3),
+        'tables': timings,
+    }
+
+def s3_source(s3, manifest: Dict[str, Any]):
+    """Источник строк для restore_tables из бэкапа в S3 по манифесту"""
+    def source(table: str):
+        info = manifest['tables'].get(table)
+        if not info or not info.get('rows'):
+            return None
+        return info['columns'], iter_s3_rows(s3, info['key'])
+    return source
+
+def json_source(backup_data: Dict[str, Any]):
+    """Источник строк из бэкапа прежнего формата (один JSON со всеми таблицами)"""
+    def source(table: str):
+        rows = backup_data['tables'].get(table) or []
+        if not rows:
+            return None
+        return list(rows[0].keys()), rows
+    return source
+
+def primary_key(cur, schema: str, table: str) -> List[str]:
+    cur.execute("""
+        SELECT a.attname FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+        WHERE n.nspname = %s AND c.relname = %s AND i.indisprimary
+        ORDER BY k.ord
+    """, (schema, table))
+    return [row[0] for row in cur.fetchall()]
+
+def chunks_to_read(info: Dict[str, Any], column: str, values: Optional[set]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Блоки файла таблицы, в которых могут быть строки с column из values.
+    Для бэкапов без индекса блоков файл читается целиком (None).
+    """
+    if not info.get('rows'):
+        return []
+    chunks = info.get('chunks')
+    if chunks is None:
+        return [None]
+    # Диапазоны в индексе блоков есть только у целочисленных значений
+    if values is None or column not in info.get('indexed', ()) or not all(isinstance(v, int) for v in values):
+        return chunks
+    return [
+        chunk for chunk in chunks
+        if column in chunk['ranges']
+        and any(chunk['ranges'][column][0] <= v <= chunk['ranges'][column][1] for v in values)
+    ]
+
+def select_rows(
+    s3,
+    chain: List[Dict[str, Any]],
+    table: str,
+    column: str,
+    values: Optional[set],
+    pk: List[str]
+) -> Tuple[List[Dict[str, Any]], List[str], int]:
+    """
+    Строки таблицы с column из values (все строки, если values=None) в состоянии
+    на момент последнего бэкапа цепочки. Инкременты проигрываются по первичному
+    ключу: изменённые строки заменяют прежние, удалённые исключаются.
+    Возвращает строки, столбцы бэкапа и число прочитанных блоков.
+    """
+    found: Dict[Any, Dict[str, Any]] = {}
+    columns: List[str] = []
+    chunks_read = 0
+
+    def row_key(row: Dict[str, Any]):
+        return tuple(row.get(c) for c in pk) if pk else json.dumps(row, sort_keys=True)
+
+    for manifest in chain:
+        info = manifest['tables'].get(table)
+        if not info:
+            continue
+        mode = info.get('mode', 'full')
+        if mode == 'full':
+            found = {}
+        elif mode == 'by_file':
+            file_ids = set(info['file_ids'])
+            found = {k: row for k, row in found.items() if row.get('file_id') not in file_ids}
+        elif mode == 'changes' and info.get('deleted'):
+            for key in iter_s3_rows(s3, info['deleted_key']):
+                found.pop(row_key(key['row_pk']), None)
+
+        if info.get('rows'):
+            columns = info['columns']
+        # В инкременте строка могла перестать подходить под условие — читается весь файл
+        scan = chunks_to_read(info, column, None if mode == 'changes' else values)
+        for chunk in scan:
+            chunks_read += 1
+            for row in iter_s3_rows(s3, info['key'], chunk):
+                if values is None or row.get(column) in values:
+                    found[row_key(row)] = row
+                elif mode == 'changes':
+                    found.pop(row_key(row), None)
+            if len(found) > MAX_SELECTED_ROWS:
+                raise ValueError(f'Слишком много строк для выборочного восстановления в {table}')
+
+    return list(found.values()), columns, chunks_read
+
+def restore_selected(
+    conn,
+    schema: str,
+    s3,
+    chain: List[Dict[str, Any]],
+    targets: List[Tuple[str, str, Optional[str]]],
+    ids: Optional[set],
+    overwrite: bool = False
+) -> Dict[str, Any]:
+    """
+    Возвращает из бэкапа отдельные строки, не очищая таблицы, в одной транзакции.
+    targets — (таблица, столбец, родитель) в порядке зависимостей: строки первой
+    таблицы отбираются по ids, остальных — по id строк, найденных в родителе.
+    Существующие строки обновляются только при overwrite.
+    """
+    started = time.monotonic()
+    selected: Dict[str, List[Dict[str, Any]]] = {}
+    tables: Dict[str, Dict[str, Any]] = {}
+    cur = conn.cursor()
+    try:
+        cur.execute('SET CONSTRAINTS ALL DEFERRED')
+        for table, column, parent in targets:
+            values = ids if parent is None else {row['id'] for row in selected.get(parent, [])}
+            if values is not None and not values:
+                continue
+            pk = primary_key(cur, schema, table)
+            rows, backup_columns, chunks_read = select_rows(s3, chain, table, column, values, pk)
+            selected[table] = rows
+            if not rows:
+                continue
+            kinds = column_kinds(cur, schema, table)
+            columns = [c for c in backup_columns if c in kinds]
+            count = upsert_rows(cur, schema, table, columns, kinds, pk, rows, overwrite)
+            tables[table] = {'found': len(rows), 'restored': count, 'chunks_read': chunks_read}
+
+        reset_sequences(cur, schema, list(tables))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return {
+        'tables_restored': len(tables),
+        'rows_restored': sum(t['restored'] for t in tables.values()),
+        'seconds': round(time.monotonic() - started, 3),
+        'tables': tables,
+    }
@@ -0,0 +1,561 @@
+"""
+Потоковый экспорт БД в S3.
+Каждая таблица читается серверным курсором пачками и пишется как NDJSON
+(одна строка — одна запись), сжатый gzip, в S3 через multipart upload частями
+по PART_SIZE. В памяти одновременно находятся одна пачка строк и одна часть,
+поэтому расход памяти не зависит от размера базы.
+
+Таблицы выгружаются параллельно из одного снимка БД (см. export_database).
+Бэкап — префикс backups/backup_<дата>/ с файлами <таблица>.ndjson.gz
+и manifest.json (состав таблиц, число строк, размеры, время выгрузки,
+хэш схемы, sha256 каждого файла и индекс его блоков с их хэшами — см. ChunkedWriter).
+Бэкап бывает полным или инкрементальным: инкремент содержит только строки,
+изменённые после предыдущего бэкапа цепочки (журнал backup_changes), и ссылается
+на него в manifest['parent']; восстановление проигрывает полный бэкап и цепочку.
+Модуль продублирован в backend/auto-backup — изменения вносить в обе копии.
+"""
+import os
+import json
+import gzip
+import time
+import queue
+import base64
+import hashlib
+import threading
+from datetime import datetime
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+from typing import Dict, Any, List, Optional, Tuple
+
+import boto3
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+S3_ENDPOINT = 'https://bucket.poehali.dev'
+S3_BUCKET = 'files'
+BACKUP_PREFIX = 'backups/'
+MANIFEST_NAME = 'manifest.json'
+BACKUP_VERSION = '2.0'
+MAX_CHAIN_LENGTH = 1000
+# Таблицы с file_id, которые в инкременте выгружаются по изменённым файлам
+# log_files (см. export_by_file), и порядок их строк
+BY_FILE_TABLES = {
+    'log_entries': 'file_id, line_number',
+    'log_statistics': 'file_id, level',
+    'log_file_templates': 'file_id, cluster_id',
+    'log_histogram_minute': 'file_id, bucket, level, cluster_id',
+    'log_histogram_hour': 'file_id, bucket, level, cluster_id',
+}
+
+PART_SIZE = 8 * 1024 * 1024
+FETCH_SIZE = 2000
+CHUNK_ROWS = 20000
+GZIP_LEVEL = 6
+DEFAULT_WORKERS = 4
+
+def get_s3():
+    return boto3.client(
+        's3',
+        endpoint_url=S3_ENDPOINT,
+        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+    )
+
+def cdn_url(key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+
+def json_serial(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (bytes, memoryview)):
+        return base64.b64encode(bytes(obj)).decode('utf-8')
+    return str(obj)
+
+def new_backup_prefix(incremental: bool = False) -> str:
+    now = datetime.now(ZoneInfo('Europe/Moscow'))
+    suffix = '_inc' if incremental else ''
+    return f"{BACKUP_PREFIX}backup_{now.strftime('%Y-%m-%d_%H-%M-%S')}{suffix}/"
+
+class MultipartWriter:
+    """
+    Файлоподобный объект для записи в S3: данные копятся до PART_SIZE
+    и отправляются очередной частью multipart upload.
+    """
+
+    def __init__(self, s3, key: str, content_type: str = 'application/gzip'):
+        self.s3 = s3
+        self.key = key
+        self.upload_id = s3.create_multipart_upload(
+            Bucket=S3_BUCKET, Key=key, ContentType=content_type
+        )['UploadId']
+        self.parts: List[Dict[str, Any]] = []
+        self.buffer = bytearray()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= PART_SIZE:
+            self._upload_part(bytes(self.buffer[:PART_SIZE]))
+            del self.buffer[:PART_SIZE]
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _upload_part(self, body: bytes) -> None:
+        number = len(self.parts) + 1
+        resp = self.s3.upload_part(
+            Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id,
+            PartNumber=number, Body=body
+        )
+        self.parts.append({'PartNumber': number, 'ETag': resp['ETag']})
+
+    def complete(self) -> None:
+        # Последняя часть может быть меньше PART_SIZE
+        if self.buffer or not self.parts:
+            self._upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.s3.complete_multipart_upload(
+            Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+
+    def abort(self) -> None:
+        try:
+            self.s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id)
+        except Exception:
+            pass
+
+def update_ranges(ranges: Dict[str, List[int]], columns: List[str], batch: List[Dict[str, Any]]) -> None:
+    """Расширяет диапазоны [min, max] целочисленных ключевых столбцов значениями пачки"""
+    for col in columns:
+        values = [row[col] for row in batch if isinstance(row[col], int) and not isinstance(row[col], bool)]
+        if not values:
+            continue
+        low, high = min(values), max(values)
+        current = ranges.get(col)
+        ranges[col] = [low, high] if current is None else [min(current[0], low), max(current[1], high)]
+
+def chunk_bucket(value: Any) -> Optional[int]:
+    """
+    Номер блока по значению первого столбца (обычно id). Границы блоков
+    привязаны к диапазонам ключей, а не к номерам строк, поэтому вставка или
+    удаление строки меняет хэш только её блока, и сравнение бэкапов читает только его.
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value // CHUNK_ROWS
+    return None
+
+class ChunkedWriter:
+    """
+    Пишет NDJSON в MultipartWriter независимыми gzip-блоками и ведёт их индекс:
+    смещение и длина в объекте, число строк, диапазоны столбцов id и *_id
+    и sha256 несжатого содержимого блока и всего файла.
+    """
+
+    def __init__(self, writer: MultipartWriter, columns: List[str]):
+        self.writer = writer
+        self.columns = columns
+        self.first = columns[0] if columns else None
+        self.indexed = [c for c in columns if c == 'id' or c.endswith('_id')]
+        self.chunks: List[Dict[str, Any]] = []
+        self.chunk: Dict[str, Any] = {}
+        self.gz = None
+        self.chunk_hash = None
+        self.file_hash = hashlib.sha256()
+        self.rows = 0
+
+    def _start(self, bucket: Optional[int]) -> None:
+        self.chunk = {'offset': self.writer.size, 'rows': 0, 'bucket': bucket, 'ranges': {}}
+        # mtime=0 — одинаковые данные дают одинаковые байты
+        self.gz = gzip.GzipFile(fileobj=self.writer, mode='wb', compresslevel=GZIP_LEVEL, mtime=0)
+        self.chunk_hash = hashlib.sha256()
+
+    def _close(self) -> None:
+        if self.gz is None:
+            return
+        self.gz.close()
+        self.gz = None
+        self.chunk['length'] = self.writer.size - self.chunk['offset']
+        self.chunk['sha256'] = self.chunk_hash.hexdigest()
+        self.chunks.append(self.chunk)
+
+    def _write(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        data = ''.join(json.dumps(row, ensure_ascii=False, default=json_serial) + '\n' for row in rows).encode('utf-8')
+        self.gz.write(data)
+        self.chunk_hash.update(data)
+        self.file_hash.update(data)
+        update_ranges(self.chunk['ranges'], self.indexed, rows)
+        self.chunk['rows'] += len(rows)
+        self.rows += len(rows)
+
+    def write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        segment: List[Dict[str, Any]] = []
+        for row in batch:
+            bucket = chunk_bucket(row[self.first])
+            if self.gz is not None and (bucket != self.chunk['bucket'] or self.chunk['rows'] + len(segment) >= CHUNK_ROWS):
+                self._write(segment)
+                segment = []
+                self._close()
+            if self.gz is None:
+                self._start(bucket)
+            segment.append(row)
+        self._write(segment)
+
+    def finish(self) -> None:
+        self._close()
+        if not self.chunks:
+            # Пустая таблица — всё равно корректный gzip
+            self.writer.write(gzip.compress(b'', mtime=0))
+
+def export_query(conn, s3, name: str, query: str, params: tuple, key: str) -> Dict[str, Any]:
+    """
+    Выгружает результат запроса в key как gzip NDJSON.
+    Строки читаются именованным (серверным) курсором по FETCH_SIZE.
+    Объект состоит из независимых gzip-блоков (см. ChunkedWriter); индекс
+    блоков и хэши попадают в результат, чтобы выборочное восстановление и
+    сравнение бэкапов читали только нужные блоки.
+    """
+    started = time.monotonic()
+    writer = MultipartWriter(s3, key)
+    chunked: Optional[ChunkedWriter] = None
+    try:
+        with conn.cursor(name=f'export_{name}', cursor_factory=RealDictCursor) as cur:
+            cur.itersize = FETCH_SIZE
+            cur.execute(query, params)
+            while True:
+                batch = cur.fetchmany(FETCH_SIZE)
+                if chunked is None and cur.description:
+                    chunked = ChunkedWriter(writer, [col.name for col in cur.description])
+                if not batch:
+                    break
+                chunked.write_batch(batch)
+        chunked = chunked or ChunkedWriter(writer, [])
+        chunked.finish()
+        writer.complete()
+    except Exception:
+        writer.abort()
+        raise
+
+    return {
+        'key': key,
+        'rows': chunked.rows,
+        'bytes': writer.size,
+        'columns': chunked.columns,
+        'indexed': chunked.indexed,
+        'chunks': chunked.chunks,
+        'sha256': chunked.file_hash.hexdigest(),
+        'seconds': round(time.monotonic() - started, 3),
+    }
+
+def export_table(conn, s3, schema: str, table: str, key: str) -> Dict[str, Any]:
+    return export_query(conn, s3, table, f'SELECT * FROM {schema}."{table}" ORDER BY 1', (), key)
+
+def changes_since(pk: List[List[str]]) -> Tuple[str, str]:
+    """
+    Условие на журнал backup_changes: изменения таблицы, не видимые в снимке
+    предыдущего бэкапа (видимость в текущем снимке обеспечивает сама транзакция),
+    и выражение первичного ключа из row_pk с приведением к типам столбцов.
+    """
+    where = "c.table_name = %s AND c.row_pk IS NOT NULL AND NOT txid_visible_in_snapshot(c.tx_id, %s::txid_snapshot)"
+    pk_expr = ', '.join(f"(c.row_pk->>'{col}')::{col_type}" for col, col_type in pk)
+    return where, pk_expr
+
+def export_changes(conn, s3, schema: str, table: str, pk: List[List[str]], previous_snapshot: str, prefix: str) -> Dict[str, Any]:
+    """
+    Инкремент таблицы: текущие версии строк, изменённых после предыдущего
+    бэкапа, и ключи удалённых строк (отдельный файл <таблица>.deleted.ndjson.gz).
+    """
+    where, pk_expr = changes_since(pk)
+    pk_cols = ', '.join(f't."{col}"' for col, _ in pk)
+    match = ' AND '.join(f"""t."{col}" = (c.row_pk->>'{col}')::{col_type}""" for col, col_type in pk)
+
+    result = export_query(conn, s3, table, f"""
+        SELECT t.* FROM {schema}."{table}" t
+        WHERE ({pk_cols}) IN (SELECT {pk_expr} FROM {schema}.backup_changes c WHERE {where})
+        ORDER BY 1
+    """, (table, previous_snapshot), f'{prefix}{table}.ndjson.gz')
+
+    deleted = export_query(conn, s3, f'{table}_deleted', f"""
+        SELECT DISTINCT c.row_pk FROM {schema}.backup_changes c
+        WHERE {where}
+        AND NOT EXISTS (SELECT 1 FROM {schema}."{table}" t WHERE {match})
+    """, (table, previous_snapshot), f'{prefix}{table}.deleted.ndjson.gz')
+
+    result['mode'] = 'changes'
+    result['pk'] = [col for col, _ in pk]
+    result['deleted_key'] = deleted['key']
+    result['deleted'] = deleted['rows']
+    result['deleted_bytes'] = deleted['bytes']
+    result['bytes'] += deleted['bytes']
+    result['seconds'] = round(result['seconds'] + deleted['seconds'], 3)
+    return result
+
+def export_by_file(conn, s3, schema: str, table: str, previous_snapshot: str, prefix: str) -> Dict[str, Any]:
+    """
+    Таблицы BY_FILE_TABLES не ведут журнал изменений: log_entries — потому что
+    COPY миллионов строк через триггер слишком дорог, остальные пересчитываются
+    при каждой загрузке. Инкремент — все строки файлов, строка которых в log_files
+    менялась после предыдущего бэкапа; при восстановлении строки этих файлов заменяются.
+    """
+    where, _ = changes_since([['id', 'integer']])
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT DISTINCT (c.row_pk->>'id')::integer FROM {schema}.backup_changes c WHERE {where}
+    """, ('log_files', previous_snapshot))
+    file_ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+
+    result = export_query(conn, s3, table, f"""
+        SELECT * FROM {schema}."{table}" WHERE file_id = ANY(%s) ORDER BY {BY_FILE_TABLES[table]}
+    """, (file_ids,), f'{prefix}{table}.ndjson.gz')
+    result['mode'] = 'by_file'
+    result['file_ids'] = file_ids
+    return result
+
+def plan_tables(conn, schema: str, tables: List[str], previous: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Способ выгрузки каждой таблицы: full — целиком; changes — по журналу
+    backup_changes (таблицы с первичным ключом и триггером журнала, если после
+    предыдущего бэкапа не было TRUNCATE); by_file — для BY_FILE_TABLES.
+    """
+    if previous is None:
+        return {table: {'mode': 'full'} for table in tables}
+
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname,
+               array_agg(ARRAY[a.attname::text, format_type(a.atttypid, a.atttypmod)] ORDER BY k.ord)
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_index i ON i.indrelid = c.oid AND i.indisprimary
+        CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+        WHERE n.nspname = %s AND c.relname = ANY(%s)
+        AND EXISTS (SELECT 1 FROM pg_trigger tg WHERE tg.tgrelid = c.oid AND tg.tgname = 'backup_changes_trg')
+        GROUP BY c.relname
+    """, (schema, list(tables)))
+    tracked = {name: pk for name, pk in cur.fetchall()}
+    cur.execute(f"""
+        SELECT DISTINCT c.table_name FROM {schema}.backup_changes c
+        WHERE c.op = 'T' AND NOT txid_visible_in_snapshot(c.tx_id, %s::txid_snapshot)
+    """, (previous['txid_snapshot'],))
+    truncated = {row[0] for row in cur.fetchall()}
+    cur.close()
+
+    plan = {}
+    for table in tables:
+        if table in tracked and table not in truncated:
+            plan[table] = {'mode': 'changes', 'pk': tracked[table]}
+        elif table in BY_FILE_TABLES and 'log_files' in tracked and 'log_files' not in truncated:
+            plan[table] = {'mode': 'by_file'}
+        else:
+            plan[table] = {'mode': 'full'}
+    return plan
+
+def schema_hash(conn, schema: str, tables: List[str]) -> str:
+    """Хэш состава и типов столбцов таблиц: по нему видно, что схема между бэкапами менялась"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT table_name, column_name, data_type FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = ANY(%s)
+        ORDER BY table_name, ordinal_position
+    """, (schema, list(tables)))
+    columns = cur.fetchall()
+    cur.close()
+    return hashlib.sha256(json.dumps(columns).encode('utf-8')).hexdigest()
+
+def write_manifest(s3, prefix: str, manifest: Dict[str, Any]) -> str:
+    key = prefix + MANIFEST_NAME
+    s3.put_object(
+        Bucket=S3_BUCKET,
+        Key=key,
+        Body=json.dumps(manifest, ensure_ascii=False, default=json_serial, indent=2).encode('utf-8'),
+        ContentType='application/json',
+        # Связи цепочки в метаданных: список бэкапов читает их HEAD-запросом, не скачивая манифест
+        Metadata={'kind': manifest['kind'], 'parent': manifest.get('parent') or ''},
+    )
+    return key
+
+def open_snapshot(conn) -> Tuple[str, str]:
+    """
+    Начинает на conn транзакцию REPEATABLE READ и экспортирует её снимок.
+    Транзакция должна оставаться открытой, пока снимок используют рабочие соединения.
+    Возвращает id снимка и его txid_snapshot — по нему следующий инкрементальный
+    бэкап отличает уже сохранённые изменения от новых.
+    """
+    conn.commit()
+    cur = conn.cursor()
+    cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+    cur.execute('SELECT pg_export_snapshot(), txid_current_snapshot()::text')
+    snapshot, txid_snapshot = cur.fetchone()
+    cur.close()
+    return snapshot, txid_snapshot
+
+def connect_to_snapshot(dsn: str, snapshot: str):
+    """Рабочее соединение, видящее те же данные, что и транзакция со снимком"""
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+    cur.execute('SET TRANSACTION SNAPSHOT %s', (snapshot,))
+    cur.close()
+    return conn
+
+def tables_by_size(conn, schema: str, tables: List[str]) -> List[str]:
+    """
+    Самые большие таблицы первыми — так потоки заканчивают примерно одновременно.
+    Для секционированных таблиц (log_entries) складываются оценки секций.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname,
+               GREATEST(c.reltuples, 0) + COALESCE((
+                   SELECT SUM(GREATEST(p.reltuples, 0)) FROM pg_inherits i
+                   JOIN pg_class p ON p.oid = i.inhrelid
+                   WHERE i.inhparent = c.oid
+               ), 0)
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = ANY(%s)
+    """, (schema, list(tables)))
+    sizes = {name: rows for name, rows in cur.fetchall()}
+    cur.close()
+    return sorted(tables, key=lambda t: sizes.get(t, 0), reverse=True)
+
+def export_database(
+    conn,
+    schema: str,
+    tables: List[str],
+    s3=None,
+    prefix: Optional[str] = None,
+    workers: Optional[int] = None,
+    dsn: Optional[str] = None,
+    previous: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Выгружает таблицы параллельно в workers потоков и записывает манифест.
+    Все потоки читают один снимок (pg_export_snapshot транзакции на conn),
+    поэтому бэкап согласован: платёж и его custom_field_values попадают в него вместе.
+    Если передан манифест предыдущего бэкапа цепочки, бэкап инкрементальный:
+    выгружаются только изменения после него (см. plan_tables).
+    Возвращает манифест; ключ манифеста — в manifest['manifest_key'].
+    """
+    s3 = s3 or get_s3()
+    prefix = prefix or new_backup_prefix(incremental=previous is not None)
+    dsn = dsn or os.environ['DATABASE_URL']
+    workers = max(1, min(workers or int(os.environ.get('BACKUP_WORKERS', DEFAULT_WORKERS)), len(tables) or 1))
+    started = time.monotonic()
+    created_at = datetime.now(ZoneInfo('Europe/Moscow')).isoformat()
+    manifest: Dict[str, Any] = {
+        'version': BACKUP_VERSION,
+        'format': 'ndjson.gz',
+        'kind': 'incremental' if previous else 'full',
+        'created_at': created_at,
+        'schema': schema,
+        'prefix': prefix,
+        'isolation': 'repeatable read',
+        'workers': workers,
+        'tables': {},
+    }
+    if previous:
+        manifest['parent'] = previous['prefix']
+        manifest['base'] = previous.get('base') or previous['prefix']
+        manifest['base_created_at'] = previous.get('base_created_at') or previous['created_at']
+        manifest['chain_length'] = previous.get('chain_length', 0) + 1
+    else:
+        manifest['base_created_at'] = created_at
+        manifest['chain_length'] = 0
+
+    snapshot, manifest['txid_snapshot'] = open_snapshot(conn)
+    manifest['schema_hash'] = schema_hash(conn, schema, tables)
+    plan = plan_tables(conn, schema, tables, previous)
+    pending: queue.Queue = queue.Queue()
+    for table in tables_by_size(conn, schema, tables):
+        pending.put(table)
+    results: Dict[str, Dict[str, Any]] = {}
+    errors: List[BaseException] = []
+
+    def export_planned(worker_conn, table: str) -> Dict[str, Any]:
+        mode = plan[table]['mode']
+        if mode == 'changes':
+            return export_changes(worker_conn, s3, schema, table, plan[table]['pk'], previous['txid_snapshot'], prefix)
+        if mode == 'by_file':
+            return export_by_file(worker_conn, s3, schema, table, previous['txid_snapshot'], prefix)
+        result = export_table(worker_conn, s3, schema, table, f'{prefix}{table}.ndjson.gz')
+        result['mode'] = 'full'
+        return result
+
+    def worker() -> None:
+        worker_conn = None
+        try:
+            worker_conn = connect_to_snapshot(dsn, snapshot)
+            while not errors:
+                try:
+                    table = pending.get_nowait()
+                except queue.Empty:
+                    break
+                results[table] = export_planned(worker_conn, table)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            if worker_conn is not None:
+                worker_conn.close()
+
+    try:
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        conn.commit()
+    if errors:
+        raise errors[0]
+
+    # Манифест хранит таблицы в порядке восстановления, а не выгрузки
+    manifest['tables'] = {table: results[table] for table in tables}
+    manifest['rows'] = sum(t['rows'] for t in manifest['tables'].values())
+    manifest['bytes'] = sum(t['bytes'] for t in manifest['tables'].values())
+    manifest['seconds'] = round(time.monotonic() - started, 3)
+    manifest['manifest_key'] = write_manifest(s3, prefix, manifest)
+    return manifest
+
+def read_manifest(s3, prefix: str) -> Dict[str, Any]:
+    if not prefix.endswith('/'):
+        prefix += '/'
+    body = s3.get_object(Bucket=S3_BUCKET, Key=prefix + MANIFEST_NAME)['Body'].read()
+    return json.loads(body)
+
+def load_chain(s3, prefix: str) -> List[Dict[str, Any]]:
+    """Цепочка манифестов от полного бэкапа до указанного (включительно)"""
+    chain = [read_manifest(s3, prefix)]
+    while chain[0].get('kind') == 'incremental':
+        if len(chain) > MAX_CHAIN_LENGTH:
+            raise ValueError('Слишком длинная цепочка инкрементальных бэкапов')
+        chain.insert(0, read_manifest(s3, chain[0]['parent']))
+    return chain
+
+def manifest_links(s3, prefix: str) -> Dict[str, Optional[str]]:
+    """Тип бэкапа и его родитель в цепочке; для бэкапов без метаданных — из манифеста"""
+    meta = s3.head_object(Bucket=S3_BUCKET, Key=prefix + MANIFEST_NAME).get('Metadata') or {}
+    if 'kind' in meta:
+        return {'kind': meta['kind'], 'parent': meta.get('parent') or None}
+    manifest = read_manifest(s3, prefix)
+    return {'kind': manifest.get('kind', 'full'), 'parent': manifest.get('parent')}
+
+def prune_changes(conn, schema: str, txid_snapshot: str) -> int:
+    """Удаляет из журнала изменения, уже вошедшие в бэкап с этим снимком"""
+    cur = conn.cursor()
+    cur.execute(
+        f"DELETE FROM {schema}.backup_changes WHERE txid_visible_in_snapshot(tx_id, %s::txid_snapshot)",
+        (txid_snapshot,)
+    )
+    deleted = cur.rowcount
+    conn.commit()
+    cur.close()
+    return deleted
@@ -5,10 +5,8 @@ import jwt
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
-from datetime import datetime
-from decimal import Decimal
-from zoneinfo import ZoneInfo
-import base64
+from backup_stream import export_database, cdn_url, get_s3, load_chain, BACKUP_PREFIX, S3_BUCKET
+from backup_restore import restore_tables, restore_selected, s3_source, json_source, primary_key
 
 SCHEMA = 't_p61788166_html_to_frontend'
 
@@ -49,6 +47,9 @@ TABLES_ORDER = [
     'payment_custom_values',
     'payment_documents',
     'payment_views',
+    'uploaded_files',
+    'file_blobs',
+    'file_previews',
     'planned_payments',
     'planned_payment_custom_field_values',
     'savings',
@@ -56,6 +57,11 @@ TABLES_ORDER = [
     'log_files',
     'log_entries',
     'log_statistics',
+    'log_templates',
+    'log_file_templates',
+    'log_histogram_minute',
+    'log_histogram_hour',
+    'log_sources',
     'login_attempts',
     'push_subscriptions',
     'dashboard_layouts',
@@ -63,6 +69,26 @@ TABLES_ORDER = [
     'webauthn_credentials',
 ]
 
+# Сущности выборочного восстановления: (таблица, столбец, родительская таблица)
+# в порядке зависимостей; строки дочерних таблиц отбираются по id строк родителя
+RESTORE_ENTITIES = {
+    'payment': [
+        ('payments', 'id', None),
+        ('approvals', 'payment_id', 'payments'),
+        ('custom_field_values', 'payment_id', 'payments'),
+        ('notifications', 'payment_id', 'payments'),
+        ('payment_comments', 'payment_id', 'payments'),
+        ('comment_likes', 'comment_id', 'payment_comments'),
+        ('payment_custom_field_values', 'payment_id', 'payments'),
+        ('payment_custom_values', 'payment_id', 'payments'),
+        ('payment_documents', 'payment_id', 'payments'),
+        ('payment_views', 'payment_id', 'payments'),
+    ],
+    'contractor': [
+        ('contractors', 'id', None),
+    ],
+}
+
 def log(msg):
     print(msg, file=sys.stderr, flush=True)
 
@@ -119,17 +145,6 @@ def check_admin_permission(conn, user_id):
     cur.close()
     return len(perms) > 0
 
-def json_serial(obj):
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    if isinstance(obj, Decimal):
-        return float(obj)
-    if isinstance(obj, bytes):
-        return base64.b64encode(obj).decode('utf-8')
-    if isinstance(obj, memoryview):
-        return base64.b64encode(bytes(obj)).decode('utf-8')
-    return str(obj)
-
 def get_existing_tables(conn):
     cur = conn.cursor()
     cur.execute("""
@@ -162,111 +177,163 @@ def get_last_backup_info(conn):
     cur.close()
     return [dict(r) for r in rows]
 
+def key_column(conn, table):
+    """
+    Столбец первичного ключа таблицы для выборки по ids и признак целочисленного
+    типа (file_blobs, например, ключом имеет sha256). None — ключ составной или его нет.
+    """
+    cur = conn.cursor()
+    pk = primary_key(cur, SCHEMA, table)
+    if len(pk) != 1:
+        cur.close()
+        return None
+    cur.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s AND column_name = %s
+    """, (SCHEMA, table, pk[0]))
+    data_type = cur.fetchone()[0]
+    cur.close()
+    return pk[0], data_type in ('smallint', 'integer', 'bigint')
+
 def handle_export(conn, user_id=None, username=None):
+    """Потоковый экспорт в S3 (gzip NDJSON по таблицам); в ответе манифест и ссылки"""
     existing = get_existing_tables(conn)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    backup = {
-        'version': '1.0',
-        'created_at': datetime.now(ZoneInfo('Europe/Moscow')).isoformat(),
-        'schema': SCHEMA,
-        'tables': {}
-    }
-    total_rows = 0
-    for table in TABLES_ORDER:
-        if table not in existing:
-            continue
-        cur.execute(f'SELECT * FROM {SCHEMA}."{table}" ORDER BY 1')
-        rows = cur.fetchall()
-        backup['tables'][table] = [dict(row) for row in rows]
-        total_rows += len(rows)
-    cur.close()
+    tables = [t for t in TABLES_ORDER if t in existing]
+    manifest = export_database(conn, SCHEMA, tables)
     if user_id:
-        log_backup_action(conn, user_id, username, 'export', {'tables': len(backup['tables']), 'rows': total_rows})
-    return response(200, backup)
+        log_backup_action(conn, user_id, username, 'export', {
+            'tables': len(manifest['tables']),
+            'rows': manifest['rows'],
+            'file': manifest['prefix'],
+            'size_mb': round(manifest['bytes'] / (1024 * 1024), 2),
+        })
+    return response(200, {
+        'success': True,
+        'key': manifest['prefix'],
+        'manifest_url': cdn_url(manifest['manifest_key']),
+        'manifest': manifest,
+    })
 
 def handle_import(conn, event, user_id=None, username=None):
-    body = json.loads(event.get('body', '{}'))
+    """
+    Восстановление из бэкапа в S3 (key — папка бэкапа) потоковым COPY.
+    Бэкап прежнего формата — key на одиночный .json в S3 или JSON в поле backup.
+    """
+    body = json.loads(event.get('body') or '{}')
+    key = body.get('key')
     backup_data = body.get('backup')
-    if not backup_data:
-        return response(400, {'error': 'Отсутствуют данные бэкапа'})
 
-    if not isinstance(backup_data, dict) or 'tables' not in backup_data:
-        return response(400, {'error': 'Некорректный формат бэкапа'})
+    if key:
+        if not key.startswith(BACKUP_PREFIX):
+            return response(400, {'error': 'Некорректный ключ бэкапа'})
+        s3 = get_s3()
+        if not key.endswith('/'):
+            # Одиночный JSON прежнего формата: манифеста и цепочки у него нет
+            try:
+                backup_data = json.loads(s3.get_object(Bucket=S3_BUCKET, Key=key)['Body'].read())
+            except Exception as e:
+                log(f"Legacy backup read error: {e}")
+                return response(404, {'error': 'Файл бэкапа не найден'})
+            if not isinstance(backup_data, dict) or 'tables' not in backup_data:
+                return response(400, {'error': 'Некорректный формат бэкапа'})
+            source = json_source(backup_data)
+            increments = []
+        else:
+            try:
+                chain = load_chain(s3, key)
+            except Exception as e:
+                log(f"Manifest read error: {e}")
+                return response(404, {'error': 'Бэкап или один из бэкапов его цепочки не найден'})
+            source = s3_source(s3, chain[0])
+            increments = chain[1:]
+    elif backup_data:
+        if not isinstance(backup_data, dict) or 'tables' not in backup_data:
+            return response(400, {'error': 'Некорректный формат бэкапа'})
+        source = json_source(backup_data)
+        s3 = None
+        increments = []
+    else:
+        return response(400, {'error': 'Отсутствуют данные бэкапа'})
 
     existing = get_existing_tables(conn)
-    cur = conn.cursor()
+    tables = [t for t in TABLES_ORDER if t in existing]
 
     try:
-        cur.execute('BEGIN')
-
-        reversed_tables = list(reversed(TABLES_ORDER))
-        for table in reversed_tables:
-            if table not in existing:
-                continue
-            cur.execute(f'DELETE FROM {SCHEMA}."{table}"')
-
-        tables_restored = 0
-        rows_restored = 0
-
-        for table in TABLES_ORDER:
-            if table not in existing:
-                continue
-            rows = backup_data['tables'].get(table, [])
-            if not rows:
-                continue
-
-            columns = list(rows[0].keys())
-            cols_str = ', '.join(f'"{c}"' for c in columns)
-            placeholders = ', '.join(['%s'] * len(columns))
+        result = restore_tables(conn, SCHEMA, tables, source, s3, increments)
+    except Exception as e:
+        log(f"Import error: {e}")
+        return response(500, {'error': f'Ошибка восстановления: {str(e)}'})
 
-            for row in rows:
-                values = []
-                for c in columns:
-                    v = row.get(c)
-                    values.append(v)
-                cur.execute(
-                    f'INSERT INTO {SCHEMA}."{table}" ({cols_str}) VALUES ({placeholders})',
-                    values
-                )
+    if user_id:
+        log_backup_action(conn, user_id, username, 'import', {
+            'tables': result['tables_restored'],
+            'rows': result['rows_restored'],
+            'file': key,
+            'seconds': result['seconds'],
+            'chain': len(increments) + 1,
+        })
 
-            tables_restored += 1
-            rows_restored += len(rows)
+    return response(200, {'success': True, **result})
+
+def handle_restore_rows(conn, event, user_id=None, username=None):
+    """
+    Выборочное восстановление без очистки базы: entity=payment|contractor и id
+    (платёж возвращается вместе с согласованиями, комментариями, документами и
+    значениями полей) либо entity=table, table и необязательный список ids —
+    значений первичного ключа таблицы (он должен состоять из одного столбца).
+    Из S3 читаются только блоки бэкапа, в которые попадают нужные ключи.
+    overwrite=true перезаписывает существующие строки значениями из бэкапа.
+    """
+    body = json.loads(event.get('body') or '{}')
+    key = body.get('key') or ''
+    entity = body.get('entity')
+    if not key.startswith(BACKUP_PREFIX):
+        return response(400, {'error': 'Некорректный ключ бэкапа'})
 
-        for table in TABLES_ORDER:
-            if table not in existing:
-                continue
-            cur.execute(f"""
-                SELECT column_name FROM information_schema.columns
-                WHERE table_schema = '{SCHEMA}' AND table_name = '{table}'
-                AND column_default LIKE 'nextval%%'
-            """)
-            seq_cols = cur.fetchall()
-            for (col_name,) in seq_cols:
-                cur.execute(f"""
-                    SELECT setval(
-                        pg_get_serial_sequence('{SCHEMA}."{table}"', '{col_name}'),
-                        COALESCE((SELECT MAX("{col_name}") FROM {SCHEMA}."{table}"), 0) + 1,
-                        false
-                    )
-                """)
+    existing = get_existing_tables(conn)
+    try:
+        if entity == 'table':
+            table = body.get('table')
+            if table not in TABLES_ORDER or table not in existing:
+                return response(400, {'error': 'Неизвестная таблица'})
+            pk_column = key_column(conn, table)
+            if pk_column is None:
+                return response(400, {'error': 'Выборочно восстанавливаются только таблицы с первичным ключом из одного столбца'})
+            column, is_integer = pk_column
+            targets = [(table, column, None)]
+            ids = {int(i) if is_integer else str(i) for i in body['ids']} if body.get('ids') else None
+        elif entity in RESTORE_ENTITIES:
+            targets = [t for t in RESTORE_ENTITIES[entity] if t[0] in existing]
+            ids = {int(body['id'])}
+        else:
+            return response(400, {'error': 'Неизвестный тип объекта'})
+    except (KeyError, TypeError, ValueError):
+        return response(400, {'error': 'Некорректный идентификатор'})
 
-        cur.execute('COMMIT')
+    s3 = get_s3()
+    try:
+        chain = load_chain(s3, key)
+    except Exception as e:
+        log(f"Manifest read error: {e}")
+        return response(404, {'error': 'Бэкап или один из бэкапов его цепочки не найден'})
 
-        if user_id:
-            log_backup_action(conn, user_id, username, 'import', {'tables': tables_restored, 'rows': rows_restored})
+    try:
+        result = restore_selected(conn, SCHEMA, s3, chain, targets, ids, bool(body.get('overwrite')))
+    except Exception as e:
+        log(f"Selective restore error: {e}")
+        return response(500, {'error': f'Ошибка восстановления: {str(e)}'})
 
-        return response(200, {
-            'success': True,
-            'tables_restored': tables_restored,
-            'rows_restored': rows_restored,
+    if user_id:
+        log_backup_action(conn, user_id, username, 'restore_rows', {
+            'file': key,
+            'entity': entity,
+            'table': body.get('table'),
+            'ids': sorted(ids) if ids else None,
+            'rows': result['rows_restored'],
+            'seconds': result['seconds'],
         })
 
-    except Exception as e:
-        cur.execute('ROLLBACK')
-        log(f"Import error: {e}")
-        return response(500, {'error': f'Ошибка восстановления: {str(e)}'})
-    finally:
-        cur.close()
+    return response(200, {'success': True, **result})
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Резервное копирование и восстановление базы данных"""
@@ -296,6 +363,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return handle_export(conn, user_id, username)
         elif method == 'POST' and action == 'import':
             return handle_import(conn, event, user_id, username)
+        elif method == 'POST' and action == 'restore_rows':
+            return handle_restore_rows(conn, event, user_id, username)
         else:
             return response(400, {'error': 'Неизвестное действие'})
     finally:
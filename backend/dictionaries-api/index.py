@@ -692,7 +692,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
                 cur.execute(f"""
                     UPDATE {SCHEMA}.planned_payments
-                    SET department_id = %s
+                    SET department_id = %s, updated_at = NOW()
                     WHERE service_id = %s
                 """, (svc_req.customer_department_id, svc_id))
                 
@@ -1,76 +1,338 @@
 import urllib.request
 import urllib.parse
+import urllib.error
 import base64
+import io
+import json
+import os
 import re
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Tuple
+
+import boto3
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'GET, OPTIONS',
-    'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, Range, If-None-Match, If-Modified-Since, If-Range',
+    'Access-Control-Expose-Headers': 'Content-Disposition, Content-Range, Content-Length, Accept-Ranges, ETag, Last-Modified',
     'Access-Control-Max-Age': '86400',
 }
 
+S3_BUCKET = 'files'
+BUCKET_PREFIX = f'https://bucket.poehali.dev/{S3_BUCKET}/'
+# Ссылка на скачивание живёт недолго: её получает только тот, кто запросил файл
+DOWNLOAD_URL_TTL = 300
+# Сколько байт функция отдаёт за один ответ; остальное — через Range или редирект
+MAX_PROXY_BYTES = 4 * 1024 * 1024
+READ_CHUNK_BYTES = 256 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
 
 def _safe_ascii_name(name: str) -> str:
     safe = re.sub(r'[\r\n"\\]', '_', name or 'file')
     return safe.encode('ascii', 'replace').decode('ascii').replace('?', '_')
 
 
+def _error(status: int, message: str, headers: Optional[dict] = None) -> dict:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', **CORS_HEADERS, **(headers or {})},
+        'body': json.dumps({'error': message}, ensure_ascii=False)
+    }
+
+
+def _header(event: dict, name: str) -> str:
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value or ''
+    return ''
+
+
+def _bucket_key(url: str) -> Optional[str]:
+    '''Ключ объекта в бакете проекта, если url указывает на него (CDN или сам бакет)'''
+    cdn_prefix = f"https://cdn.poehali.dev/projects/{os.environ.get('AWS_ACCESS_KEY_ID')}/bucket/"
+    for prefix in (cdn_prefix, BUCKET_PREFIX):
+        if url.startswith(prefix):
+            key = urllib.parse.unquote(url[len(prefix):].split('?', 1)[0])
+            return key or None
+    return None
+
+
+def _get_s3():
+    return boto3.client('s3',
+        endpoint_url='https://bucket.poehali.dev',
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
+    )
+
+
+class BucketSource:
+    '''Файл из бакета проекта: метаданные через HEAD, части через Range GET'''
+
+    def __init__(self, s3, key: str):
+        self.s3 = s3
+        self.key = key
+        head = s3.head_object(Bucket=S3_BUCKET, Key=key)
+        self.size = head['ContentLength']
+        self.content_type = head.get('ContentType') or 'application/octet-stream'
+        self.etag = head.get('ETag')
+        self.last_modified = head.get('LastModified')
+
+    def open(self, start: int, end: int):
+        return self.s3.get_object(Bucket=S3_BUCKET, Key=self.key, Range=f'bytes={start}-{end}')['Body']
+
+
+class UpstreamTooLarge(Exception):
+    pass
+
+
+class UrlSource:
+    '''
+    Прочие файлы CDN: то же самое через HTTP HEAD и GET с заголовком Range.
+    Если HEAD не поддерживается или не сообщает размер, файл запрашивается
+    обычным GET: размер берётся из его Content-Length, а без него файл
+    читается в память, но не больше MAX_PROXY_BYTES.
+    '''
+
+    def __init__(self, url: str):
+        self.url = url
+        self.data: Optional[bytes] = None
+        self.size: Optional[int] = None
+        try:
+            req = urllib.request.Request(url, method='HEAD', headers={'User-Agent': 'Mozilla/5.0'})
+            with urllib.request.urlopen(req, timeout=20) as resp:
+                self._read_headers(resp.headers)
+        except Exception:
+            self.size = None
+        if self.size is None:
+            self._fetch()
+
+    def _read_headers(self, headers) -> None:
+        length = headers.get('Content-Length')
+        self.size = int(length) if length is not None else None
+        self.content_type = headers.get('Content-Type', 'application/octet-stream')
+        self.etag = headers.get('ETag')
+        modified = headers.get('Last-Modified')
+        self.last_modified = _parse_http_date(modified) if modified else None
+
+    def _fetch(self) -> None:
+        req = urllib.request.Request(self.url, headers={'User-Agent': 'Mozilla/5.0'})
+        resp = urllib.request.urlopen(req, timeout=20)
+        self._read_headers(resp.headers)
+        if self.size is not None:
+            # Размер известен — части читаются Range-запросами, как после HEAD
+            resp.close()
+            return
+        data = _read_bounded(resp, MAX_PROXY_BYTES + 1)
+        if len(data) > MAX_PROXY_BYTES:
+            raise UpstreamTooLarge()
+        self.data = data
+        self.size = len(data)
+
+    def open(self, start: int, end: int):
+        if self.data is not None:
+            return io.BytesIO(self.data[start:end + 1])
+        req = urllib.request.Request(self.url, headers={'User-Agent': 'Mozilla/5.0', 'Range': f'bytes={start}-{end}'})
+        resp = urllib.request.urlopen(req, timeout=20)
+        if resp.status == 200 and start:
+            # Сервер не поддержал Range — пропускаем начало потоком
+            skip = start
+            while skip:
+                skipped = len(resp.read(min(skip, READ_CHUNK_BYTES)))
+                if not skipped:
+                    break
+                skip -= skipped
+        return resp
+
+
+def _parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _read_bounded(body, length: int) -> bytes:
+    '''Читает ровно length байт порциями READ_CHUNK_BYTES, не держа лишнего в памяти'''
+    parts = []
+    remaining = length
+    try:
+        while remaining > 0:
+            chunk = body.read(min(remaining, READ_CHUNK_BYTES))
+            if not chunk:
+                break
+            parts.append(chunk)
+            remaining -= len(chunk)
+    finally:
+        body.close()
+    return b''.join(parts)
+
+
+def _not_modified(event: dict, source) -> bool:
+    if_none_match = _header(event, 'If-None-Match')
+    if if_none_match:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return source.etag is not None and ('*' in tags or source.etag in tags or f'W/{source.etag}' in tags)
+    if_modified_since = _parse_http_date(_header(event, 'If-Modified-Since'))
+    if if_modified_since and source.last_modified:
+        return source.last_modified.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+def _parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    '''
+    Один диапазон из заголовка Range: (start, end) включительно.
+    None — заголовка нет или он не поддерживается (отдаём файл целиком);
+    ValueError — диапазон за пределами файла.
+    '''
+    match = RANGE_RE.match(value.replace(' ', ''))
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            raise ValueError('empty suffix range')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('range not satisfiable')
+    return start, end
+
+
+def _validators(source) -> dict:
+    headers = {}
+    if source.etag:
+        headers['ETag'] = source.etag
+    if source.last_modified:
+        headers['Last-Modified'] = format_datetime(source.last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def _redirect(s3, source: BucketSource, disposition: str) -> dict:
+    location = s3.generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': S3_BUCKET,
+            'Key': source.key,
+            'ResponseContentDisposition': disposition,
+            'ResponseContentType': source.content_type,
+        },
+        ExpiresIn=DOWNLOAD_URL_TTL
+    )
+    return {
+        'statusCode': 302,
+        'headers': {**CORS_HEADERS, 'Location': location, 'Cache-Control': 'private, no-store'},
+        'body': '',
+    }
+
+
 def handler(event: dict, context) -> dict:
-    '''Прокси-скачивание файла: тянет файл по url, возвращает с Content-Disposition: attachment, чтобы браузер скачал, а не открыл.'''
+    '''
+    Скачивание файла с Content-Disposition: attachment, чтобы браузер скачал, а не открыл.
+    mode=redirect — короткоживущая подписанная ссылка на объект бакета (302), файл
+    через функцию не проходит. По умолчанию — прокси с поддержкой Range: за один
+    ответ отдаётся не больше MAX_PROXY_BYTES, больший файл без Range перенаправляется
+    на подписанную ссылку. ETag/Last-Modified позволяют повторным запросам получать 304.
+    '''
 
     if event.get('httpMethod') == 'OPTIONS':
         return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
     if event.get('httpMethod') != 'GET':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-            'body': '{"error":"Method not allowed"}'
-        }
+        return _error(405, 'Method not allowed')
 
     qs = event.get('queryStringParameters') or {}
     url = qs.get('url', '')
     suggested = qs.get('name', '') or 'file'
+    mode = qs.get('mode', 'proxy')
 
     if not url:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-            'body': '{"error":"Missing url param"}'
-        }
+        return _error(400, 'Missing url param')
 
     if not (url.startswith('https://cdn.poehali.dev/') or url.startswith('https://bucket.poehali.dev/')):
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-            'body': '{"error":"URL domain not allowed"}'
-        }
+        return _error(400, 'URL domain not allowed')
+
+    if mode not in ('proxy', 'redirect'):
+        return _error(400, 'mode must be proxy or redirect')
+
+    ascii_name = _safe_ascii_name(suggested)
+    utf8_name = urllib.parse.quote(suggested, safe='')
+    disposition = f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{utf8_name}"
+
+    key = _bucket_key(url)
+    s3 = _get_s3() if key else None
+    if mode == 'redirect' and not key:
+        return _error(400, 'Redirect is available only for files of this project')
 
     try:
-        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            data = resp.read()
-            content_type = resp.headers.get('Content-Type', 'application/octet-stream')
+        source = BucketSource(s3, key) if key else UrlSource(url)
+    except urllib.error.HTTPError as e:
+        return _error(404 if e.code == 404 else 502, f'Upstream fetch failed: HTTP {e.code}')
+    except UpstreamTooLarge:
+        return _error(413, f'File is larger than {MAX_PROXY_BYTES} bytes and upstream does not report its size')
     except Exception as e:
+        if key and getattr(e, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return _error(404, 'File not found')
+        return _error(502, f'Upstream fetch failed: {str(e)[:200]}')
+
+    validators = _validators(source)
+    if _not_modified(event, source):
         return {
-            'statusCode': 502,
-            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-            'body': f'{{"error":"Upstream fetch failed: {str(e)[:200]}"}}'
+            'statusCode': 304,
+            'headers': {**CORS_HEADERS, **validators, 'Cache-Control': 'private, max-age=60'},
+            'body': '',
         }
 
-    ascii_name = _safe_ascii_name(suggested)
-    utf8_name = urllib.parse.quote(suggested, safe='')
-    disposition = f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{utf8_name}"
+    if mode == 'redirect':
+        return _redirect(s3, source, disposition)
+
+    byte_range = None
+    range_header = _header(event, 'Range')
+    if_range = _header(event, 'If-Range')
+    # If-Range с устаревшим валидатором — клиент должен получить файл заново целиком
+    if range_header and (not if_range or if_range == source.etag or if_range == validators.get('Last-Modified')):
+        try:
+            byte_range = _parse_range(range_header, source.size)
+        except ValueError:
+            return _error(416, 'Range not satisfiable', {'Content-Range': f'bytes */{source.size}'})
+
+    if byte_range is None and source.size > MAX_PROXY_BYTES:
+        if key:
+            return _redirect(s3, source, disposition)
+        return _error(413, f'File is larger than {MAX_PROXY_BYTES} bytes, request it by Range',
+                      {'Accept-Ranges': 'bytes', **validators})
+
+    start, end = byte_range if byte_range else (0, source.size - 1)
+    # Каждый ответ ограничен MAX_PROXY_BYTES: клиент дочитывает следующими Range-запросами
+    end = min(end, start + MAX_PROXY_BYTES - 1)
+
+    try:
+        data = _read_bounded(source.open(start, end), end - start + 1) if source.size else b''
+    except Exception as e:
+        return _error(502, f'Upstream fetch failed: {str(e)[:200]}')
+
+    headers = {
+        **CORS_HEADERS,
+        **validators,
+        'Content-Type': source.content_type,
+        'Content-Disposition': disposition,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=60',
+    }
+    status = 200
+    if byte_range is not None:
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{start + len(data) - 1}/{source.size}'
 
     return {
-        'statusCode': 200,
-        'headers': {
-            **CORS_HEADERS,
-            'Content-Type': content_type,
-            'Content-Disposition': disposition,
-            'Cache-Control': 'private, max-age=60',
-        },
+        'statusCode': status,
+        'headers': headers,
         'body': base64.b64encode(data).decode('utf-8'),
         'isBase64Encoded': True,
     }
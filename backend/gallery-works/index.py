@@ -2,6 +2,10 @@ import json
 import os
 import psycopg2
 
+from file_previews import fetch_previews
+
+SCHEMA = 't_p61788166_html_to_frontend'
+
 def handler(event: dict, context) -> dict:
     '''API для получения работ галереи. ?featured=true — только лучшие работы (для главной). Без параметра — все с согласием на публикацию.'''
     method = event.get('httpMethod', 'GET')
@@ -49,6 +53,7 @@ def handler(event: dict, context) -> dict:
                 """)
 
             rows = cur.fetchall()
+            previews_map = fetch_previews(cur, SCHEMA, [row[5] for row in rows])
             works = []
             for row in rows:
                 works.append({
@@ -58,6 +63,7 @@ def handler(event: dict, context) -> dict:
                     'work_title': row[3],
                     'contest_name': row[4],
                     'work_file_url': row[5],
+                    'work_file_previews': previews_map.get(row[5]),
                     'result': row[6],
                     'created_at': row[7].isoformat() if row[7] else None
                 })
@@ -0,0 +1,240 @@
+"""
+Кэш картинок шаблона справки (логотип, подпись с печатью). Три уровня:
+LRU в памяти процесса, ограниченный суммарным размером; файлы в /tmp —
+переживают повторные вызовы тёплого контейнера и общие для процессов
+пакетного пула; копия в бакете — переживает холодный старт, так что
+справка собирается, даже если сторонний хост картинки недоступен.
+
+Версия картинки — её ETag (или Last-Modified): данные хранятся по ключу
+«URL + ETag», а отдельная запись-указатель хранит текущую версию для URL.
+Старше REVALIDATE_AFTER указатель проверяется условным запросом
+(If-None-Match / If-Modified-Since): 304 только продлевает его, а при
+ошибке сети отдаётся последняя известная версия.
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from certificate_cache import S3_BUCKET, get_s3
+
+ASSET_PREFIX = 'asset-cache/'
+DISK_DIR = os.path.join(tempfile.gettempdir(), 'certificate-assets')
+MAX_MEMORY_BYTES = 16 * 1024 * 1024
+MAX_DISK_BYTES = 64 * 1024 * 1024
+MAX_ASSET_BYTES = 10 * 1024 * 1024
+REVALIDATE_AFTER = 24 * 3600
+# После неудачной проверки источник не запрашивается снова столько секунд
+RETRY_AFTER = 300
+FETCH_TIMEOUT = 5
+
+
+def log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+class BytesLRU:
+    """LRU по суммарному размеру значений"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items: 'OrderedDict[str, bytes]' = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self.items.get(key)
+        if data is not None:
+            self.items.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        old = self.items.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.items[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.size -= len(evicted)
+
+
+_memory = BytesLRU(MAX_MEMORY_BYTES)
+# URL -> {'version', 'etag', 'last_modified', 'checked_at'}
+_pointers: Dict[str, Dict[str, Any]] = {}
+_s3 = None
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def _data_name(url: str, version: str) -> str:
+    return _digest(f'{url}#{version}')
+
+
+def _bucket():
+    global _s3
+    if _s3 is None:
+        _s3 = get_s3()
+    return _s3
+
+
+def _write_file(path: str, data: bytes) -> None:
+    """Атомарная запись: процессы пула могут читать тот же файл одновременно"""
+    os.makedirs(DISK_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=DISK_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read_file(path: str) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _prune_disk() -> None:
+    """Удаляет самые старые файлы данных, пока кэш на диске больше MAX_DISK_BYTES"""
+    try:
+        files = [os.path.join(DISK_DIR, name) for name in os.listdir(DISK_DIR) if name.endswith('.bin')]
+        stats = sorted(((os.stat(path), path) for path in files), key=lambda item: item[0].st_mtime)
+    except OSError:
+        return
+    total = sum(stat.st_size for stat, _ in stats)
+    for stat, path in stats:
+        if total <= MAX_DISK_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= stat.st_size
+        except OSError:
+            pass
+
+
+def _load_pointer(url: str) -> Optional[Dict[str, Any]]:
+    pointer = _pointers.get(url)
+    if pointer is not None:
+        return pointer
+    raw = _read_file(os.path.join(DISK_DIR, f'{_digest(url)}.json'))
+    if raw is None:
+        try:
+            raw = _bucket().get_object(Bucket=S3_BUCKET, Key=f'{ASSET_PREFIX}{_digest(url)}.json')['Body'].read()
+        except Exception:
+            return None
+    try:
+        pointer = json.loads(raw)
+    except ValueError:
+        return None
+    _pointers[url] = pointer
+    return pointer
+
+
+def _load_data(url: str, version: str) -> Optional[bytes]:
+    name = _data_name(url, version)
+    data = _memory.get(name)
+    if data is not None:
+        return data
+    path = os.path.join(DISK_DIR, f'{name}.bin')
+    data = _read_file(path)
+    if data is None:
+        try:
+            data = _bucket().get_object(Bucket=S3_BUCKET, Key=f'{ASSET_PREFIX}{name}')['Body'].read()
+        except Exception:
+            return None
+        try:
+            _write_file(path, data)
+            _prune_disk()
+        except OSError as e:
+            log(f"[assets] disk cache write failed: {e}")
+    _memory.put(name, data)
+    return data
+
+
+def _save_pointer(url: str, pointer: Dict[str, Any], to_bucket: bool) -> None:
+    _pointers[url] = pointer
+    raw = json.dumps(pointer).encode('utf-8')
+    try:
+        _write_file(os.path.join(DISK_DIR, f'{_digest(url)}.json'), raw)
+    except OSError as e:
+        log(f"[assets] disk cache write failed: {e}")
+    if to_bucket:
+        try:
+            _bucket().put_object(Bucket=S3_BUCKET, Key=f'{ASSET_PREFIX}{_digest(url)}.json',
+                                 Body=raw, ContentType='application/json')
+        except Exception as e:
+            log(f"[assets] bucket write failed for {url}: {e}")
+
+
+def _save_data(url: str, version: str, data: bytes, content_type: Optional[str]) -> None:
+    name = _data_name(url, version)
+    _memory.put(name, data)
+    try:
+        _write_file(os.path.join(DISK_DIR, f'{name}.bin'), data)
+        _prune_disk()
+    except OSError as e:
+        log(f"[assets] disk cache write failed: {e}")
+    try:
+        _bucket().put_object(Bucket=S3_BUCKET, Key=f'{ASSET_PREFIX}{name}', Body=data,
+                             ContentType=content_type or 'application/octet-stream')
+    except Exception as e:
+        log(f"[assets] bucket write failed for {url}: {e}")
+
+
+def _fetch(url: str, pointer: Optional[Dict[str, Any]]):
+    """(данные, заголовки) новой версии или (None, None), если источник ответил 304"""
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    if pointer and pointer.get('etag'):
+        headers['If-None-Match'] = pointer['etag']
+    if pointer and pointer.get('last_modified'):
+        headers['If-Modified-Since'] = pointer['last_modified']
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=FETCH_TIMEOUT) as resp:
+            data = resp.read(MAX_ASSET_BYTES + 1)
+            if len(data) > MAX_ASSET_BYTES:
+                raise ValueError(f'{url} is larger than {MAX_ASSET_BYTES} bytes')
+            return data, resp.headers
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, None
+        raise
+
+
+def get(url: str) -> bytes:
+    """Содержимое картинки по URL через кэш; источник запрашивается, только если версия устарела"""
+    pointer = _load_pointer(url)
+    cached = _load_data(url, pointer['version']) if pointer else None
+    if cached is not None and time.time() - pointer['checked_at'] < REVALIDATE_AFTER:
+        return cached
+
+    try:
+        data, headers = _fetch(url, pointer if cached is not None else None)
+    except Exception as e:
+        if cached is not None:
+            log(f"[assets] revalidation of {url} failed, using cached copy: {e}")
+            _save_pointer(url, {**pointer, 'checked_at': time.time() - REVALIDATE_AFTER + RETRY_AFTER}, to_bucket=False)
+            return cached
+        raise
+
+    if data is None:
+        _save_pointer(url, {**pointer, 'checked_at': time.time()}, to_bucket=False)
+        return cached
+
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    version = etag or last_modified or hashlib.sha256(data).hexdigest()
+    _save_data(url, version, data, headers.get('Content-Type'))
+    _save_pointer(url, {'version': version, 'etag': etag, 'last_modified': last_modified,
+                        'checked_at': time.time()}, to_bucket=True)
+    return data
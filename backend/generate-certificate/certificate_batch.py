@@ -0,0 +1,145 @@
+"""
+Пакетная выдача справок. Пакет собирается по шагам: каждый шаг рендерит
+BATCH_STEP_SIZE справок в пуле процессов (шрифты и картинки шаблона
+загружаются один раз на процесс — инициализатор пула) и кладёт их в кэш
+справок, последний шаг читает их из кэша и дописывает в ZIP, который
+потоком уходит в бакет частями multipart upload — в памяти одновременно
+одна часть архива, а не весь архив. В архиве персональные данные, поэтому
+ключ содержит случайную часть, а скачивают его по короткой подписанной ссылке.
+"""
+import multiprocessing
+import secrets
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from certificate_cache import S3_BUCKET, CERT_PREFIX
+
+BATCH_PREFIX = f'{CERT_PREFIX}batches/'
+PART_SIZE = 8 * 1024 * 1024
+POOL_SIZE = 4
+MAP_CHUNK_SIZE = 8
+MAX_BATCH_SIZE = 5000
+# Справок за один шаг задания: шаг должен укладываться в таймаут функции
+BATCH_STEP_SIZE = 200
+# Задание без шагов дольше этого считается прерванным
+STALE_MINUTES = 10
+FETCH_THREADS = 16
+# Сколько справок читается из кэша впереди записи в архив
+FETCH_WINDOW = 64
+# Срок жизни подписанной ссылки на готовый архив, секунды
+ZIP_URL_TTL = 300
+
+
+class MultipartWriter:
+    """
+    Файлоподобный объект для записи в S3 (как MultipartWriter в backup_stream):
+    данные копятся до PART_SIZE и отправляются очередной частью multipart upload.
+    Без tell/seek — zipfile в таком случае пишет архив последовательно.
+    """
+
+    def __init__(self, s3, key: str, content_type: str):
+        self.s3 = s3
+        self.key = key
+        self.upload_id = s3.create_multipart_upload(
+            Bucket=S3_BUCKET, Key=key, ContentType=content_type
+        )['UploadId']
+        self.parts: List[Dict[str, Any]] = []
+        self.buffer = bytearray()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= PART_SIZE:
+            self._upload_part(bytes(self.buffer[:PART_SIZE]))
+            del self.buffer[:PART_SIZE]
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _upload_part(self, body: bytes) -> None:
+        number = len(self.parts) + 1
+        resp = self.s3.upload_part(
+            Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id,
+            PartNumber=number, Body=body
+        )
+        self.parts.append({'PartNumber': number, 'ETag': resp['ETag']})
+
+    def complete(self) -> None:
+        if self.buffer or not self.parts:
+            self._upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.s3.complete_multipart_upload(
+            Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+
+    def abort(self) -> None:
+        try:
+            self.s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id)
+        except Exception:
+            pass
+
+
+def batch_key(batch_id: int, name: str) -> str:
+    """Ключ архива: по номеру пакета и конкурса его не угадать"""
+    return f'{BATCH_PREFIX}{batch_id}-{secrets.token_hex(16)}/{name}.zip'
+
+
+def zip_url(s3, key: str, disposition: str) -> str:
+    return s3.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': S3_BUCKET, 'Key': key, 'ResponseContentDisposition': disposition,
+                'ResponseContentType': 'application/zip'},
+        ExpiresIn=ZIP_URL_TTL
+    )
+
+
+def render_all(render: Callable, initializer: Callable, items: List[Any]) -> Iterator:
+    """
+    Результаты render по элементам items в исходном порядке. Пул запускается
+    через spawn, чтобы дочерние процессы не унаследовали соединение с БД;
+    если среда не даёт создавать процессы, всё рендерится в текущем.
+    """
+    try:
+        pool = ProcessPoolExecutor(max_workers=min(POOL_SIZE, max(len(items), 1)),
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=initializer)
+    except (OSError, NotImplementedError):
+        initializer()
+        yield from map(render, items)
+        return
+    with pool:
+        yield from pool.map(render, items, chunksize=MAP_CHUNK_SIZE)
+
+
+def fetch_all(fetch: Callable, items: List[Any]) -> Iterator:
+    """
+    Результаты fetch по элементам items в исходном порядке. fetch — чтение
+    из бакета, поэтому в потоках; вперёд читается не больше FETCH_WINDOW
+    элементов, чтобы весь пакет не оказался в памяти.
+    """
+    with ThreadPoolExecutor(max_workers=FETCH_THREADS) as pool:
+        for start in range(0, len(items), FETCH_WINDOW):
+            yield from pool.map(fetch, items[start:start + FETCH_WINDOW])
+
+
+def write_zip(s3, key: str, files: Iterable[Tuple[str, bytes]]) -> int:
+    """
+    Пишет файлы в ZIP прямо в бакет. PDF уже сжаты, поэтому хранятся без
+    повторного сжатия (ZIP_STORED). Возвращает число файлов в архиве.
+    """
+    writer = MultipartWriter(s3, key, 'application/zip')
+    count = 0
+    try:
+        with zipfile.ZipFile(writer, 'w', zipfile.ZIP_STORED) as zf:
+            for name, data in files:
+                zf.writestr(name, data)
+                count += 1
+        writer.complete()
+    except Exception:
+        writer.abort()
+        raise
+    return count
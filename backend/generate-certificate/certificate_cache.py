@@ -0,0 +1,72 @@
+"""
+Кэш готовых PDF-справок в бакете. Ключ — id результата и отпечаток всех
+данных, попадающих в справку: поля строки results, дата выдачи и версия
+шаблона. Изменённая строка results даёт другой отпечаток, поэтому устаревший
+PDF никогда не отдаётся; при сохранении новой версии прежние копии той же
+справки удаляются, и в бакете остаётся по одному файлу на результат.
+"""
+import hashlib
+import json
+import os
+from typing import Optional
+
+import boto3
+
+S3_BUCKET = 'files'
+CERT_PREFIX = 'certificates/'
+
+
+def get_s3():
+    return boto3.client('s3',
+        endpoint_url='https://bucket.poehali.dev',
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
+    )
+
+
+def cdn_url(key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ.get('AWS_ACCESS_KEY_ID')}/bucket/{key}"
+
+
+def fingerprint(result: dict, issued: str, template: dict) -> str:
+    raw = json.dumps({'result': result, 'issued': issued, 'template': template},
+                     sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def cache_key(result_id, fp: str) -> str:
+    return f'{CERT_PREFIX}{result_id}/{fp}.pdf'
+
+
+def _missing(e: Exception) -> bool:
+    return getattr(e, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+
+def exists(s3, key: str) -> bool:
+    try:
+        s3.head_object(Bucket=S3_BUCKET, Key=key)
+        return True
+    except Exception as e:
+        if _missing(e):
+            return False
+        raise
+
+
+def load(s3, key: str) -> Optional[bytes]:
+    try:
+        return s3.get_object(Bucket=S3_BUCKET, Key=key)['Body'].read()
+    except Exception as e:
+        if _missing(e):
+            return None
+        raise
+
+
+def store(s3, key: str, pdf: bytes, disposition: str) -> None:
+    """Сохраняет PDF и удаляет прежние версии справки того же результата"""
+    s3.put_object(Bucket=S3_BUCKET, Key=key, Body=pdf, ContentType='application/pdf',
+                  ContentDisposition=disposition)
+    prefix = key.rsplit('/', 1)[0] + '/'
+    listing = s3.list_objects_v2(Bucket=S3_BUCKET, Prefix=prefix)
+    stale = [{'Key': obj['Key']} for obj in listing.get('Contents', []) if obj['Key'] != key]
+    if stale:
+        s3.delete_objects(Bucket=S3_BUCKET, Delete={'Objects': stale, 'Quiet': True})
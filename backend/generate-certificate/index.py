@@ -1,10 +1,12 @@
 import json
 import os
 import base64
-import urllib.request
 import tempfile
+import sys
+import urllib.parse
+import jwt
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from io import BytesIO
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
@@ -15,6 +17,13 @@ from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from datetime import date
+from typing import Optional
+
+import asset_cache
+import certificate_cache
+from certificate_batch import (
+    BATCH_STEP_SIZE, MAX_BATCH_SIZE, STALE_MINUTES, batch_key, fetch_all, render_all, write_zip, zip_url,
+)
 
 
 RESULT_LABELS = {
@@ -45,16 +54,13 @@ RESULT_COLORS = {
 LOGO_URL      = 'https://cdn.poehali.dev/projects/117fa0d8-5c6b-45ca-a517-e66143c3f4b1/bucket/2aa89901-38a4-48dd-b954-f55aec2d1508.png'
 SIGN_STAMP_URL = 'https://cdn.poehali.dev/projects/117fa0d8-5c6b-45ca-a517-e66143c3f4b1/bucket/57089395-3617-4837-8eb4-5a611478b79f.png'
 
-_img_cache: dict = {}
+SCHEMA = 't_p61788166_html_to_frontend'
+
+# Увеличивать при любом изменении вёрстки справки — закэшированные PDF перестанут отдаваться
+TEMPLATE_VERSION = 1
 
 def fetch_image(url: str) -> BytesIO:
-    if url in _img_cache:
-        return BytesIO(_img_cache[url])
-    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-    with urllib.request.urlopen(req, timeout=15) as resp:
-        data = resp.read()
-    _img_cache[url] = data
-    return BytesIO(data)
+    return BytesIO(asset_cache.get(url))
 
 _fonts_registered = False
 
@@ -91,7 +97,7 @@ def ensure_fonts():
     )
 
 
-def build_pdf(result: dict) -> bytes:
+def build_pdf(result: dict, issued: date = None) -> bytes:
     ensure_fonts()
 
     F = 'DejaVu'
@@ -127,7 +133,7 @@ def build_pdf(result: dict) -> bytes:
     result_label = RESULT_LABELS.get(result_value, result_value)
     result_color = RESULT_COLORS.get(result_value, COLORS['accent'])
 
-    issued_str = date.today().strftime('%d.%m.%Y')
+    issued_str = (issued or date.today()).strftime('%d.%m.%Y')
 
     created_at = result.get('created_at', '')
     try:
@@ -256,8 +262,363 @@ def build_pdf(result: dict) -> bytes:
     return buffer.getvalue()
 
 
+def log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def content_disposition(filename: str) -> str:
+    ascii_name = filename.encode('ascii', 'replace').decode('ascii').replace('?', '_').replace('"', '_')
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{urllib.parse.quote(filename, safe='')}"
+
+
+def certificate_fingerprint(result: dict, issued: date) -> str:
+    template = {'version': TEMPLATE_VERSION, 'logo': LOGO_URL, 'sign_stamp': SIGN_STAMP_URL}
+    return certificate_cache.fingerprint(result, issued.isoformat(), template)
+
+
+RESULT_COLUMNS = (
+    'id, full_name, age, teacher, institution, work_title, '
+    'contest_name, result, diploma_issued_at, created_at'
+)
+
+
+def serialize_result(result) -> dict:
+    result = dict(result)
+    result['diploma_issued_at'] = result['diploma_issued_at'].isoformat() if result.get('diploma_issued_at') else None
+    result['created_at'] = result['created_at'].isoformat() if result.get('created_at') else None
+    return result
+
+
+def certificate_filename(result: dict) -> str:
+    full_name_safe = (result.get('full_name') or 'certificate').replace(' ', '_')
+    return f"certificate_{result['id']}_{full_name_safe}.pdf"
+
+
+def json_response(status: int, body: dict) -> dict:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(body, ensure_ascii=False, default=str),
+        'isBase64Encoded': False,
+    }
+
+
+_worker_s3 = None
+
+
+def warm_up():
+    '''Шрифты и картинки шаблона загружаются заранее, чтобы первая справка не ждала их'''
+    try:
+        ensure_fonts()
+    except Exception as e:
+        log(f"[certificate] fonts unavailable: {e}")
+    for url in (LOGO_URL, SIGN_STAMP_URL):
+        try:
+            fetch_image(url)
+        except Exception as e:
+            log(f"[certificate] template image {url} unavailable: {e}")
+
+
+def init_batch_worker():
+    '''Инициализатор процесса пакетного рендера: шрифты, картинки шаблона и клиент S3 — один раз на процесс'''
+    global _worker_s3
+    warm_up()
+    try:
+        _worker_s3 = certificate_cache.get_s3()
+    except Exception as e:
+        log(f"[certificate] S3 unavailable, batch renders without cache: {e}")
+
+
+def render_for_batch(item) -> tuple:
+    '''Справка для пакета: (имя файла в архиве, PDF). Использует и пополняет тот же кэш, что и выдача по одной'''
+    result, issued_iso = item
+    issued = date.fromisoformat(issued_iso)
+    key = certificate_cache.cache_key(result['id'], certificate_fingerprint(result, issued))
+    pdf_bytes = None
+    if _worker_s3 is not None:
+        try:
+            pdf_bytes = certificate_cache.load(_worker_s3, key)
+        except Exception as e:
+            log(f"[certificate] cache read failed for {key}: {e}")
+    if pdf_bytes is None:
+        pdf_bytes = build_pdf(result, issued)
+        if _worker_s3 is not None:
+            try:
+                certificate_cache.store(_worker_s3, key, pdf_bytes, content_disposition(certificate_filename(result)))
+            except Exception as e:
+                log(f"[certificate] cache write failed for {key}: {e}")
+    return certificate_filename(result), pdf_bytes
+
+
+def parse_batch_request(body: dict):
+    '''(contest_id, result_ids) из тела запроса; ValueError — с текстом ошибки для ответа'''
+    if not isinstance(body, dict):
+        raise ValueError('Invalid JSON')
+    contest_id = body.get('contest_id')
+    result_ids = body.get('result_ids')
+    if (contest_id is None) == (result_ids is None):
+        raise ValueError('Нужно указать contest_id или result_ids')
+    if contest_id is not None:
+        if not isinstance(contest_id, int) or isinstance(contest_id, bool):
+            raise ValueError('contest_id должен быть числом')
+        return contest_id, None
+    if (not isinstance(result_ids, list) or not result_ids
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in result_ids)):
+        raise ValueError('result_ids должен быть непустым списком чисел')
+    if len(result_ids) > MAX_BATCH_SIZE:
+        raise ValueError(f'Не больше {MAX_BATCH_SIZE} справок за раз')
+    return None, sorted(set(result_ids))
+
+
+def verify_token(event: dict) -> Optional[dict]:
+    headers = event.get('headers') or {}
+    token = (headers.get('X-Auth-Token') or
+             headers.get('x-auth-token') or
+             headers.get('X-Authorization') or
+             headers.get('x-authorization', ''))
+    if token:
+        token = token.replace('Bearer ', '').strip()
+    if not token:
+        return None
+    try:
+        secret = os.environ.get('JWT_SECRET')
+        if not secret:
+            return None
+        return jwt.decode(token, secret, algorithms=['HS256'])
+    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
+        return None
+
+
+def is_admin(conn, user_id: int) -> bool:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT COUNT(*) as cnt FROM {SCHEMA}.roles r
+            JOIN {SCHEMA}.user_roles ur ON r.id = ur.role_id
+            WHERE ur.user_id = %s AND r.name IN ('Администратор', 'Admin')
+        """, (user_id,))
+        row = cur.fetchone()
+        return row['cnt'] > 0 if row else False
+
+
+def load_results(conn, result_ids: list) -> list:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'SELECT {RESULT_COLUMNS} FROM results WHERE id = ANY(%s) ORDER BY id', (result_ids,))
+        return [serialize_result(row) for row in cur.fetchall()]
+
+
+def fail_stale_batches(conn) -> None:
+    '''
+    Задания без шагов дольше STALE_MINUTES помечаются failed. Строку, которую
+    сейчас держит шаг (FOR UPDATE), пропускаем — это задание живое.
+    '''
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE certificate_batches SET status = 'failed', error = %s, finished_at = NOW() "
+            "WHERE id IN (SELECT id FROM certificate_batches WHERE status = 'running' "
+            "AND updated_at < NOW() - %s * INTERVAL '1 minute' FOR UPDATE SKIP LOCKED)",
+            (f'Задание прервано: шагов не было больше {STALE_MINUTES} минут', STALE_MINUTES)
+        )
+    conn.commit()
+
+
+def handle_batch(event: dict, conn) -> dict:
+    '''
+    Создаёт задание на ZIP со справками конкурса (contest_id) или списка
+    результатов (result_ids) и сразу возвращает batch_id. Справки рендерятся
+    шагами POST action=batch_step, поэтому ни один запрос не упирается в таймаут функции.
+    '''
+    try:
+        contest_id, result_ids = parse_batch_request(json.loads(event.get('body') or '{}'))
+    except ValueError as e:
+        return json_response(400, {'error': 'Invalid JSON' if isinstance(e, json.JSONDecodeError) else str(e)})
+
+    with conn.cursor() as cur:
+        if contest_id is not None:
+            cur.execute('SELECT id FROM results WHERE contest_id = %s ORDER BY id', (contest_id,))
+        else:
+            cur.execute('SELECT id FROM results WHERE id = ANY(%s) ORDER BY id', (result_ids,))
+        ids = [row[0] for row in cur.fetchall()]
+
+    if not ids:
+        return json_response(404, {'error': 'Results not found'})
+    if len(ids) > MAX_BATCH_SIZE:
+        return json_response(400, {'error': f'Не больше {MAX_BATCH_SIZE} справок за раз'})
+
+    with conn.cursor() as cur:
+        cur.execute(
+            'INSERT INTO certificate_batches (contest_id, result_ids, total) VALUES (%s, %s, %s) RETURNING id',
+            (contest_id, ids, len(ids))
+        )
+        batch_id = cur.fetchone()[0]
+    conn.commit()
+
+    return json_response(202, {'batch_id': batch_id, 'status': 'running', 'total': len(ids), 'done': 0})
+
+
+def cached_for_batch(item) -> Optional[bytes]:
+    '''PDF справки из кэша; None — справку нужно отрендерить'''
+    result, issued_iso = item
+    key = certificate_cache.cache_key(result['id'], certificate_fingerprint(result, date.fromisoformat(issued_iso)))
+    try:
+        return certificate_cache.load(_worker_s3, key) if _worker_s3 is not None else None
+    except Exception as e:
+        log(f"[certificate] cache read failed for {key}: {e}")
+        return None
+
+
+def zip_files(items: list):
+    '''(имя, PDF) для архива: справки, отрендеренные шагами, читаются из кэша; пропавшие из него рендерятся заново'''
+    for item, pdf_bytes in zip(items, fetch_all(cached_for_batch, items)):
+        yield (certificate_filename(item[0]), pdf_bytes) if pdf_bytes is not None else render_for_batch(item)
+
+
+def run_batch_step(conn, batch: dict) -> None:
+    '''
+    Шаг задания: следующие BATCH_STEP_SIZE справок рендерятся в кэш справок;
+    когда отрендерены все, шаг собирает из кэша ZIP и добавляет записи
+    certificates_log по всему пакету одним INSERT.
+    '''
+    issued = batch['issued_on'].isoformat()
+    if batch['done'] < batch['total']:
+        ids = batch['result_ids'][batch['done']:batch['done'] + BATCH_STEP_SIZE]
+        for _ in render_all(render_for_batch, init_batch_worker, [(r, issued) for r in load_results(conn, ids)]):
+            pass
+        with conn.cursor() as cur:
+            cur.execute(
+                'UPDATE certificate_batches SET done = %s, updated_at = NOW() WHERE id = %s',
+                (batch['done'] + len(ids), batch['id'])
+            )
+        conn.commit()
+        return
+
+    results = load_results(conn, batch['result_ids'])
+    contest_id = batch['contest_id']
+    name = f'certificates_contest_{contest_id}' if contest_id is not None else f"certificates_batch_{batch['id']}"
+    key = batch_key(batch['id'], name)
+    init_batch_worker()
+    count = write_zip(certificate_cache.get_s3(), key, zip_files([(r, issued) for r in results]))
+
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            'INSERT INTO certificates_log (result_id, full_name, contest_name) VALUES %s',
+            [(r['id'], r.get('full_name') or '', r.get('contest_name') or '') for r in results],
+            page_size=max(len(results), 1)
+        )
+        cur.execute(
+            "UPDATE certificate_batches SET status = 'done', done = %s, zip_key = %s, "
+            "updated_at = NOW(), finished_at = NOW() WHERE id = %s",
+            (count, key, batch['id'])
+        )
+    conn.commit()
+
+
+def parse_batch_id(params: dict) -> Optional[int]:
+    try:
+        return int(params.get('batch_id') or '')
+    except ValueError:
+        return None
+
+
+def handle_batch_step(params: dict, conn) -> dict:
+    '''
+    Выполняет очередной шаг задания и возвращает его состояние. Клиент
+    повторяет запрос, пока status = running. Строка задания блокируется
+    на время шага (FOR UPDATE SKIP LOCKED): параллельный запрос шаг не
+    выполняет и просто получает текущий прогресс.
+    '''
+    batch_id = parse_batch_id(params)
+    if batch_id is None:
+        return json_response(400, {'error': 'Parameter batch_id is required'})
+
+    fail_stale_batches(conn)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            'SELECT id, contest_id, result_ids, status, total, done, issued_on '
+            'FROM certificate_batches WHERE id = %s FOR UPDATE SKIP LOCKED',
+            (batch_id,)
+        )
+        batch = cur.fetchone()
+
+    if batch is not None and batch['status'] == 'running':
+        try:
+            run_batch_step(conn, dict(batch))
+        except Exception as e:
+            log(f"[certificate] batch {batch_id} failed: {e}")
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE certificate_batches SET status = 'failed', error = %s, finished_at = NOW() WHERE id = %s",
+                    (str(e)[:500], batch_id)
+                )
+            conn.commit()
+    else:
+        conn.rollback()
+    return batch_status(conn, batch_id)
+
+
+def handle_batch_status(params: dict, conn) -> dict:
+    batch_id = parse_batch_id(params)
+    if batch_id is None:
+        return json_response(400, {'error': 'Parameter batch_id is required'})
+    fail_stale_batches(conn)
+    return batch_status(conn, batch_id)
+
+
+def batch_status(conn, batch_id: int) -> dict:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            'SELECT id, contest_id, status, total, done, zip_key, error, created_at, updated_at, finished_at '
+            'FROM certificate_batches WHERE id = %s',
+            (batch_id,)
+        )
+        batch = cur.fetchone()
+
+    if not batch:
+        return json_response(404, {'error': 'Batch not found'})
+    batch = dict(batch)
+    zip_key = batch.pop('zip_key')
+    batch['progress'] = round(batch['done'] * 100 / batch['total']) if batch['total'] else 100
+    # Ссылка на архив подписанная и короткая: публичного CDN-адреса у архива нет
+    batch['zip_url'] = zip_url(
+        certificate_cache.get_s3(), zip_key, content_disposition(zip_key.rsplit('/', 1)[-1])
+    ) if zip_key else None
+    return json_response(200, batch)
+
+
+def handle_batch_action(event: dict, method: str, action: str, params: dict) -> dict:
+    '''Пакетная выдача справок — только для администраторов (JWT из X-Auth-Token)'''
+    payload = verify_token(event)
+    if not payload:
+        return json_response(401, {'error': 'Требуется авторизация'})
+
+    conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+    try:
+        if not is_admin(conn, payload['user_id']):
+            return json_response(403, {'error': 'Недостаточно прав. Требуется роль Администратор'})
+        if method == 'POST' and action == 'batch':
+            return handle_batch(event, conn)
+        if method == 'POST' and action == 'batch_step':
+            return handle_batch_step(params, conn)
+        if method == 'GET' and action == 'batch_status':
+            return handle_batch_status(params, conn)
+        return json_response(405, {'error': 'Method not allowed'})
+    finally:
+        conn.close()
+
+
+warm_up()
+
+
 def handler(event: dict, context) -> dict:
-    '''Генерация PDF справки-подтверждения участия в конкурсе по result_id'''
+    '''
+    Генерация PDF справки-подтверждения участия в конкурсе по result_id.
+    Готовые PDF кэшируются в бакете (см. certificate_cache): повторное скачивание
+    неизменённой справки не собирает PDF заново. redirect=1 — вместо тела ответа
+    перенаправление на файл в CDN. POST action=batch — задание на ZIP со справками
+    конкурса или списка результатов, POST action=batch_step&batch_id= — очередной
+    шаг задания, GET action=batch_status&batch_id= — его прогресс (только администраторам).
+    '''
     method = event.get('httpMethod', 'GET')
 
     if method == 'OPTIONS':
@@ -265,13 +626,19 @@ def handler(event: dict, context) -> dict:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-Authorization',
             },
             'body': '',
             'isBase64Encoded': False,
         }
 
+    params = event.get('queryStringParameters') or {}
+    action = params.get('action')
+
+    if action in ('batch', 'batch_step', 'batch_status'):
+        return handle_batch_action(event, method, action, params)
+
     if method != 'GET':
         return {
             'statusCode': 405,
@@ -280,8 +647,8 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False,
         }
 
-    params = event.get('queryStringParameters') or {}
     result_id = params.get('id')
+    redirect = params.get('redirect') == '1'
 
     if not result_id:
         return {
@@ -296,12 +663,7 @@ def handler(event: dict, context) -> dict:
 
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                'SELECT id, full_name, age, teacher, institution, work_title, '
-                'contest_name, result, diploma_issued_at, created_at '
-                'FROM results WHERE id = %s',
-                (result_id,)
-            )
+            cur.execute(f'SELECT {RESULT_COLUMNS} FROM results WHERE id = %s', (result_id,))
             result = cur.fetchone()
 
         if not result:
@@ -312,11 +674,34 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False,
             }
 
-        result['diploma_issued_at'] = result['diploma_issued_at'].isoformat() if result.get('diploma_issued_at') else None
-        result['created_at'] = result['created_at'].isoformat() if result.get('created_at') else None
-
-        pdf_bytes = build_pdf(dict(result))
-        pdf_b64 = base64.b64encode(pdf_bytes).decode('utf-8')
+        result = serialize_result(result)
+        disposition = content_disposition(certificate_filename(result))
+
+        # Дата выдачи входит в справку, поэтому и в ключ кэша: PDF живёт в кэше до конца дня
+        issued = date.today()
+        key = certificate_cache.cache_key(result['id'], certificate_fingerprint(dict(result), issued))
+        pdf_bytes = None
+        cached = False
+        s3 = None
+        try:
+            s3 = certificate_cache.get_s3()
+            if redirect:
+                cached = certificate_cache.exists(s3, key)
+            else:
+                pdf_bytes = certificate_cache.load(s3, key)
+                cached = pdf_bytes is not None
+        except Exception as e:
+            log(f"[certificate] cache read failed for {key}: {e}")
+            s3 = None
+
+        if not cached:
+            pdf_bytes = build_pdf(dict(result), issued)
+            if s3 is not None:
+                try:
+                    certificate_cache.store(s3, key, pdf_bytes, disposition)
+                except Exception as e:
+                    log(f"[certificate] cache write failed for {key}: {e}")
+                    s3 = None
 
         # Записываем лог выдачи справки
         with conn.cursor() as log_cur:
@@ -326,19 +711,30 @@ def handler(event: dict, context) -> dict:
             )
             conn.commit()
 
-        full_name_safe = (result.get('full_name') or 'certificate').replace(' ', '_')
-        filename = f'certificate_{result_id}_{full_name_safe}.pdf'
+        cache_status = 'hit' if cached else 'miss'
+        if redirect and s3 is not None:
+            return {
+                'statusCode': 302,
+                'headers': {
+                    'Location': certificate_cache.cdn_url(key),
+                    'Access-Control-Allow-Origin': '*',
+                    'X-Cache': cache_status,
+                },
+                'body': '',
+                'isBase64Encoded': False,
+            }
 
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/pdf',
-                'Content-Disposition': f'attachment; filename="{filename}"',
+                'Content-Disposition': disposition,
                 'Access-Control-Allow-Origin': '*',
+                'X-Cache': cache_status,
             },
-            'body': pdf_b64,
+            'body': base64.b64encode(pdf_bytes).decode('utf-8'),
             'isBase64Encoded': True,
         }
 
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
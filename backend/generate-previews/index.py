@@ -0,0 +1,158 @@
+"""Фоновая генерация превью документов платежей и работ галереи"""
+import json
+import multiprocessing
+import os
+import sys
+import psycopg2
+from psycopg2.extras import RealDictCursor, Json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List
+
+from preview_render import render_source
+
+SCHEMA = 't_p61788166_html_to_frontend'
+
+BATCH_SIZE = 24
+POOL_SIZE = 4
+MAX_ATTEMPTS = 3
+# Файл, взятый в работу дольше этого, считается брошенным (функция упала по таймауту)
+STALE_MINUTES = 15
+
+# Все URL файлов, для которых нужны превью. applications — таблица конкурсов, как и в
+# gallery-works, читается без схемы
+SOURCES_SQL = f"""
+    SELECT file_url AS url FROM {SCHEMA}.payment_documents
+    UNION SELECT invoice_file_url FROM {SCHEMA}.payments
+    UNION SELECT cash_receipt_url FROM {SCHEMA}.payments
+    UNION SELECT file_url FROM {SCHEMA}.payment_cash_receipts
+    UNION SELECT work_file_url FROM applications WHERE deleted_at IS NULL
+"""
+
+def log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type',
+        },
+        'body': json.dumps(body, ensure_ascii=False, default=str),
+        'isBase64Encoded': False
+    }
+
+def get_db():
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+def enqueue_new_files(conn) -> int:
+    """Ставит в очередь файлы, которых ещё нет в file_previews"""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO {SCHEMA}.file_previews (source_url)
+            SELECT url FROM ({SOURCES_SQL}) sources
+            WHERE url IS NOT NULL AND url <> ''
+            ON CONFLICT (source_url) DO NOTHING
+        """)
+        added = cur.rowcount
+    conn.commit()
+    return added
+
+def claim_batch(conn, limit: int) -> List[str]:
+    """
+    Забирает в работу до limit файлов. SKIP LOCKED не даёт двум
+    одновременным запускам взять один файл.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE {SCHEMA}.file_previews
+            SET status = 'processing', attempts = attempts + 1, updated_at = NOW()
+            WHERE source_url IN (
+                SELECT source_url FROM {SCHEMA}.file_previews
+                WHERE status = 'pending'
+                   OR (status = 'failed' AND attempts < %s)
+                   OR (status = 'processing' AND updated_at < NOW() - make_interval(mins => %s))
+                ORDER BY created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING source_url
+        """, (MAX_ATTEMPTS, STALE_MINUTES, limit))
+        urls = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return urls
+
+def render_all(urls: List[str]) -> List[Dict[str, Any]]:
+    """
+    Рендер в пуле процессов (spawn: дочерние процессы не наследуют соединение с БД).
+    Если среда не даёт создавать процессы, файлы обрабатываются по очереди.
+    """
+    if len(urls) < 2:
+        return [render_source(url) for url in urls]
+    try:
+        pool = ProcessPoolExecutor(max_workers=min(POOL_SIZE, len(urls)),
+                                   mp_context=multiprocessing.get_context('spawn'))
+    except (OSError, NotImplementedError) as e:
+        log(f"[previews] process pool unavailable, rendering sequentially: {e}")
+        return [render_source(url) for url in urls]
+    with pool:
+        return list(pool.map(render_source, urls))
+
+def save_results(conn, results: List[Dict[str, Any]]) -> None:
+    with conn.cursor() as cur:
+        for result in results:
+            cur.execute(f"""
+                UPDATE {SCHEMA}.file_previews
+                SET status = %s, sha256 = %s, previews = %s, error = %s, updated_at = NOW()
+                WHERE source_url = %s
+            """, (result['status'], result.get('sha256'),
+                  Json(result['previews']) if result.get('previews') else None,
+                  result.get('error'), result['url']))
+    conn.commit()
+
+def handle_trigger(conn, limit: int):
+    queued = enqueue_new_files(conn)
+    urls = claim_batch(conn, limit)
+    results = render_all(urls)
+    save_results(conn, results)
+    counts: Dict[str, int] = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        if result['status'] == 'failed':
+            log(f"[previews] {result['url']}: {result.get('error')}")
+    return response(200, {'queued': queued, 'processed': len(results), 'results': counts})
+
+def handle_stats(conn):
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"SELECT status, COUNT(*) AS count FROM {SCHEMA}.file_previews GROUP BY status")
+        return response(200, {row['status']: row['count'] for row in cur.fetchall()})
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Превью документов платежей и работ галереи. action=trigger (по расписанию) —
+    ставит новые файлы в очередь и обрабатывает пачку; без action — счётчики по статусам.
+    """
+    method = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return response(200, {})
+
+    params = event.get('queryStringParameters') or {}
+    action = params.get('action', 'stats')
+    if action not in ('trigger', 'stats'):
+        return response(400, {'error': 'Неизвестное действие'})
+
+    try:
+        limit = max(1, min(int(params.get('limit') or BATCH_SIZE), BATCH_SIZE))
+    except ValueError:
+        return response(400, {'error': 'limit должен быть числом'})
+
+    conn = get_db()
+    try:
+        if action == 'trigger':
+            return handle_trigger(conn, limit)
+        return handle_stats(conn)
+    finally:
+        conn.close()
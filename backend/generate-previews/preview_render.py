@@ -0,0 +1,118 @@
+"""
+Построение превью одного файла. Выполняется в дочерних процессах пула
+generate-previews, поэтому не работает с БД и создаёт свой клиент S3:
+на вход — URL исходника, на выход — словарь с результатом для записи в file_previews.
+"""
+import hashlib
+import os
+import re
+import urllib.request
+from io import BytesIO
+from typing import Dict, Any, Optional
+
+import boto3
+import fitz
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from file_previews import PREVIEW_SIZES, preview_key
+
+S3_BUCKET = 'files'
+MAX_SOURCE_BYTES = 30 * 1024 * 1024
+READ_CHUNK_BYTES = 256 * 1024
+PREVIEW_QUALITY = 80
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Файлы, загруженные с дедупликацией, уже лежат по ключу из своего SHA-256 (см. file_blobs)
+BLOB_URL_RE = re.compile(r'/blobs/[0-9a-f]{2}/([0-9a-f]{64})\.[^/]+$')
+
+Image.MAX_IMAGE_PIXELS = 60_000_000
+
+def get_s3():
+    return boto3.client('s3',
+        endpoint_url='https://bucket.poehali.dev',
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
+    )
+
+def cdn_url(key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ.get('AWS_ACCESS_KEY_ID')}/bucket/{key}"
+
+def download(url: str) -> bytes:
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        parts = []
+        total = 0
+        for chunk in iter(lambda: resp.read(READ_CHUNK_BYTES), b''):
+            total += len(chunk)
+            if total > MAX_SOURCE_BYTES:
+                raise ValueError(f'Файл больше {MAX_SOURCE_BYTES} байт')
+            parts.append(chunk)
+    return b''.join(parts)
+
+def previews_exist(s3, sha256: str) -> bool:
+    for size in PREVIEW_SIZES:
+        try:
+            s3.head_object(Bucket=S3_BUCKET, Key=preview_key(sha256, size))
+        except Exception:
+            return False
+    return True
+
+def open_image(data: bytes) -> Optional[Image.Image]:
+    """Картинка для превью: первая страница PDF или само изображение; None — формат не поддерживается"""
+    if data[:5] == b'%PDF-':
+        with fitz.open(stream=data, filetype='pdf') as doc:
+            if doc.page_count == 0:
+                return None
+            page = doc[0]
+            zoom = max(PREVIEW_SIZES.values()) / max(page.rect.width, page.rect.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+    try:
+        return ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    except UnidentifiedImageError:
+        return None
+
+def flatten(img: Image.Image) -> Image.Image:
+    if img.mode in ('RGB', 'L'):
+        return img.convert('RGB')
+    img = img.convert('RGBA')
+    background = Image.new('RGB', img.size, (255, 255, 255))
+    background.paste(img, mask=img.getchannel('A'))
+    return background
+
+def render_source(url: str) -> Dict[str, Any]:
+    """
+    Превью всех размеров для файла по URL. Повторный вызов для того же
+    содержимого ничего не рендерит: если все превью с его хэшем уже есть
+    в бакете, возвращаются их ссылки.
+    """
+    result: Dict[str, Any] = {'url': url}
+    try:
+        s3 = get_s3()
+        match = BLOB_URL_RE.search(url)
+        data = None
+        if match:
+            sha256 = match.group(1)
+        else:
+            data = download(url)
+            sha256 = hashlib.sha256(data).hexdigest()
+        result['sha256'] = sha256
+        previews = {size: cdn_url(preview_key(sha256, size)) for size in PREVIEW_SIZES}
+        if previews_exist(s3, sha256):
+            return {**result, 'status': 'ready', 'previews': previews}
+
+        img = open_image(data if data is not None else download(url))
+        if img is None:
+            return {**result, 'status': 'unsupported'}
+        img = flatten(img)
+        # От большего размера к меньшему: каждое превью уменьшается из предыдущего
+        for size, pixels in sorted(PREVIEW_SIZES.items(), key=lambda item: -item[1]):
+            img.thumbnail((pixels, pixels), Image.LANCZOS)
+            out = BytesIO()
+            img.save(out, 'JPEG', quality=PREVIEW_QUALITY, optimize=True)
+            s3.put_object(
+                Bucket=S3_BUCKET, Key=preview_key(sha256, size), Body=out.getvalue(),
+                ContentType='image/jpeg', CacheControl=CACHE_CONTROL
+            )
+        return {**result, 'status': 'ready', 'previews': previews}
+    except Exception as e:
+        return {**result, 'status': 'failed', 'error': str(e)[:500]}
@@ -6,13 +6,17 @@ import requests
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
+import time
+
+from file_blobs import store_bytes
+from invoice_text import CONFIDENCE_THRESHOLD, confidence, extract_text, parse_invoice
 
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 't_p61788166_html_to_frontend')
 HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
 
 
 def handler(event: dict, context) -> dict:
-    """Обработка финансовых документов: загрузка → Yandex GPT → сохранение в БД"""
+    """Обработка финансовых документов: загрузка → текстовый слой PDF или Yandex GPT → сохранение в БД"""
 
     method = event.get('httpMethod', 'POST')
 
@@ -40,6 +44,8 @@ def handler(event: dict, context) -> dict:
     file_data = body.get('file')
     file_name = body.get('fileName', 'invoice.jpg')
     user_id = body.get('user_id')
+    # Форма платежа просит распознать счёт; загрузки файлов в доп. поля — нет
+    extract = bool(body.get('extract'))
     # Распознавание через Yandex GPT отключено — всегда работаем в режиме "только загрузка".
     upload_only = True
 
@@ -83,12 +89,28 @@ def handler(event: dict, context) -> dict:
                 aws_access_key_id=aws_key,
                 aws_secret_access_key=aws_secret,
             )
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            safe_name = (file_name or 'file').replace('/', '_').replace('\\', '_')
-            s3_key = f'invoices/{timestamp}_{safe_name}'
-            s3.put_object(Bucket='files', Key=s3_key, Body=file_bytes, ContentType=content_type)
+            # Один и тот же счёт часто загружают повторно — храним по хэшу содержимого
+            extension = name_lower.rsplit('.', 1)[-1]
+            conn = psycopg2.connect(os.environ['DATABASE_URL'])
+            try:
+                with conn.cursor() as cur:
+                    s3_key, duplicate = store_bytes(s3, cur, SCHEMA, file_bytes, extension, content_type)
+                conn.commit()
+            finally:
+                conn.close()
             cdn_url = f"https://cdn.poehali.dev/projects/{aws_key}/bucket/{s3_key}"
-            return resp(200, {'file_url': cdn_url, 'file_name': file_name})
+            result = {'file_url': cdn_url, 'file_name': file_name, 'deduplicated': duplicate}
+            # GPT отключён, но счета из 1С распознаются локально по текстовому слою
+            if extract and content_type == 'application/pdf':
+                try:
+                    _, parsed, score = read_text_layer(file_bytes)
+                    if parsed:
+                        result['extracted_data'] = map_gpt_to_db(parsed, load_reference_data())
+                        result['source'] = 'text_layer'
+                        result['confidence'] = score
+                except Exception as e:
+                    import sys; print(f"[TEXT LAYER ERROR] {e}", file=sys.stderr, flush=True)
+            return resp(200, result)
         except Exception as e:
             import sys; print(f"[UPLOAD ONLY ERROR] {e}", file=sys.stderr, flush=True)
             return resp(500, {'error': 'Не удалось сохранить файл'})
@@ -135,11 +157,16 @@ def handler(event: dict, context) -> dict:
         aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
     )
 
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    s3_key = f'invoices/{timestamp}_{file_name}'
-    content_type = 'application/pdf' if file_name.lower().endswith('.pdf') else 'image/jpeg'
+    is_pdf = file_name.lower().endswith('.pdf')
+    content_type = 'application/pdf' if is_pdf else 'image/jpeg'
 
-    s3.put_object(Bucket='files', Key=s3_key, Body=file_bytes, ContentType=content_type)
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        with conn.cursor() as cur:
+            s3_key, _ = store_bytes(s3, cur, SCHEMA, file_bytes, 'pdf' if is_pdf else 'jpg', content_type)
+        conn.commit()
+    finally:
+        conn.close()
     cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{s3_key}"
 
     upload_date = datetime.now().isoformat()
@@ -149,6 +176,16 @@ def handler(event: dict, context) -> dict:
 
     ref_data = load_reference_data()
 
+    # Счёт с текстовым слоем сначала разбираем локально — это миллисекунды вместо вызова GPT
+    text_layer, parsed, score = read_text_layer(file_bytes) if is_pdf else ('', None, 0.0)
+    if parsed:
+        return resp(200, {
+            'file_url': cdn_url,
+            'extracted_data': map_gpt_to_db(parsed, ref_data),
+            'source': 'text_layer',
+            'confidence': score
+        })
+
     categories_list = ', '.join([f'id={c["id"]} "{c["name"]}"' for c in ref_data['categories']])
     services_list = ', '.join([f'id={s["id"]} "{s["name"]}"' for s in ref_data['services']])
     departments_list = ', '.join([f'id={d["id"]} "{d["name"]}"' for d in ref_data['departments']])
@@ -179,7 +216,14 @@ def handler(event: dict, context) -> dict:
 
 ВАЖНО: Верни ТОЛЬКО JSON без markdown-разметки, без комментариев, без дополнительного текста."""
 
-    gpt_result = call_yandex_gpt(api_key, folder_id, gpt_prompt, file_data)
+    if text_layer:
+        # Текст уже есть — GPT получает его без картинки и без Vision OCR
+        gpt_result = call_gpt_text_only(api_key, folder_id, gpt_prompt, text_layer)
+    elif is_pdf:
+        ocr_text = run_vision_ocr(file_data, api_key, folder_id, 'application/pdf')
+        gpt_result = call_gpt_text_only(api_key, folder_id, gpt_prompt, ocr_text) if ocr_text else None
+    else:
+        gpt_result = call_yandex_gpt(api_key, folder_id, gpt_prompt, file_data)
 
     if not gpt_result:
         return resp(200, {
@@ -211,6 +255,21 @@ def resp(status: int, body: dict) -> dict:
     }
 
 
+def read_text_layer(pdf_bytes: bytes) -> tuple[str, dict | None, float]:
+    """
+    Текстовый слой PDF и реквизиты счёта из него. Реквизиты None, если текста
+    нет (скан) или уверенность ниже порога — тогда счёт распознаёт GPT.
+    """
+    started = time.monotonic()
+    text = extract_text(pdf_bytes)
+    if not text:
+        return '', None, 0.0
+    parsed = parse_invoice(text)
+    score = confidence(parsed)
+    import sys; print(f"[TEXT LAYER] confidence={score} in {(time.monotonic() - started) * 1000:.0f} ms", file=sys.stderr, flush=True)
+    return text, (parsed if score >= CONFIDENCE_THRESHOLD else None), score
+
+
 def resolve_folder_id(api_key: str) -> str:
     try:
         r = requests.get(
@@ -316,16 +375,20 @@ def call_yandex_gpt(api_key: str, folder_id: str, prompt: str, image_base64: str
         return None
 
 
-def run_vision_ocr(image_base64: str, api_key: str, folder_id: str) -> str:
+def run_vision_ocr(image_base64: str, api_key: str, folder_id: str, mime_type: str = '') -> str:
+    spec = {
+        'content': image_base64,
+        'features': [{'type': 'TEXT_DETECTION', 'text_detection_config': {'language_codes': ['ru', 'en']}}]
+    }
+    if mime_type:
+        spec['mime_type'] = mime_type
+
     r = requests.post(
         'https://vision.api.cloud.yandex.net/vision/v1/batchAnalyze',
         headers={'Authorization': f'Api-Key {api_key}', 'Content-Type': 'application/json'},
         json={
             'folderId': folder_id,
-            'analyze_specs': [{
-                'content': image_base64,
-                'features': [{'type': 'TEXT_DETECTION', 'text_detection_config': {'language_codes': ['ru', 'en']}}]
-            }]
+            'analyze_specs': [spec]
         },
         timeout=30
     )
@@ -412,6 +475,17 @@ def parse_gpt_json(text: str) -> dict | None:
     return None
 
 
+def find_by_inn(items: list, inn, kpp=None) -> dict | None:
+    """Запись справочника с этим ИНН; у филиалов ИНН общий, поэтому при наличии КПП предпочитаем совпадение по нему"""
+    inn = str(inn).strip()
+    matches = [item for item in items if item.get('inn') and item['inn'].strip() == inn]
+    if kpp:
+        for item in matches:
+            if (item.get('kpp') or '').strip() == str(kpp).strip():
+                return item
+    return matches[0] if matches else None
+
+
 def map_gpt_to_db(gpt_data: dict, ref_data: dict) -> dict:
     result = {
         'amount': None,
@@ -441,10 +515,9 @@ def map_gpt_to_db(gpt_data: dict, ref_data: dict) -> dict:
             result['contractor_id'] = cp_id
         else:
             if counterparty.get('inn'):
-                for c in ref_data['contractors']:
-                    if c.get('inn') and c['inn'].strip() == str(counterparty['inn']).strip():
-                        result['contractor_id'] = c['id']
-                        break
+                match = find_by_inn(ref_data['contractors'], counterparty['inn'], counterparty.get('kpp'))
+                if match:
+                    result['contractor_id'] = match['id']
             if not result['contractor_id'] and counterparty.get('name'):
                 result['contractor_name'] = counterparty['name']
                 result['contractor_inn'] = counterparty.get('inn')
@@ -456,10 +529,9 @@ def map_gpt_to_db(gpt_data: dict, ref_data: dict) -> dict:
             result['legal_entity_id'] = le_id
         else:
             if legal_entity.get('inn'):
-                for le in ref_data['legal_entities']:
-                    if le.get('inn') and le['inn'].strip() == str(legal_entity['inn']).strip():
-                        result['legal_entity_id'] = le['id']
-                        break
+                match = find_by_inn(ref_data['legal_entities'], legal_entity['inn'], legal_entity.get('kpp'))
+                if match:
+                    result['legal_entity_id'] = match['id']
             if not result['legal_entity_id'] and legal_entity.get('name'):
                 result['legal_entity_name'] = legal_entity['name']
                 result['legal_entity_inn'] = legal_entity.get('inn')
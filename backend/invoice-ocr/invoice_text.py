@@ -0,0 +1,184 @@
+"""
+Распознавание счёта по текстовому слою PDF без обращения к Yandex GPT.
+Большинство счетов выгружено из 1С и содержит текст, поэтому реквизиты
+находятся правилами: номер и дата из заголовка «Счёт на оплату № … от …»,
+ИНН/КПП поставщика и покупателя из их блоков, сумма из «Всего к оплате».
+Результат — словарь в том же формате, что возвращает GPT (см. map_gpt_to_db),
+и оценка уверенности: при низкой уверенности или скане без текста счёт
+распознаётся через GPT.
+"""
+import re
+import sys
+from datetime import date
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from pypdf import PdfReader
+
+# Меньше символов в текстовом слое — считаем документ сканом
+MIN_TEXT_CHARS = 50
+MAX_PAGES = 3
+CONFIDENCE_THRESHOLD = 0.75
+# Вклад каждого найденного реквизита в уверенность
+FIELD_WEIGHTS = {
+    'amount': 0.35,
+    'counterparty_inn': 0.25,
+    'invoice_number': 0.15,
+    'invoice_date': 0.15,
+    'legal_entity_inn': 0.10,
+}
+
+MONTHS = {
+    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6,
+    'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12,
+}
+
+DATE_PATTERN = r'(\d{1,2})[.\s]+(\d{1,2}|[а-яё]+)[.\s]+(\d{4})'
+TITLE_RE = re.compile(
+    r'Сч[её]т(?:[\s-]+оферта)?(?:\s+на\s+оплату)?\s*(?:№|N[oо]?\.?)\s*([\w\-/.]+?)\s+от\s+' + DATE_PATTERN,
+    re.IGNORECASE
+)
+SUPPLIER_RE = re.compile(
+    r'(?:Поставщик|Исполнитель|Продавец)[^:\n]{0,40}(?:\n[^:\n]{0,40})?:\s*(.+?)'
+    r'(?=Покупатель|Заказчик|Плательщик|Грузополучатель|Основание|$)',
+    re.IGNORECASE | re.DOTALL
+)
+BUYER_RE = re.compile(
+    r'(?:Покупатель|Заказчик|Плательщик)[^:\n]{0,40}(?:\n[^:\n]{0,40})?:\s*(.+?)'
+    r'(?=Грузополучатель|Основание|Товары|Наименование|\n\s*№|$)',
+    re.IGNORECASE | re.DOTALL
+)
+INN_RE = re.compile(r'ИНН(?:\s*/\s*КПП)?\s*:?\s*(\d{12}|\d{10})(?:\s*/\s*(\d{9}))?')
+KPP_RE = re.compile(r'КПП\s*:?\s*(\d{9})')
+# Суммы по убыванию надёжности: «Итого» без уточнения ловит и строки с НДС
+AMOUNT_LABELS = [
+    r'Всего\s+к\s+оплате',
+    r'Итого\s+к\s+оплате',
+    r'на\s+сумму',
+    r'Итого(?!\s+НДС)(?!\s+без)',
+]
+AMOUNT_PATTERN = r'[^\d\n]{0,20}?(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)(?:[.,](\d{1,2}))?'
+GOODS_ROW_RE = re.compile(
+    r'^\s*1\s+(\S.{2,200}?)\s+\d+(?:[.,]\d+)?\s*(?:шт|усл|ед|мес|час|ч|кг|л|м|компл|упак)\b',
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+def log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def extract_text(pdf_bytes: bytes) -> str:
+    """Текстовый слой первых страниц PDF; пустая строка, если его нет или файл не читается"""
+    try:
+        reader = PdfReader(BytesIO(pdf_bytes))
+        pages = reader.pages[:MAX_PAGES]
+        text = '\n'.join(page.extract_text() or '' for page in pages)
+    except Exception as e:
+        log(f"[INVOICE TEXT] PDF read failed: {e}")
+        return ''
+    return text.replace('\u00a0', ' ') if len(text.strip()) >= MIN_TEXT_CHARS else ''
+
+
+def valid_inn(inn: str) -> bool:
+    """Проверка контрольных цифр ИНН организации (10 цифр) или ИП (12 цифр)"""
+    def check_digit(digits: str, coefficients) -> int:
+        return sum(int(d) * c for d, c in zip(digits, coefficients)) % 11 % 10
+
+    if len(inn) == 10:
+        return check_digit(inn, (2, 4, 10, 3, 5, 9, 4, 6, 8)) == int(inn[9])
+    if len(inn) == 12:
+        return (check_digit(inn, (7, 2, 4, 10, 3, 5, 9, 4, 6, 8)) == int(inn[10])
+                and check_digit(inn, (3, 7, 2, 4, 10, 3, 5, 9, 4, 6, 8)) == int(inn[11]))
+    return False
+
+
+def parse_date(day: str, month: str, year: str) -> Optional[str]:
+    month_num = int(month) if month.isdigit() else MONTHS.get(month.lower())
+    if not month_num:
+        return None
+    try:
+        return date(int(year), month_num, int(day)).isoformat()
+    except ValueError:
+        return None
+
+
+def parse_amount(text: str) -> Optional[float]:
+    for label in AMOUNT_LABELS:
+        match = re.search(label + AMOUNT_PATTERN, text, re.IGNORECASE)
+        if match:
+            whole = re.sub(r'\s', '', match.group(1))
+            return float(f"{whole}.{(match.group(2) or '0').ljust(2, '0')}")
+    return None
+
+
+def parse_party(block: Optional[str]) -> Dict[str, Any]:
+    """Название, ИНН и КПП из блока «Поставщик: …» / «Покупатель: …»"""
+    party = {'id': None, 'name': None, 'inn': None, 'kpp': None}
+    if not block:
+        return party
+    inn_match = INN_RE.search(block)
+    if inn_match and valid_inn(inn_match.group(1)):
+        party['inn'] = inn_match.group(1)
+        party['kpp'] = inn_match.group(2)
+    if not party['kpp']:
+        kpp_match = KPP_RE.search(block)
+        if kpp_match:
+            party['kpp'] = kpp_match.group(1)
+    head = block[:inn_match.start()] if inn_match else block
+    name = head.strip().split('\n')[0].strip(' ,;')
+    if name:
+        party['name'] = name
+    return party
+
+
+def parse_invoice(text: str) -> Dict[str, Any]:
+    """Реквизиты счёта в формате ответа GPT; ненайденные поля — None"""
+    result: Dict[str, Any] = {
+        'counterparty': None,
+        'legal_entity': None,
+        'invoice_number': None,
+        'invoice_date': None,
+        'purpose': None,
+        'amount': None,
+    }
+
+    title = TITLE_RE.search(text)
+    if title:
+        result['invoice_number'] = title.group(1).rstrip('.')
+        result['invoice_date'] = parse_date(title.group(2), title.group(3), title.group(4))
+
+    supplier_match = SUPPLIER_RE.search(text)
+    buyer_match = BUYER_RE.search(text)
+    supplier = parse_party(supplier_match.group(1) if supplier_match else None)
+    buyer = parse_party(buyer_match.group(1) if buyer_match else None)
+
+    # ИНН получателя есть и в банковском блоке над заголовком счёта
+    if not supplier['inn']:
+        for match in INN_RE.finditer(text):
+            inn = match.group(1)
+            if inn != buyer['inn'] and valid_inn(inn):
+                supplier['inn'] = inn
+                supplier['kpp'] = supplier['kpp'] or match.group(2)
+                break
+
+    result['counterparty'] = supplier
+    result['legal_entity'] = buyer
+    result['amount'] = parse_amount(text)
+
+    goods = GOODS_ROW_RE.search(text)
+    if goods:
+        result['purpose'] = goods.group(1).strip()
+
+    return result
+
+
+def confidence(parsed: Dict[str, Any]) -> float:
+    found = {
+        'amount': parsed.get('amount'),
+        'counterparty_inn': (parsed.get('counterparty') or {}).get('inn'),
+        'invoice_number': parsed.get('invoice_number'),
+        'invoice_date': parsed.get('invoice_date'),
+        'legal_entity_inn': (parsed.get('legal_entity') or {}).get('inn'),
+    }
+    return round(sum(weight for field, weight in FIELD_WEIGHTS.items() if found[field]), 2)
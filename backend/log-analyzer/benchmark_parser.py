@@ -0,0 +1,107 @@
+"""
+Микро-бенчмарк разбора строк логов.
+Запуск: python benchmark_parser.py [количество строк на образец]
+Результаты — строки в секунду; ускорение считается относительно прежнего разбора.
+Для каждого образца (nginx, syslog, ISO, app-лог) печатает строки/сек прежнего
+разбора (re.match + strptime на каждую строку), общего разбора (перебор всех
+предкомпилированных форматов) и быстрого пути после определения формата.
+Прежний разбор не распознавал nginx access-логи (строка проходила все шаблоны
+вхолостую), поэтому для nginx сравнение показывает цену извлечения полей.
+"""
+import re
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional
+
+from log_parser import detect_parser, parse_log_line
+
+SAMPLES: Dict[str, List[str]] = {
+    'nginx': [
+        '192.168.1.10 - - [15/Jan/2024:10:30:45 +0300] "GET /api/payments?page=2 HTTP/1.1" 200 5123 "-" "Mozilla/5.0"',
+        '10.0.0.7 - admin [15/Jan/2024:10:30:46 +0300] "POST /api/login HTTP/1.1" 401 87 "-" "curl/8.4.0"',
+        '192.168.1.11 - - [15/Jan/2024:10:30:47 +0300] "GET /static/app.js HTTP/2.0" 304 0 "https://finance-km.ru/" "Mozilla/5.0"',
+        '172.16.0.3 - - [15/Jan/2024:10:30:48 +0300] "GET /api/tickets HTTP/1.1" 502 166 "-" "Mozilla/5.0"',
+    ],
+    'syslog': [
+        'Jan 15 10:30:45 web-01 ERROR: connection refused by upstream 10.0.0.5:5432',
+        'Jan 15 10:30:46 web-01 INFO: worker 4 started',
+        'Jan 15 10:30:47 web-02 WARN: disk usage 91% on /var',
+        'Jan 15 10:30:48 web-02 DEBUG: cache miss for key payments:list:2',
+    ],
+    'iso': [
+        '2024-01-15T10:30:45.123Z [ERROR] Payment 1842 failed: timeout after 30s',
+        '2024-01-15T10:30:45.456Z [INFO] User 17 logged in',
+        '2024-01-15T10:30:46Z [WARN] Slow query 1532ms: SELECT * FROM payments',
+        '2024-01-15T10:30:47.001Z [DEBUG] Component mounted: LogAnalyzer',
+    ],
+    'app': [
+        '2024-01-15 10:30:45 INFO Function main invoked',
+        '2024-01-15 10:30:45,871 ERROR Traceback (most recent call last): KeyError id',
+        '2024-01-15 10:30:46 DEBUG Processing request endpoint=payments',
+        '2024-01-15 10:30:47 WARN Retrying request to bitrix (attempt 2)',
+    ],
+}
+
+
+LEGACY_PATTERNS = [
+    r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?Z?)\s*\[(\w+)\]\s*(.+)$',
+    r'^(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})\s+(\w+)\s+(.+)$',
+    r'^(\w+\s+\d+\s+\d{2}:\d{2}:\d{2})\s+\S+\s+(\w+):\s*(.+)$',
+    r'^(\w+):\s*(\d{4}-\d{2}-\d{2})\s+(.+)$',
+    r'^(\w+)\s+(.+)$'
+]
+LEGACY_FORMATS = ['%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%b %d %H:%M:%S']
+
+
+def legacy_parse_timestamp(ts_str: str) -> Optional[datetime]:
+    for fmt in LEGACY_FORMATS:
+        try:
+            return datetime.strptime(ts_str, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def legacy_parse_log_line(line: str, line_number: int) -> Dict[str, Any]:
+    """Прежняя реализация разбора — для сравнения"""
+    timestamp, level, message = None, None, line
+    for pattern in LEGACY_PATTERNS:
+        match = re.match(pattern, line)
+        if match:
+            groups = match.groups()
+            if len(groups) == 3:
+                timestamp = legacy_parse_timestamp(groups[0])
+                level = groups[1].upper()
+                message = groups[2]
+            elif len(groups) == 2:
+                level = groups[0].upper() if groups[0].upper() in ['ERROR', 'WARN', 'INFO', 'DEBUG', 'TRACE', 'FATAL'] else None
+                message = groups[1] if level else line
+            if level or timestamp:
+                break
+    return {'line_number': line_number, 'timestamp': timestamp, 'level': level,
+            'message': message.strip(), 'raw_line': line}
+
+
+def measure(parse: Callable[[str, int], Dict[str, Any]], lines: List[str]) -> float:
+    started = time.perf_counter()
+    for number, line in enumerate(lines, 1):
+        parse(line, number)
+    elapsed = time.perf_counter() - started
+    return len(lines) / elapsed if elapsed > 0 else float('inf')
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print(f"{'образец':<10}{'формат':<14}{'прежний':>12}{'общий':>12}{'быстрый':>12}{'ускорение':>12}")
+    for name, templates in SAMPLES.items():
+        lines = [templates[i % len(templates)] for i in range(count)]
+        parse_line, _, log_format = detect_parser(lines)
+        legacy = measure(legacy_parse_log_line, lines)
+        general = measure(parse_log_line, lines)
+        fast = measure(parse_line, lines)
+        print(f"{name:<10}{str(log_format):<14}{legacy:>12,.0f}{general:>12,.0f}{fast:>12,.0f}{fast / legacy:>11.1f}x")
+
+
+if __name__ == '__main__':
+    main()
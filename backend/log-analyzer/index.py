@@ -1,11 +1,82 @@
 import json
 import os
 import re
+import io
+import gzip
+import uuid
 import base64
-from datetime import datetime
-from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+import boto3
+import jwt
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from ingest import ingest_lines, iter_lines
+from log_parser import detect_parser
+from log_partitions import apply_retention, drop_file, retention_days
+from log_templates import extract_params, render_template
+
+S3_ENDPOINT = 'https://bucket.poehali.dev'
+S3_BUCKET = 'files'
+LOG_UPLOAD_PREFIX = 'logs/'
+UPLOAD_URL_TTL = 3600
+
+HISTOGRAM_MINUTE_MAX_SPAN = timedelta(hours=6)
+ENTRIES_MAX_LIMIT = 1000
+
+TEMPLATE_SORTS = {
+    'count': 'c.count',
+    'first_seen': 'c.first_seen',
+    'last_seen': 'c.last_seen',
+    'file_count': 'file_count',
+}
+
+SCHEMA = 't_p61788166_html_to_frontend'
+
+def verify_token(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    headers = event.get('headers') or {}
+    token = (headers.get('X-Auth-Token') or
+             headers.get('x-auth-token') or
+             headers.get('X-Authorization') or
+             headers.get('x-authorization', ''))
+    if token:
+        token = token.replace('Bearer ', '').strip()
+    if not token:
+        return None
+    try:
+        secret = os.environ.get('JWT_SECRET')
+        if not secret:
+            return None
+        return jwt.decode(token, secret, algorithms=['HS256'])
+    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
+        return None
+
+def is_admin(conn, user_id: int) -> bool:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT COUNT(*) as cnt FROM {SCHEMA}.roles r
+            JOIN {SCHEMA}.user_roles ur ON r.id = ur.role_id
+            WHERE ur.user_id = %s AND r.name IN ('Администратор', 'Admin')
+        """, (user_id,))
+        row = cur.fetchone()
+        return row['cnt'] > 0 if row else False
+
+def admin_error(conn, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Ответ 401/403, если запрос не от администратора; None — доступ разрешён"""
+    payload = verify_token(event)
+    if not payload:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Требуется авторизация'})
+        }
+    if not is_admin(conn, payload['user_id']):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Недостаточно прав. Требуется роль Администратор'})
+        }
+    return None
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -34,6 +105,47 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if method == 'POST':
             # Загрузка и парсинг лог-файла
             body_data = json.loads(event.get('body', '{}'))
+            action = body_data.get('action')
+            
+            if action == 'upload_url':
+                return create_upload_url(body_data)
+            
+            if action == 'process':
+                return process_s3_file(conn, body_data)
+            
+            if action in ('delete', 'retention'):
+                # Удаление записей логов — только администраторам
+                denied = admin_error(conn, event)
+                if denied:
+                    return denied
+            
+            if action == 'delete':
+                # Удаление файла целиком: секция записей удаляется за O(1)
+                file_id = body_data.get('file_id')
+                if not file_id:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'file_id обязателен'})
+                    }
+                with conn.cursor() as cur:
+                    drop_file(cur, int(file_id))
+                    conn.commit()
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'deleted': int(file_id)})
+                }
+            
+            if action == 'retention':
+                # Удаление файлов старше срока хранения; срок задаётся только LOG_RETENTION_DAYS
+                days = retention_days()
+                deleted = apply_retention(conn, days)
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'retention_days': days, 'deleted': deleted})
+                }
             
             if 'file_content' not in body_data or 'filename' not in body_data:
                 return {
@@ -42,70 +154,31 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'file_content и filename обязательны'})
                 }
             
-            # Декодируем base64 контент
-            file_content = base64.b64decode(body_data['file_content']).decode('utf-8')
+            # Декодируем base64 и читаем построчно, не собирая список всех строк
+            raw_content = base64.b64decode(body_data['file_content'])
             filename = body_data['filename']
             
             # Создаём запись о файле
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     "INSERT INTO log_files (filename, file_size, total_lines, status) VALUES (%s, %s, %s, %s) RETURNING id",
-                    (filename, len(file_content), file_content.count('\n'), 'processing')
+                    (filename, len(raw_content), 0, 'processing')
                 )
                 file_id = cur.fetchone()['id']
                 conn.commit()
             
-            # Парсим логи
-            lines = file_content.split('\n')
-            parsed_entries = []
-            stats = {}
-            
-            for idx, line in enumerate(lines, 1):
-                if not line.strip():
-                    continue
-                
-                entry = parse_log_line(line, idx)
-                parsed_entries.append((
-                    file_id,
-                    entry['line_number'],
-                    entry['timestamp'],
-                    entry['level'],
-                    entry['message'],
-                    entry['raw_line']
-                ))
-                
-                # Статистика
-                level = entry['level'] or 'UNKNOWN'
-                stats[level] = stats.get(level, 0) + 1
-            
-            # Сохраняем записи логов
-            with conn.cursor() as cur:
-                cur.executemany(
-                    "INSERT INTO log_entries (file_id, line_number, timestamp, level, message, raw_line) VALUES (%s, %s, %s, %s, %s, %s)",
-                    parsed_entries
-                )
-                
-                # Сохраняем статистику
-                for level, count in stats.items():
-                    cur.execute(
-                        "INSERT INTO log_statistics (file_id, level, count) VALUES (%s, %s, %s)",
-                        (file_id, level, count)
-                    )
-                
-                # Обновляем статус файла
-                cur.execute(
-                    "UPDATE log_files SET status = %s WHERE id = %s",
-                    ('completed', file_id)
-                )
-                conn.commit()
+            # Определяем формат по первым строкам, парсим и загружаем пачками через COPY
+            parse_line, lines, log_format = detect_parser(iter_lines(io.BytesIO(raw_content)))
+            result = ingest_lines(conn, file_id, lines, parse_line)
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({
                     'file_id': file_id,
-                    'total_lines': len(parsed_entries),
-                    'statistics': stats
+                    'total_lines': result['total_lines'],
+                    'statistics': result['statistics'],
+                    'format': log_format
                 })
             }
         
@@ -114,18 +187,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             action = params.get('action', 'list')
             
             if action == 'list':
-                # Список всех файлов
+                # Список всех файлов с размером секции записей на диске
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
                     cur.execute("""
                         SELECT lf.*, 
                                COALESCE(json_agg(
                                    json_build_object('level', ls.level, 'count', ls.count)
-                               ) FILTER (WHERE ls.id IS NOT NULL), '[]') as statistics
+                               ) FILTER (WHERE ls.id IS NOT NULL), '[]') as statistics,
+                               pg_total_relation_size(to_regclass('log_entries_f' || lf.id)) as partition_size,
+                               CASE WHEN %(days)s > 0 THEN lf.uploaded_at + make_interval(days => %(days)s) END as expires_at
                         FROM log_files lf
                         LEFT JOIN log_statistics ls ON lf.id = ls.file_id
                         GROUP BY lf.id
                         ORDER BY lf.uploaded_at DESC
-                    """)
+                    """, {'days': retention_days()})
                     files = cur.fetchall()
                 
                 return {
@@ -135,55 +210,149 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             elif action == 'entries':
-                # Получить записи из конкретного файла
+                # Получить записи из конкретного файла.
+                # Страницы по курсору after (номер последней строки предыдущей страницы):
+                # выборка идёт по индексу (file_id, [level,] line_number) без OFFSET
                 file_id = params.get('file_id')
                 level_filter = params.get('level')
                 search = params.get('search')
-                limit = int(params.get('limit', 100))
-                offset = int(params.get('offset', 0))
+                limit = min(int(params.get('limit', 100)), ENTRIES_MAX_LIMIT)
+                after = params.get('after')
+                offset = int(params.get('offset', 0)) if after is None else 0
+                exact = params.get('exact_count') in ('1', 'true')
                 
-                query = "SELECT * FROM log_entries WHERE file_id = %s"
-                query_params = [file_id]
+                template_filter = params.get('template')
+                
+                where = "e.file_id = %s"
+                where_params = [file_id]
                 
                 if level_filter:
-                    query += " AND level = %s"
-                    query_params.append(level_filter)
+                    where += " AND e.level = %s"
+                    where_params.append(level_filter)
+                
+                if template_filter:
+                    where += " AND e.template_id IN (SELECT id FROM log_templates WHERE cluster_id = %s)"
+                    where_params.append(int(template_filter))
                 
                 if search:
-                    query += " AND message ILIKE %s"
-                    query_params.append(f'%{search}%')
+                    # message хранится и у шаблонизированных записей; покрыт триграммным индексом
+                    where += " AND e.message ILIKE %s"
+                    where_params.append(f'%{search}%')
+                
+                page_where = where
+                page_params = list(where_params)
+                if after is not None:
+                    page_where += " AND e.line_number > %s"
+                    page_params.append(int(after))
                 
-                query += " ORDER BY line_number LIMIT %s OFFSET %s"
-                query_params.extend([limit, offset])
+                query = f"""
+                    SELECT e.*, t.template, t.cluster_id as template_cluster_id
+                    FROM log_entries e
+                    LEFT JOIN log_templates t ON t.id = e.template_id
+                    WHERE {page_where}
+                    ORDER BY e.line_number LIMIT %s OFFSET %s
+                """
                 
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    cur.execute(query, query_params)
-                    entries = cur.fetchall()
-                    
-                    # Получаем общее количество
-                    count_query = f"SELECT COUNT(*) as total FROM log_entries WHERE file_id = %s"
-                    count_params = [file_id]
-                    if level_filter:
-                        count_query += " AND level = %s"
-                        count_params.append(level_filter)
-                    if search:
-                        count_query += " AND message ILIKE %s"
-                        count_params.append(f'%{search}%')
+                    cur.execute(query, page_params + [limit + 1, offset])
+                    rows = cur.fetchall()
+                    has_more = len(rows) > limit
+                    entries = [restore_entry(e) for e in rows[:limit]]
                     
-                    cur.execute(count_query, count_params)
-                    total = cur.fetchone()['total']
+                    total, total_exact = count_entries(
+                        cur, file_id, level_filter, template_filter, search, where, where_params, exact
+                    )
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({
-                        'entries': [dict(e) for e in entries],
+                        'entries': entries,
                         'total': total,
+                        'total_exact': total_exact,
                         'limit': limit,
-                        'offset': offset
+                        'offset': offset,
+                        'next_after': entries[-1]['line_number'] if has_more else None
                     }, default=str)
                 }
             
+            elif action == 'templates':
+                # Шаблоны сообщений: количество, первое/последнее появление, примеры строк
+                file_id = params.get('file_id')
+                level_filter = params.get('level')
+                sort = TEMPLATE_SORTS.get(params.get('sort', 'count'), TEMPLATE_SORTS['count'])
+                limit = min(int(params.get('limit', 100)), 1000)
+                
+                query_params = []
+                file_join = ''
+                file_count = 'NULL::bigint'
+                if file_id:
+                    file_join = "JOIN log_file_templates ft ON ft.cluster_id = c.cluster_id AND ft.file_id = %s"
+                    file_count = 'ft.count'
+                    query_params.append(file_id)
+                
+                level_where = ''
+                if level_filter:
+                    level_where = "WHERE lt.level = %s"
+                    query_params.append(level_filter)
+                
+                query_params.append(limit)
+                
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute(f"""
+                        WITH c AS (
+                            SELECT cluster_id,
+                                   MAX(id) as latest_id,
+                                   SUM(count) as count,
+                                   MIN(first_seen) as first_seen,
+                                   MAX(last_seen) as last_seen,
+                                   MIN(first_file_id) as first_file_id,
+                                   (array_agg(example_line ORDER BY id) FILTER (WHERE example_line IS NOT NULL))[1:3] as examples
+                            FROM log_templates
+                            GROUP BY cluster_id
+                        )
+                        SELECT c.cluster_id as id, lt.template, lt.level, c.count,
+                               {file_count} as file_count,
+                               c.first_seen, c.last_seen, c.first_file_id, c.examples
+                        FROM c
+                        JOIN log_templates lt ON lt.id = c.latest_id
+                        {file_join}
+                        {level_where}
+                        ORDER BY {sort} DESC NULLS LAST
+                        LIMIT %s
+                    """, query_params)
+                    templates = cur.fetchall()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps([dict(t) for t in templates], default=str)
+                }
+            
+            elif action == 'histogram':
+                # Гистограмма по времени: читаются только предрассчитанные бакеты
+                file_id = params.get('file_id')
+                if not file_id:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'file_id обязателен'})
+                    }
+                
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    histogram = get_histogram(
+                        cur, int(file_id),
+                        params.get('from'), params.get('to'),
+                        params.get('resolution', 'auto'),
+                        params.get('level'), params.get('template')
+                    )
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps(histogram, default=str)
+                }
+            
             elif action == 'stats':
                 # Статистика по файлу
                 file_id = params.get('file_id')
@@ -211,70 +380,246 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         conn.close()
 
 
-def parse_log_line(line: str, line_number: int) -> Dict[str, Any]:
+def get_histogram(
+    cur,
+    file_id: int,
+    date_from: Optional[str],
+    date_to: Optional[str],
+    resolution: str,
+    level: Optional[str],
+    template: Optional[str]
+) -> Dict[str, Any]:
     """
-    Парсит строку лога и извлекает timestamp, level, message.
-    Поддерживает различные форматы логов.
+    Строит гистограмму по бакетам log_histogram_minute/hour.
+    Без границ берётся весь файл; resolution=auto выбирает минуты для
+    диапазона до HISTOGRAM_MINUTE_MAX_SPAN и часы для более длинных.
     """
-    # Паттерны для парсинга
-    patterns = [
-        # ISO timestamp with level: 2024-01-15T10:30:45.123Z [ERROR] Message
-        r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?Z?)\s*\[(\w+)\]\s*(.+)$',
-        # Standard format: 2024-01-15 10:30:45 ERROR Message
-        r'^(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})\s+(\w+)\s+(.+)$',
-        # Syslog format: Jan 15 10:30:45 hostname ERROR: Message
-        r'^(\w+\s+\d+\s+\d{2}:\d{2}:\d{2})\s+\S+\s+(\w+):\s*(.+)$',
-        # Level first: ERROR: 2024-01-15 Message
-        r'^(\w+):\s*(\d{4}-\d{2}-\d{2})\s+(.+)$',
-        # Just level: ERROR Message
-        r'^(\w+)\s+(.+)$'
-    ]
+    start = datetime.fromisoformat(date_from) if date_from else None
+    end = datetime.fromisoformat(date_to) if date_to else None
     
-    timestamp = None
-    level = None
-    message = line
+    if start is None or end is None:
+        cur.execute(
+            "SELECT MIN(bucket) as first_bucket, MAX(bucket) as last_bucket FROM log_histogram_hour WHERE file_id = %s",
+            (file_id,)
+        )
+        bounds = cur.fetchone()
+        if bounds['first_bucket'] is None:
+            return {'resolution': None, 'from': None, 'to': None, 'buckets': []}
+        start = start or bounds['first_bucket']
+        end = end or bounds['last_bucket'] + timedelta(hours=1)
     
-    for pattern in patterns:
-        match = re.match(pattern, line)
-        if match:
-            groups = match.groups()
-            if len(groups) == 3:
-                try:
-                    timestamp = parse_timestamp(groups[0])
-                    level = groups[1].upper()
-                    message = groups[2]
-                except:
-                    pass
-            elif len(groups) == 2:
-                level = groups[0].upper() if groups[0].upper() in ['ERROR', 'WARN', 'INFO', 'DEBUG', 'TRACE', 'FATAL'] else None
-                message = groups[1] if level else line
-            
-            if level or timestamp:
-                break
+    if resolution not in ('minute', 'hour'):
+        resolution = 'minute' if end - start <= HISTOGRAM_MINUTE_MAX_SPAN else 'hour'
+    
+    query = f"""
+        SELECT bucket, level, SUM(count) as count
+        FROM log_histogram_{resolution}
+        WHERE file_id = %s AND bucket >= %s AND bucket < %s
+    """
+    query_params: List[Any] = [file_id, start, end]
+    if level:
+        query += " AND level = %s"
+        query_params.append(level)
+    if template:
+        query += " AND cluster_id = %s"
+        query_params.append(int(template))
+    query += " GROUP BY bucket, level ORDER BY bucket"
+    cur.execute(query, query_params)
+    
+    buckets: List[Dict[str, Any]] = []
+    for row in cur.fetchall():
+        if not buckets or buckets[-1]['bucket'] != row['bucket']:
+            buckets.append({'bucket': row['bucket'], 'total': 0, 'levels': {}})
+        buckets[-1]['levels'][row['level']] = int(row['count'])
+        buckets[-1]['total'] += int(row['count'])
+    
+    return {'resolution': resolution, 'from': start, 'to': end, 'buckets': buckets}
+
+
+def count_entries(
+    cur,
+    file_id: str,
+    level: Optional[str],
+    template: Optional[str],
+    search: Optional[str],
+    where: str,
+    where_params: List[Any],
+    exact: bool
+) -> Tuple[int, bool]:
+    """
+    Общее количество записей под фильтром. Без поиска берётся из
+    предрассчитанных log_statistics / log_file_templates, при поиске —
+    оценка планировщика; точный COUNT(*) только по запросу (exact_count=1).
+    Возвращает количество и признак точности.
+    """
+    if not search and not template:
+        if level:
+            cur.execute("SELECT count FROM log_statistics WHERE file_id = %s AND level = %s", (file_id, level))
+        else:
+            cur.execute("SELECT COALESCE(SUM(count), 0) as count FROM log_statistics WHERE file_id = %s", (file_id,))
+        row = cur.fetchone()
+        return (int(row['count']) if row else 0), True
+    
+    if not search and not level:
+        cur.execute(
+            "SELECT count FROM log_file_templates WHERE file_id = %s AND cluster_id = %s",
+            (file_id, int(template))
+        )
+        row = cur.fetchone()
+        return (int(row['count']) if row else 0), True
+    
+    count_query = f"SELECT COUNT(*) as total FROM log_entries e WHERE {where}"
+    if exact:
+        cur.execute(count_query, where_params)
+        return int(cur.fetchone()['total']), True
+    
+    cur.execute("EXPLAIN (FORMAT JSON) " + count_query.replace('COUNT(*) as total', '1'), where_params)
+    plan = list(cur.fetchone().values())[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows']), False
+
+
+def restore_entry(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Восстанавливает raw_line и параметры записи, сохранённой через шаблон"""
+    entry = dict(row)
+    template = entry.pop('template', None)
+    if entry.get('message') is None and template is not None:
+        entry['message'] = render_template(template, entry.get('params'))
+    if entry.get('params') is None and template is not None and entry.get('message') is not None:
+        entry['params'] = extract_params(template, entry['message'])
+    if entry.get('raw_line') is None and entry.get('message') is not None:
+        entry['raw_line'] = (entry.get('raw_prefix') or '') + entry['message']
+    return entry
+
+
+def get_s3_client():
+    return boto3.client(
+        's3',
+        endpoint_url=S3_ENDPOINT,
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
+    )
+
+
+def create_upload_url(body_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Выдаёт presigned PUT URL для загрузки лог-файла напрямую в бакет.
+    Файл может быть сжат gzip — тогда имя должно оканчиваться на .gz.
+    """
+    filename = body_data.get('filename')
+    if not filename:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'filename обязателен'})
+        }
+    
+    safe_name = re.sub(r'[^\w.\-]', '_', os.path.basename(filename))[:100]
+    compressed = bool(body_data.get('compressed')) or safe_name.endswith('.gz')
+    if compressed and not safe_name.endswith('.gz'):
+        safe_name += '.gz'
+    
+    file_key = f"{LOG_UPLOAD_PREFIX}{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}_{safe_name}"
+    content_type = 'application/gzip' if compressed else 'text/plain'
+    
+    presigned_url = get_s3_client().generate_presigned_url(
+        'put_object',
+        Params={'Bucket': S3_BUCKET, 'Key': file_key, 'ContentType': content_type},
+        ExpiresIn=UPLOAD_URL_TTL
+    )
     
     return {
-        'line_number': line_number,
-        'timestamp': timestamp,
-        'level': level,
-        'message': message.strip(),
-        'raw_line': line
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'presigned_url': presigned_url,
+            'file_key': file_key,
+            'content_type': content_type,
+            'expires_in': UPLOAD_URL_TTL
+        })
     }
 
 
-def parse_timestamp(ts_str: str) -> Optional[datetime]:
-    """Пытается распарсить различные форматы timestamp"""
-    formats = [
-        '%Y-%m-%dT%H:%M:%S.%fZ',
-        '%Y-%m-%dT%H:%M:%SZ',
-        '%Y-%m-%d %H:%M:%S',
-        '%Y-%m-%d',
-        '%b %d %H:%M:%S'
-    ]
+def process_s3_file(conn, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Обрабатывает загруженный в бакет лог-файл по ключу объекта.
+    Объект читается потоком и при необходимости распаковывается на лету.
+    Повторный вызов для того же ключа продолжает прерванную обработку.
+    """
+    file_key = body_data.get('file_key') or ''
+    if not file_key.startswith(LOG_UPLOAD_PREFIX) or '..' in file_key:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Некорректный file_key'})
+        }
+    
+    s3_object = get_s3_client().get_object(Bucket=S3_BUCKET, Key=file_key)
+    stream = s3_object['Body']
+    compressed = file_key.endswith('.gz') or s3_object.get('ContentEncoding') == 'gzip'
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream)
     
-    for fmt in formats:
-        try:
-            return datetime.strptime(ts_str, fmt)
-        except:
-            continue
+    filename = body_data.get('filename') or os.path.basename(file_key)
+    if filename.endswith('.gz'):
+        filename = filename[:-3]
     
-    return None
\ No newline at end of file
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            "SELECT id, status, processed_lines FROM log_files WHERE source_key = %s ORDER BY id DESC LIMIT 1",
+            (file_key,)
+        )
+        existing = cur.fetchone()
+        
+        if existing and existing['status'] == 'completed':
+            cur.execute("SELECT level, count FROM log_statistics WHERE file_id = %s", (existing['id'],))
+            stats = {row['level']: row['count'] for row in cur.fetchall()}
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'file_id': existing['id'],
+                    'total_lines': existing['processed_lines'],
+                    'statistics': stats
+                })
+            }
+        
+        if existing:
+            file_id = existing['id']
+            processed = existing['processed_lines'] or 0
+            cur.execute("SELECT COALESCE(MAX(line_number), 0) as last_line FROM log_entries WHERE file_id = %s", (file_id,))
+            resume_after = cur.fetchone()['last_line']
+            cur.execute("UPDATE log_files SET status = %s, error_message = NULL WHERE id = %s", ('processing', file_id))
+        else:
+            cur.execute(
+                "INSERT INTO log_files (filename, file_size, total_lines, status, source_key) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                (filename, s3_object.get('ContentLength', 0), 0, 'processing', file_key)
+            )
+            file_id = cur.fetchone()['id']
+            processed = 0
+            resume_after = 0
+        conn.commit()
+    
+    parse_line, lines, log_format = detect_parser(iter_lines(stream))
+    result = ingest_lines(
+        conn, file_id, lines, parse_line,
+        resume_after=resume_after, processed=processed
+    )
+    stats = result['statistics']
+    if resume_after:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("SELECT level, count FROM log_statistics WHERE file_id = %s", (file_id,))
+            stats = {row['level']: row['count'] for row in cur.fetchall()}
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'file_id': file_id,
+            'total_lines': result['total_lines'],
+            'statistics': stats,
+            'format': log_format
+        })
+    }
+
@@ -0,0 +1,72 @@
+"""
+Жизненный цикл записей логов. log_entries секционирована по file_id
+(LIST, одна секция на файл): удаление файла — DROP TABLE его секции вместо
+построчного DELETE, поэтому объём мёртвых строк и нагрузка на VACUUM не растут.
+Строки, попавшие в секцию по умолчанию (например, после восстановления из
+бэкапа), удаляются обычным DELETE.
+Модуль продублирован в backend/collect-logs — изменения вносить в обе копии.
+"""
+import os
+from typing import List
+
+DEFAULT_RETENTION_DAYS = 90
+FILE_TABLES = ('log_statistics', 'log_file_templates', 'log_histogram_minute', 'log_histogram_hour')
+
+
+def partition_name(file_id: int) -> str:
+    return f'log_entries_f{int(file_id)}'
+
+
+def ensure_partition(cur, file_id: int) -> None:
+    """Создаёт секцию log_entries для файла, если её ещё нет"""
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(file_id)} "
+        f"PARTITION OF log_entries FOR VALUES IN ({int(file_id)})"
+    )
+
+
+def drop_file(cur, file_id: int) -> None:
+    """Удаляет файл со всеми записями, статистикой и гистограммами"""
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL as exists", (partition_name(file_id),))
+    row = cur.fetchone()
+    exists = row['exists'] if isinstance(row, dict) else row[0]
+    if exists:
+        cur.execute(f"DROP TABLE {partition_name(file_id)}")
+    else:
+        cur.execute("DELETE FROM log_entries WHERE file_id = %s", (file_id,))
+
+    for table in FILE_TABLES:
+        cur.execute(f"DELETE FROM {table} WHERE file_id = %s", (file_id,))
+    # Источник автосбора начнёт новый суточный файл
+    cur.execute(
+        "UPDATE log_sources SET file_id = NULL, file_date = NULL WHERE file_id = %s",
+        (file_id,)
+    )
+    cur.execute("DELETE FROM log_files WHERE id = %s", (file_id,))
+
+
+def retention_days() -> int:
+    """Срок хранения из LOG_RETENTION_DAYS; 0 — хранить бессрочно"""
+    return int(os.environ.get('LOG_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+
+
+def apply_retention(conn, days: int) -> List[int]:
+    """
+    Удаляет файлы, загруженные раньше чем days дней назад.
+    Каждый файл удаляется в своей транзакции. Возвращает id удалённых файлов.
+    """
+    if days <= 0:
+        return []
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT id FROM log_files WHERE uploaded_at < NOW() - make_interval(days => %s) ORDER BY id",
+            (days,)
+        )
+        expired = [row[0] for row in cur.fetchall()]
+
+        for file_id in expired:
+            drop_file(cur, file_id)
+            conn.commit()
+
+    return expired
@@ -0,0 +1,203 @@
+"""
+Выделение шаблонов сообщений логов (алгоритм в духе Drain).
+Сообщения разбиваются на токены по пробелу, очевидные переменные (числа, hex,
+UUID, IP) сразу маскируются, затем сообщение относится к ближайшему кластеру
+с тем же уровнем, числом токенов и первым токеном. Несовпавшие позиции
+становятся плейсхолдерами <*>, значения в них — параметры записи.
+
+Текст версии шаблона после записи в БД не меняется: если кластер обобщается,
+появляется новая версия (новая строка log_templates с тем же cluster_id),
+поэтому параметры любой записи выделяются из её message и template_id.
+Модуль продублирован в backend/collect-logs — изменения вносить в обе копии.
+"""
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+WILDCARD = '<*>'
+SIMILARITY_THRESHOLD = 0.5
+MAX_TOKENS = 100
+MAX_CLUSTERS_PER_GROUP = 200
+MAX_LOADED_CLUSTERS = 10000
+EXAMPLE_MAX_LENGTH = 1000
+
+VARIABLE_TOKEN = re.compile(
+    r'^(?:'
+    r'[-+]?\d+(?:[.,:]\d+)*[a-zA-Z%]{0,3}'
+    r'|0x[0-9a-fA-F]+'
+    r'|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
+    r'|[0-9a-fA-F]{16,}'
+    r'|\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?'
+    r')[,;.)\]]?$'
+)
+
+
+def tokenize(message: str) -> List[str]:
+    """Разбиение по одиночному пробелу: ' '.join(tokens) == message"""
+    return message.split(' ')
+
+
+def render_template(template: str, params: Optional[List[str]]) -> str:
+    """Собирает исходное сообщение из текста шаблона и параметров"""
+    values = iter(params or [])
+    return ' '.join(next(values, '') if token == WILDCARD else token for token in tokenize(template))
+
+
+def extract_params(template: str, message: str) -> Optional[List[str]]:
+    """Значения плейсхолдеров: токены message на местах <*>; None — message не по этому шаблону"""
+    tokens = tokenize(message)
+    template_tokens = tokenize(template)
+    if len(tokens) != len(template_tokens):
+        return None
+    return [token for token, pattern in zip(tokens, template_tokens) if pattern == WILDCARD]
+
+
+class TemplateVersion:
+    """Конкретный текст шаблона, на который ссылаются записи log_entries"""
+
+    def __init__(self, cluster: 'Cluster', tokens: List[str], db_id: Optional[int] = None):
+        self.cluster = cluster
+        self.tokens = tokens
+        self.db_id = db_id
+        self.wildcards = [i for i, token in enumerate(tokens) if token == WILDCARD]
+        self.count = 0
+        self.first_seen: Optional[datetime] = None
+        self.last_seen: Optional[datetime] = None
+        self.example: Optional[str] = None
+
+    @property
+    def template(self) -> str:
+        return ' '.join(self.tokens)
+
+
+class Cluster:
+    def __init__(self, cluster_id: Optional[int], level: str, tokens: List[str], db_id: Optional[int] = None):
+        self.cluster_id = cluster_id
+        self.level = level
+        self.current = TemplateVersion(self, tokens, db_id)
+
+    def similarity(self, tokens: List[str]) -> float:
+        same = sum(1 for a, b in zip(self.current.tokens, tokens) if a == b)
+        return same / len(tokens)
+
+    def absorb(self, tokens: List[str]) -> TemplateVersion:
+        merged = [a if a == b else WILDCARD for a, b in zip(self.current.tokens, tokens)]
+        if merged != self.current.tokens:
+            self.current = TemplateVersion(self, merged)
+        return self.current
+
+
+class TemplateMiner:
+    """
+    Дерево кластеров: (уровень, число токенов, первый токен) -> кластеры.
+    Состояние загружается из log_templates, новые и изменённые версии
+    сохраняются методом flush перед записью очередной пачки log_entries.
+    """
+
+    def __init__(self, file_id: int):
+        self.file_id = file_id
+        self.groups: Dict[Tuple[str, int, str], List[Cluster]] = {}
+        self.dirty: Dict[int, TemplateVersion] = {}
+
+    @staticmethod
+    def group_key(level: str, tokens: List[str]) -> Tuple[str, int, str]:
+        first = tokens[0]
+        return level, len(tokens), WILDCARD if first == WILDCARD or any(c.isdigit() for c in first) else first
+
+    def load(self, cur) -> None:
+        """Загружает актуальные версии самых свежих кластеров"""
+        cur.execute(
+            """SELECT * FROM (
+                   SELECT DISTINCT ON (cluster_id) id, cluster_id, level, template, last_seen
+                   FROM log_templates
+                   ORDER BY cluster_id, id DESC
+               ) t
+               ORDER BY last_seen DESC NULLS LAST
+               LIMIT %s""",
+            (MAX_LOADED_CLUSTERS,)
+        )
+        for db_id, cluster_id, level, template, _ in cur.fetchall():
+            tokens = tokenize(template)
+            cluster = Cluster(cluster_id, level, tokens, db_id)
+            self.groups.setdefault(self.group_key(level, tokens), []).append(cluster)
+
+    def add(self, message: str, level: Optional[str], seen_at: datetime, raw_line: str) -> Optional[Tuple[TemplateVersion, List[str]]]:
+        """
+        Относит сообщение к кластеру. Возвращает версию шаблона и параметры
+        либо None, если сообщение не шаблонизируется (пустое, слишком длинное
+        или содержит сам плейсхолдер).
+        """
+        if not message or WILDCARD in message:
+            return None
+        tokens = tokenize(message)
+        if len(tokens) > MAX_TOKENS:
+            return None
+
+        level = level or 'UNKNOWN'
+        masked = [WILDCARD if VARIABLE_TOKEN.match(token) else token for token in tokens]
+        clusters = self.groups.setdefault(self.group_key(level, masked), [])
+
+        best, best_sim = None, 0.0
+        for cluster in clusters:
+            sim = cluster.similarity(masked)
+            if sim > best_sim:
+                best, best_sim = cluster, sim
+
+        if best is not None and best_sim >= SIMILARITY_THRESHOLD:
+            version = best.absorb(masked)
+        elif len(clusters) < MAX_CLUSTERS_PER_GROUP:
+            best = Cluster(None, level, masked)
+            clusters.append(best)
+            version = best.current
+        else:
+            return None
+
+        version.count += 1
+        if version.first_seen is None or seen_at < version.first_seen:
+            version.first_seen = seen_at
+        if version.last_seen is None or seen_at > version.last_seen:
+            version.last_seen = seen_at
+        if version.example is None:
+            version.example = raw_line[:EXAMPLE_MAX_LENGTH]
+        self.dirty[id(version)] = version
+
+        return version, [tokens[i] for i in version.wildcards]
+
+    def flush(self, cur) -> None:
+        """
+        Записывает новые версии шаблонов и накопленные счётчики.
+        После вызова у всех использованных версий заполнен db_id.
+        """
+        for version in self.dirty.values():
+            cluster = version.cluster
+            if version.db_id is None:
+                cur.execute(
+                    """INSERT INTO log_templates
+                       (cluster_id, level, template, token_count, count, first_seen, last_seen, example_line, first_file_id)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+                    (cluster.cluster_id, cluster.level, version.template, len(version.tokens), version.count,
+                     version.first_seen, version.last_seen, version.example, self.file_id)
+                )
+                version.db_id = cur.fetchone()[0]
+                if cluster.cluster_id is None:
+                    cluster.cluster_id = version.db_id
+                    cur.execute("UPDATE log_templates SET cluster_id = id WHERE id = %s", (version.db_id,))
+            else:
+                cur.execute(
+                    """UPDATE log_templates SET
+                           count = count + %s,
+                           first_seen = LEAST(first_seen, %s),
+                           last_seen = GREATEST(last_seen, %s),
+                           example_line = COALESCE(example_line, %s)
+                       WHERE id = %s""",
+                    (version.count, version.first_seen, version.last_seen, version.example, version.db_id)
+                )
+            cur.execute(
+                """INSERT INTO log_file_templates (file_id, cluster_id, count) VALUES (%s, %s, %s)
+                   ON CONFLICT (file_id, cluster_id) DO UPDATE SET count = log_file_templates.count + EXCLUDED.count""",
+                (self.file_id, cluster.cluster_id, version.count)
+            )
+            version.count = 0
+            version.first_seen = None
+            version.last_seen = None
+        self.dirty = {}
@@ -1821,11 +1821,13 @@ def handle_payments(method: str, event: Dict[str, Any], conn) -> Dict[str, Any]:
             cur.execute(f'DELETE FROM {SCHEMA}.custom_field_values WHERE payment_id = %s', (payment_id,))
             cur.execute(f'DELETE FROM {SCHEMA}.payment_custom_field_values WHERE payment_id = %s', (payment_id,))
             cur.execute(f'DELETE FROM {SCHEMA}.payment_custom_values WHERE payment_id = %s', (payment_id,))
-            cur.execute(f'UPDATE {SCHEMA}.planned_payments SET converted_to_payment_id = NULL WHERE converted_to_payment_id = %s', (payment_id,))
+            # updated_at меняет отпечаток planned_payments — правило снова активно, прогноз пересчитается
+            cur.execute(f'UPDATE {SCHEMA}.planned_payments SET converted_to_payment_id = NULL, updated_at = NOW() WHERE converted_to_payment_id = %s', (payment_id,))
             
             # Удаляем платёж
             cur.execute(f'DELETE FROM {SCHEMA}.payments WHERE id = %s', (payment_id,))
             conn.commit()
+            invalidate_forecast_cache(clinic_id)
             
             # Audit log
             cur.execute(f"SELECT username FROM {SCHEMA}.users WHERE id = %s", (payload['user_id'],))
@@ -4698,6 +4700,7 @@ def handle_planned_payments(method: str, event: Dict[str, Any], conn) -> Dict[st
             
             new_id = cur.fetchone()['id']
             conn.commit()
+            invalidate_forecast_cache(clinic_id)
             
             cur.execute(f"""
                 SELECT pp.id, pp.category_id, c.name as category_name, c.icon as category_icon,
@@ -4762,7 +4765,8 @@ def handle_planned_payments(method: str, event: Dict[str, Any], conn) -> Dict[st
                 f"""UPDATE {SCHEMA}.planned_payments SET
                     category_id = %s, amount = %s, description = %s, planned_date = %s,
                     legal_entity_id = %s, contractor_id = %s, department_id = %s, service_id = %s,
-                    invoice_number = %s, invoice_date = %s, recurrence_type = %s, recurrence_end_date = %s
+                    invoice_number = %s, invoice_date = %s, recurrence_type = %s, recurrence_end_date = %s,
+                    updated_at = NOW()
                 WHERE id = %s RETURNING id""",
                 (category_id, amount, description, planned_date, legal_entity_id,
                  contractor_id, department_id, service_id, invoice_number, invoice_date,
@@ -4774,6 +4778,7 @@ def handle_planned_payments(method: str, event: Dict[str, Any], conn) -> Dict[st
                 return response(404, {'error': 'Planned payment not found'})
             
             conn.commit()
+            invalidate_forecast_cache(clinic_id)
             
             cur.execute(f"""
                 SELECT pp.id, pp.category_id, c.name as category_name, c.icon as category_icon,
@@ -4817,7 +4822,7 @@ def handle_planned_payments(method: str, event: Dict[str, Any], conn) -> Dict[st
             if pp_del['clinic_id'] != clinic_id:
                 return response(403, {'error': 'Запись принадлежит другому порталу'})
             cur.execute(
-                f"UPDATE {SCHEMA}.planned_payments SET is_active = false WHERE id = %s RETURNING id", 
+                f"UPDATE {SCHEMA}.planned_payments SET is_active = false, updated_at = NOW() WHERE id = %s RETURNING id", 
                 (planned_payment_id,)
             )
             row = cur.fetchone()
@@ -4826,6 +4831,7 @@ def handle_planned_payments(method: str, event: Dict[str, Any], conn) -> Dict[st
                 return response(404, {'error': 'Planned payment not found'})
             
             conn.commit()
+            invalidate_forecast_cache(clinic_id)
             return response(200, {'message': 'Planned payment deleted'})
         
         return response(405, {'error': 'Method not allowed'})
@@ -4837,6 +4843,214 @@ def handle_planned_payments(method: str, event: Dict[str, Any], conn) -> Dict[st
     finally:
         cur.close()
 
+# Кэш прогноза движения денежных средств: ключ (clinic_id, months, horizon_start).
+# Запись хранит отпечаток planned_payments; при любом изменении правил
+# отпечаток меняется и развёртка пересчитывается.
+_forecast_cache: Dict[tuple, Dict[str, Any]] = {}
+
+FORECAST_MAX_MONTHS = 36
+
+# Шаг повторения совпадает с process-scheduled-payments (там месяц = 30 дней,
+# год = 365 дней), чтобы прогноз не расходился с фактически созданными платежами.
+RECURRENCE_STEP_SQL = """
+    CASE pp.recurrence_type
+        WHEN 'daily' THEN INTERVAL '1 day'
+        WHEN 'weekly' THEN INTERVAL '7 days'
+        WHEN 'monthly' THEN INTERVAL '30 days'
+        WHEN 'yearly' THEN INTERVAL '365 days'
+    END
+"""
+
+def invalidate_forecast_cache(clinic_id: Optional[int]) -> None:
+    '''Сбрасывает закэшированные прогнозы клиники после изменения запланированных платежей.'''
+    for key in [k for k in _forecast_cache if k[0] == clinic_id]:
+        _forecast_cache.pop(key, None)
+
+def get_planned_payments_fingerprint(cur, clinic_id: Optional[int]) -> tuple:
+    '''Дешёвый отпечаток состояния planned_payments клиники (один проход по индексу).'''
+    cur.execute(f"""
+        SELECT COUNT(*) as cnt, MAX(id) as max_id, MAX(updated_at) as max_updated_at
+        FROM {SCHEMA}.planned_payments
+        WHERE {clinic_sql(clinic_id)}
+    """)
+    row = cur.fetchone()
+    return (row['cnt'], row['max_id'], str(row['max_updated_at']))
+
+def expand_planned_payments(cur, clinic_id: Optional[int], horizon_start: datetime, horizon_end: datetime) -> list:
+    '''Разворачивает все активные правила повторения в даты внутри горизонта.
+    Развёртка выполняется одним запросом (generate_series по всем правилам сразу),
+    в Python возвращаются только агрегаты месяц × категория × отдел × юрлицо.'''
+    cur.execute(f"""
+        WITH rules AS (
+            SELECT pp.id, pp.amount, pp.category_id, pp.department_id, pp.legal_entity_id,
+                   pp.planned_date, pp.recurrence_end_date,
+                   {RECURRENCE_STEP_SQL} as step
+            FROM {SCHEMA}.planned_payments pp
+            WHERE pp.is_active = true
+              AND pp.converted_to_payment_id IS NULL
+              AND pp.planned_date < %(horizon_end)s
+              AND {clinic_sql(clinic_id, 'pp')}
+        ),
+        occurrences AS (
+            SELECT r.amount, r.category_id, r.department_id, r.legal_entity_id, occ
+            FROM rules r
+            CROSS JOIN LATERAL generate_series(
+                r.planned_date,
+                CASE WHEN r.step IS NULL THEN r.planned_date ELSE %(horizon_end)s END,
+                COALESCE(r.step, INTERVAL '1 day')
+            ) as occ
+            WHERE occ >= %(horizon_start)s
+              AND occ < %(horizon_end)s
+              AND (r.recurrence_end_date IS NULL OR occ::date <= r.recurrence_end_date)
+        )
+        SELECT to_char(date_trunc('month', o.occ), 'YYYY-MM') as month,
+               o.category_id, c.name as category_name,
+               o.department_id, cd.name as department_name,
+               o.legal_entity_id, le.name as legal_entity_name,
+               SUM(o.amount) as amount,
+               COUNT(*) as count
+        FROM occurrences o
+        LEFT JOIN {SCHEMA}.categories c ON o.category_id = c.id
+        LEFT JOIN {SCHEMA}.customer_departments cd ON o.department_id = cd.id
+        LEFT JOIN {SCHEMA}.legal_entities le ON o.legal_entity_id = le.id
+        GROUP BY 1, o.category_id, c.name, o.department_id, cd.name, o.legal_entity_id, le.name
+    """, {'horizon_start': horizon_start, 'horizon_end': horizon_end})
+    return [dict(row) for row in cur.fetchall()]
+
+def get_approved_unpaid_payments(cur, clinic_id: Optional[int], horizon_start: datetime, horizon_end: datetime) -> list:
+    '''Согласованные платежи с датой оплаты внутри горизонта, в тех же разрезах.'''
+    cur.execute(f"""
+        SELECT to_char(date_trunc('month', p.payment_date), 'YYYY-MM') as month,
+               p.category_id, c.name as category_name,
+               p.department_id, cd.name as department_name,
+               p.legal_entity_id, le.name as legal_entity_name,
+               SUM(p.amount) as amount,
+               COUNT(*) as count
+        FROM {SCHEMA}.payments p
+        LEFT JOIN {SCHEMA}.categories c ON p.category_id = c.id
+        LEFT JOIN {SCHEMA}.customer_departments cd ON p.department_id = cd.id
+        LEFT JOIN {SCHEMA}.legal_entities le ON p.legal_entity_id = le.id
+        WHERE p.status = 'approved'
+          AND p.payment_date >= %(horizon_start)s
+          AND p.payment_date < %(horizon_end)s
+          AND {clinic_sql(clinic_id, 'p')}
+        GROUP BY 1, p.category_id, c.name, p.department_id, cd.name, p.legal_entity_id, le.name
+    """, {'horizon_start': horizon_start, 'horizon_end': horizon_end})
+    return [dict(row) for row in cur.fetchall()]
+
+def aggregate_forecast(planned_rows: list, approved_rows: list, months: list) -> Dict[str, Any]:
+    '''Сводит развёрнутые правила и согласованные платежи по месяцам и справочникам.'''
+    by_month = {m: {'month': m, 'planned_amount': 0.0, 'planned_count': 0, 'approved_amount': 0.0, 'approved_count': 0} for m in months}
+    dimensions = {
+        'by_category': ('category_id', 'category_name'),
+        'by_department': ('department_id', 'department_name'),
+        'by_legal_entity': ('legal_entity_id', 'legal_entity_name'),
+    }
+    grouped = {name: {} for name in dimensions}
+
+    for source, rows in (('planned', planned_rows), ('approved', approved_rows)):
+        for row in rows:
+            amount = float(row['amount'])
+            count = int(row['count'])
+            month = by_month.get(row['month'])
+            if month is not None:
+                month[f'{source}_amount'] += amount
+                month[f'{source}_count'] += count
+            for name, (id_key, name_key) in dimensions.items():
+                item = grouped[name].setdefault(row[id_key], {
+                    'id': row[id_key],
+                    'name': row[name_key] or 'Не указано',
+                    'planned_amount': 0.0,
+                    'approved_amount': 0.0,
+                    'months': {},
+                })
+                item[f'{source}_amount'] += amount
+                item['months'][row['month']] = item['months'].get(row['month'], 0.0) + amount
+
+    result: Dict[str, Any] = {'months': []}
+    for m in months:
+        entry = by_month[m]
+        entry['total_amount'] = round(entry['planned_amount'] + entry['approved_amount'], 2)
+        entry['planned_amount'] = round(entry['planned_amount'], 2)
+        entry['approved_amount'] = round(entry['approved_amount'], 2)
+        result['months'].append(entry)
+
+    for name, items in grouped.items():
+        values = []
+        for item in items.values():
+            item['total_amount'] = round(item['planned_amount'] + item['approved_amount'], 2)
+            item['planned_amount'] = round(item['planned_amount'], 2)
+            item['approved_amount'] = round(item['approved_amount'], 2)
+            item['months'] = {k: round(v, 2) for k, v in sorted(item['months'].items())}
+            values.append(item)
+        values.sort(key=lambda x: x['total_amount'], reverse=True)
+        result[name] = values
+
+    result['totals'] = {
+        'planned_amount': round(sum(m['planned_amount'] for m in result['months']), 2),
+        'approved_amount': round(sum(m['approved_amount'] for m in result['months']), 2),
+        'total_amount': round(sum(m['total_amount'] for m in result['months']), 2),
+    }
+    return result
+
+def handle_cash_flow_forecast(method: str, event: Dict[str, Any], conn) -> Dict[str, Any]:
+    """Прогноз движения денежных средств по запланированным и согласованным платежам"""
+    if method != 'GET':
+        return response(405, {'error': 'Method not allowed'})
+
+    payload, error = verify_token_and_permission(event, conn, 'payments.read')
+    if error:
+        return error
+
+    params = event.get('queryStringParameters') or {}
+    try:
+        months_count = int(params.get('months', 12))
+    except (ValueError, TypeError):
+        return response(400, {'error': 'months должен быть числом'})
+    if months_count < 1 or months_count > FORECAST_MAX_MONTHS:
+        return response(400, {'error': f'months должен быть от 1 до {FORECAST_MAX_MONTHS}'})
+
+    clinic_id = get_clinic_id(event)
+    now_moscow = datetime.now(ZoneInfo('Europe/Moscow')).replace(tzinfo=None)
+    horizon_start = now_moscow.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    months = []
+    year, month = horizon_start.year, horizon_start.month
+    for _ in range(months_count):
+        months.append(f'{year:04d}-{month:02d}')
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    horizon_end = datetime(year, month, 1)
+
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        fingerprint = get_planned_payments_fingerprint(cur, clinic_id)
+        cache_key = (clinic_id, months_count, horizon_start)
+        cached = _forecast_cache.get(cache_key)
+        if cached and cached['fingerprint'] == fingerprint:
+            planned_rows = cached['planned_rows']
+            from_cache = True
+        else:
+            planned_rows = expand_planned_payments(cur, clinic_id, horizon_start, horizon_end)
+            _forecast_cache[cache_key] = {'fingerprint': fingerprint, 'planned_rows': planned_rows}
+            from_cache = False
+
+        approved_rows = get_approved_unpaid_payments(cur, clinic_id, horizon_start, horizon_end)
+        result = aggregate_forecast(planned_rows, approved_rows, months)
+        result.update({
+            'horizon_start': horizon_start.date().isoformat(),
+            'horizon_end': horizon_end.date().isoformat(),
+            'cached': from_cache,
+        })
+        return response(200, result)
+
+    except Exception as e:
+        conn.rollback()
+        log(f"[CASH FLOW FORECAST ERROR] {e}")
+        return response(500, {'error': 'Internal server error'})
+    finally:
+        cur.close()
+
 def handle_clinics(method: str, event: Dict[str, Any], conn) -> Dict[str, Any]:
     '''Обработка запросов к справочнику клиник. Клиники — сущность верхнего уровня,
     список НЕ фильтруется по clinic_id (клиники видны на уровне общей системы).'''
@@ -5084,6 +5298,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             result = handle_savings_list(method, event, conn, payload)
         elif endpoint == 'planned-payments':
             result = handle_planned_payments(method, event, conn)
+        elif endpoint == 'cash-flow-forecast':
+            result = handle_cash_flow_forecast(method, event, conn)
         elif endpoint == 'payment-views':
             result = handle_payment_views(method, event, conn)
         else:
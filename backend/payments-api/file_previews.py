@@ -0,0 +1,38 @@
+"""
+Превью загруженных файлов: уменьшенные копии картинок и первой страницы PDF.
+Картинки лежат в бакете по хэшу содержимого исходника
+(previews/<2 символа>/<хэш>/<размер>.jpg), таблица file_previews связывает
+URL исходного файла с готовыми превью. Здесь — общие константы и чтение
+превью для ответов API; генерирует их функция generate-previews.
+Модуль продублирован в backend/generate-previews, backend/approvals-api и
+backend/gallery-works — изменения вносить во все копии.
+"""
+from typing import Dict, Iterable
+
+PREVIEW_PREFIX = 'previews/'
+# Название размера -> наибольшая сторона в пикселях
+PREVIEW_SIZES = {'sm': 160, 'md': 480, 'lg': 1024}
+
+
+def preview_key(sha256: str, size: str) -> str:
+    return f'{PREVIEW_PREFIX}{sha256[:2]}/{sha256}/{size}.jpg'
+
+
+def _row(row):
+    return (row['source_url'], row['previews']) if isinstance(row, dict) else (row[0], row[1])
+
+
+def fetch_previews(cur, schema: str, urls: Iterable) -> Dict[str, Dict[str, str]]:
+    """
+    Готовые превью для списка URL одним запросом: {url: {размер: url превью}}.
+    Файлов, для которых превью ещё нет или их нельзя построить, в ответе нет.
+    """
+    urls = list({url for url in urls if url})
+    if not urls:
+        return {}
+    cur.execute(
+        f"""SELECT source_url, previews FROM {schema}.file_previews
+            WHERE source_url = ANY(%s) AND status = 'ready'""",
+        (urls,)
+    )
+    return dict(_row(row) for row in cur.fetchall())
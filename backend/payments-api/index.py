@@ -8,6 +8,9 @@ from typing import Dict, Any
 from datetime import datetime
 from pydantic import BaseModel, Field
 
+from file_blobs import release
+from file_previews import fetch_previews
+
 try:
     import boto3
 except Exception:
@@ -115,14 +118,28 @@ def extract_s3_key_from_url(file_url: str) -> str:
     return file_url[idx + len(marker):]
 
 
-def delete_from_s3(file_url: str) -> bool:
-    """Удаляет файл из S3 по CDN-ссылке. Возвращает True при успехе. Ошибки не прерывают поток."""
+def delete_from_s3(file_url: str, cur=None) -> bool:
+    """
+    Удаляет файл из S3 по CDN-ссылке. Возвращает True при успехе. Ошибки не прерывают поток.
+    Файл, учтённый в file_blobs, может использоваться другими документами: при переданном
+    курсоре снимается одна ссылка, а объект удаляется только вместе с последней.
+    """
     try:
         if not boto3:
             return False
         key = extract_s3_key_from_url(file_url)
         if not key:
             return False
+        if cur is not None:
+            cur.execute('SAVEPOINT release_blob')
+            try:
+                last_reference = release(cur, SCHEMA, key)
+                cur.execute('RELEASE SAVEPOINT release_blob')
+            except Exception:
+                cur.execute('ROLLBACK TO SAVEPOINT release_blob')
+                raise
+            if not last_reference:
+                return True
         aws_key = os.environ.get('AWS_ACCESS_KEY_ID')
         aws_secret = os.environ.get('AWS_SECRET_ACCESS_KEY')
         if not aws_key or not aws_secret:
@@ -162,6 +179,9 @@ def fetch_payment_documents(cur, payment_id: int) -> list:
         if d.get('uploaded_at'):
             d['uploaded_at'] = d['uploaded_at'].isoformat()
         docs.append(d)
+    previews_map = fetch_previews(cur, SCHEMA, [d['file_url'] for d in docs])
+    for d in docs:
+        d['previews'] = previews_map.get(d['file_url'])
     return docs
 
 
@@ -355,6 +375,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         rd['uploaded_at'] = rd['uploaded_at'].isoformat()
                     cash_receipts_map.setdefault(pid, []).append(rd)
 
+            file_urls = [row['invoice_file_url'] for row in rows] + [row['cash_receipt_url'] for row in rows]
+            file_urls += [d['file_url'] for docs in list(documents_map.values()) + list(cash_receipts_map.values()) for d in docs]
+            previews_map = fetch_previews(cur, SCHEMA, file_urls)
+            for docs in list(documents_map.values()) + list(cash_receipts_map.values()):
+                for d in docs:
+                    d['previews'] = previews_map.get(d['file_url'])
+
             for row in rows:
                 payment = dict(row)
                 payment['amount'] = float(payment['amount'])
@@ -379,6 +406,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 payment['custom_fields'] = custom_fields_map.get(payment['id'], [])
                 payment['documents'] = documents_map.get(payment['id'], [])
                 payment['cash_receipts'] = cash_receipts_map.get(payment['id'], [])
+                payment['invoice_file_previews'] = previews_map.get(payment['invoice_file_url'])
+                payment['cash_receipt_previews'] = previews_map.get(payment['cash_receipt_url'])
                 payments.append(payment)
             
             cur.close()
@@ -836,7 +865,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         f"DELETE FROM {SCHEMA}.payment_documents WHERE id = %s AND payment_id = %s",
                         (document_id, payment_id)
                     )
-                    delete_from_s3(doc['file_url'])
+                    delete_from_s3(doc['file_url'], cur)
 
                     # Если удалён файл, совпадающий с payments.invoice_file_url — подменим на другой/NULL
                     cur.execute(
@@ -914,7 +943,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         )
                     # Удаляем старый физический файл из S3 (если CDN-ссылка)
                     if doc['file_url'] and doc['file_url'] != file_url:
-                        delete_from_s3(doc['file_url'])
+                        delete_from_s3(doc['file_url'], cur)
                     write_audit_approval(
                         cur, payment_id, payload['user_id'],
                         f'Файл «{doc["file_name"] or "без имени"}» заменён на «{new_name}»'
@@ -102,7 +102,8 @@ def process_scheduled_payments() -> Dict[str, Any]:
                                 UPDATE {SCHEMA}.planned_payments 
                                 SET planned_date = %s,
                                     converted_to_payment_id = NULL,
-                                    converted_at = NULL
+                                    converted_at = NULL,
+                                    updated_at = NOW()
                                 WHERE id = %s
                             """, (next_date, planned['id']))
                         else:
@@ -111,7 +112,8 @@ def process_scheduled_payments() -> Dict[str, Any]:
                                 UPDATE {SCHEMA}.planned_payments 
                                 SET converted_to_payment_id = %s,
                                     converted_at = %s,
-                                    is_active = false
+                                    is_active = false,
+                                    updated_at = NOW()
                                 WHERE id = %s
                             """, (new_payment_id, now_moscow, planned['id']))
                     else:
@@ -119,7 +121,8 @@ def process_scheduled_payments() -> Dict[str, Any]:
                         cur.execute(f"""
                             UPDATE {SCHEMA}.planned_payments 
                             SET converted_to_payment_id = %s,
-                                converted_at = %s
+                                converted_at = %s,
+                                updated_at = NOW()
                             WHERE id = %s
                         """, (new_payment_id, now_moscow, planned['id']))
                     
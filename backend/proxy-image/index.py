@@ -1,26 +1,293 @@
+import urllib.parse
 import urllib.request
 import base64
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from io import BytesIO
+from typing import Optional, Dict, Any, Tuple
+
+import boto3
+from PIL import Image, ImageOps
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
+    'Access-Control-Expose-Headers': 'ETag',
+    'Access-Control-Max-Age': '86400',
+}
+
+S3_BUCKET = 'files'
+CACHE_PREFIX = 'image-cache/'
+# Источники — только CDN платформы и бакет проекта, иначе функция с кэшем
+# превращается в бесплатный прокси и хостинг для любых картинок
+ALLOWED_HOST = 'cdn.poehali.dev'
+BUCKET_PREFIX = f'https://bucket.poehali.dev/{S3_BUCKET}/'
+# Кэш в бакете ограничен: на каждый из CACHE_SHARDS префиксов (первые два
+# символа хэша) приходится своя доля MAX_CACHE_BYTES, сверх неё удаляются самые старые картинки
+MAX_CACHE_BYTES = 4 * 1024 * 1024 * 1024
+CACHE_SHARDS = 256
+# Результат для пары (url, параметры) не меняется — браузер и CDN могут хранить его сколько угодно
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+MAX_SOURCE_BYTES = 15 * 1024 * 1024
+MAX_SOURCE_PIXELS = 40_000_000
+READ_CHUNK_BYTES = 256 * 1024
+# Больше этого картинка не отдаётся через функцию, а перенаправляется на CDN
+MAX_INLINE_BYTES = 4 * 1024 * 1024
+MAX_DIMENSION = 4000
+DEFAULT_QUALITY = 85
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+
+class ImageLRU:
+    """Кэш готовых картинок в памяти экземпляра функции, ограниченный суммарным размером"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self.items.get(key)
+        if item is not None:
+            self.items.move_to_end(key)
+        return item
+
+    def put(self, key: str, item: Dict[str, Any]) -> None:
+        if len(item['data']) > self.max_bytes:
+            return
+        old = self.items.pop(key, None)
+        if old is not None:
+            self.size -= len(old['data'])
+        self.items[key] = item
+        self.size += len(item['data'])
+        while self.size > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.size -= len(evicted['data'])
+
+_lru = ImageLRU(32 * 1024 * 1024)
+
+class ProxyError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def source_allowed(url: str) -> bool:
+    if url.startswith(BUCKET_PREFIX):
+        return True
+    parts = urllib.parse.urlsplit(url)
+    try:
+        port = parts.port
+    except ValueError:
+        return False
+    return parts.scheme == 'https' and parts.hostname == ALLOWED_HOST and port is None and not parts.username
+
+class AllowedRedirects(urllib.request.HTTPRedirectHandler):
+    """Редирект источника допускается только на разрешённый адрес"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if not source_allowed(newurl):
+            raise ProxyError(403, 'Source redirects to a host that is not allowed')
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+_opener = urllib.request.build_opener(AllowedRedirects)
+
+def respond_error(status: int, message: str) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
+        'body': json.dumps({'error': message}, ensure_ascii=False)
+    }
+
+def get_s3():
+    return boto3.client('s3',
+        endpoint_url='https://bucket.poehali.dev',
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
+    )
+
+def cdn_url(key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ.get('AWS_ACCESS_KEY_ID')}/bucket/{key}"
+
+def parse_params(qs: Dict[str, str]) -> Dict[str, Any]:
+    """Параметры преобразования; пустой словарь — картинка отдаётся как есть"""
+    params: Dict[str, Any] = {}
+    for name in ('w', 'h'):
+        if qs.get(name):
+            try:
+                value = int(qs[name])
+            except ValueError:
+                raise ProxyError(400, f'{name} must be an integer')
+            if not 1 <= value <= MAX_DIMENSION:
+                raise ProxyError(400, f'{name} must be between 1 and {MAX_DIMENSION}')
+            params[name] = value
+    fmt = (qs.get('format') or '').lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt:
+        if fmt not in FORMATS:
+            raise ProxyError(400, f"format must be one of: {', '.join(FORMATS)}")
+        params['format'] = fmt
+    if qs.get('q'):
+        try:
+            quality = int(qs['q'])
+        except ValueError:
+            raise ProxyError(400, 'q must be an integer')
+        if not 1 <= quality <= 95:
+            raise ProxyError(400, 'q must be between 1 and 95')
+        params['q'] = quality
+    return params
+
+def cache_key(url: str, params: Dict[str, Any]) -> str:
+    raw = json.dumps({'url': url, **params}, sort_keys=True)
+    digest = hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    return f'{CACHE_PREFIX}{digest[:2]}/{digest}'
+
+def fetch_source(url: str) -> Tuple[bytes, str]:
+    """Исходник не больше MAX_SOURCE_BYTES: проверяется и Content-Length, и фактически прочитанное"""
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    try:
+        with _opener.open(req, timeout=10) as resp:
+            length = resp.headers.get('Content-Length')
+            if length and int(length) > MAX_SOURCE_BYTES:
+                raise ProxyError(413, f'Source image is larger than {MAX_SOURCE_BYTES} bytes')
+            parts = []
+            total = 0
+            for chunk in iter(lambda: resp.read(READ_CHUNK_BYTES), b''):
+                total += len(chunk)
+                if total > MAX_SOURCE_BYTES:
+                    raise ProxyError(413, f'Source image is larger than {MAX_SOURCE_BYTES} bytes')
+                parts.append(chunk)
+            content_type = resp.headers.get('Content-Type', 'image/jpeg')
+    except ProxyError:
+        raise
+    except Exception as e:
+        raise ProxyError(502, f'Upstream fetch failed: {str(e)[:200]}')
+    return b''.join(parts), content_type
+
+def transform(data: bytes, params: Dict[str, Any]) -> Tuple[bytes, str]:
+    """
+    Уменьшает картинку до w×h с сохранением пропорций (не увеличивает)
+    и перекодирует в нужный формат и качество.
+    """
+    try:
+        img = Image.open(BytesIO(data))
+        source_format = img.format
+        img = ImageOps.exif_transpose(img)
+    except Image.DecompressionBombError:
+        raise ProxyError(413, f'Source image has more than {MAX_SOURCE_PIXELS} pixels')
+    except Exception:
+        raise ProxyError(415, 'Source is not a supported image')
+
+    if 'w' in params or 'h' in params:
+        img.thumbnail((params.get('w', MAX_DIMENSION), params.get('h', MAX_DIMENSION)), Image.LANCZOS)
+
+    fmt = params.get('format') or ('png' if source_format == 'PNG' else 'webp' if source_format == 'WEBP' else 'jpeg')
+    pil_format, content_type = FORMATS[fmt]
+    if pil_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGBA') if img.mode != 'RGBA' else img
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        img = background
+
+    out = BytesIO()
+    options: Dict[str, Any] = {'optimize': True}
+    if pil_format in ('JPEG', 'WEBP'):
+        options['quality'] = params.get('q', DEFAULT_QUALITY)
+    img.save(out, pil_format, **options)
+    return out.getvalue(), content_type
+
+def load_cached(s3, key: str) -> Optional[Dict[str, Any]]:
+    try:
+        obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
+    except Exception as e:
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+            return None
+        raise
+    data = obj['Body'].read()
+    etag = obj.get('Metadata', {}).get('sha256') or hashlib.sha256(data).hexdigest()
+    return {'data': data, 'content_type': obj.get('ContentType') or 'image/jpeg', 'etag': f'"{etag}"'}
+
+def prune_cache(s3, key: str) -> None:
+    """Удаляет самые старые картинки префикса key, пока он не уложится в свою долю MAX_CACHE_BYTES"""
+    prefix = key.rsplit('/', 1)[0] + '/'
+    objects = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        objects.extend(page.get('Contents', []))
+    total = sum(obj['Size'] for obj in objects)
+    stale = []
+    for obj in sorted(objects, key=lambda o: o['LastModified']):
+        if total <= MAX_CACHE_BYTES // CACHE_SHARDS:
+            break
+        if obj['Key'] != key:
+            stale.append({'Key': obj['Key']})
+            total -= obj['Size']
+    for i in range(0, len(stale), 1000):
+        s3.delete_objects(Bucket=S3_BUCKET, Delete={'Objects': stale[i:i + 1000], 'Quiet': True})
+
+def build_image(s3, url: str, params: Dict[str, Any], key: str) -> Dict[str, Any]:
+    data, content_type = fetch_source(url)
+    if params:
+        data, content_type = transform(data, params)
+    digest = hashlib.sha256(data).hexdigest()
+    s3.put_object(
+        Bucket=S3_BUCKET, Key=key, Body=data, ContentType=content_type,
+        CacheControl=CACHE_CONTROL, Metadata={'sha256': digest}
+    )
+    try:
+        prune_cache(s3, key)
+    except Exception as e:
+        print(f'[PROXY IMAGE] cache prune failed: {e}')
+    return {'data': data, 'content_type': content_type, 'etag': f'"{digest}"'}
 
 def handler(event: dict, context) -> dict:
-    """Проксирует изображение кота для обхода CORS при скачивании раскраски"""
+    """
+    Проксирует изображения (раскраски, работы галереи) с CDN платформы и бакета
+    проекта для обхода CORS; прочие адреса отклоняются с 403.
+    Параметры: url, w и h — уменьшить с сохранением пропорций, format — jpeg/png/webp,
+    q — качество 1–95. Результат кэшируется в бакете по url и параметрам, перед
+    бакетом — LRU в памяти; размер кэша в бакете ограничен MAX_CACHE_BYTES.
+    Повторный запрос с If-None-Match получает 304.
+    """
     if event.get('httpMethod') == 'OPTIONS':
-        return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type', 'Access-Control-Max-Age': '86400'}, 'body': ''}
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
-    url = (event.get('queryStringParameters') or {}).get('url', '')
+    qs = event.get('queryStringParameters') or {}
+    url = qs.get('url', '')
     if not url:
-        return {'statusCode': 400, 'headers': {'Access-Control-Allow-Origin': '*'}, 'body': 'Missing url param'}
+        return respond_error(400, 'Missing url param')
+    if not source_allowed(url):
+        return respond_error(403, 'Source host is not allowed')
 
-    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-    with urllib.request.urlopen(req, timeout=10) as resp:
-        data = resp.read()
-        content_type = resp.headers.get('Content-Type', 'image/jpeg')
+    try:
+        params = parse_params(qs)
+        key = cache_key(url, params)
+        image = _lru.get(key)
+        if image is None:
+            s3 = get_s3()
+            image = load_cached(s3, key) or build_image(s3, url, params, key)
+            _lru.put(key, image)
+    except ProxyError as e:
+        return respond_error(e.status, str(e))
+
+    headers = {**CORS_HEADERS, 'ETag': image['etag'], 'Cache-Control': CACHE_CONTROL}
+    headers_in = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if image['etag'] in [t.strip() for t in (headers_in.get('if-none-match') or '').split(',')]:
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
+
+    if len(image['data']) > MAX_INLINE_BYTES:
+        return {'statusCode': 302, 'headers': {**headers, 'Location': cdn_url(key)}, 'body': ''}
 
     return {
         'statusCode': 200,
-        'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Content-Type': content_type,
-        },
-        'body': base64.b64encode(data).decode('utf-8'),
+        'headers': {**headers, 'Content-Type': image['content_type']},
+        'body': base64.b64encode(image['data']).decode('utf-8'),
         'isBase64Encoded': True,
     }
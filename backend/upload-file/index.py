@@ -2,9 +2,12 @@ import json
 import os
 import base64
 import boto3
+import re
 import uuid
 import jwt
-from datetime import datetime
+import psycopg2
+
+from file_blobs import store_bytes
 
 SCHEMA = 't_p61788166_html_to_frontend'
 
@@ -19,6 +22,11 @@ ALLOWED_MIME_TYPES = {
 ALLOWED_FOLDERS = {'works', 'payments', 'invoices', 'documents', 'avatars'}
 MAX_FILE_SIZE_MB = 20
 MAX_CHUNK_SIZE_BYTES = 5 * 1024 * 1024
+# Минимальный размер части S3 multipart upload (кроме последней)
+MIN_PART_SIZE_BYTES = 5 * 1024 * 1024
+MAX_CHUNKS = 100
+S3_BUCKET = 'files'
+UPLOAD_KEY_RE = re.compile(r'^([a-z]+)/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.([a-z]+)$')
 
 
 def make_response(status: int, body: dict) -> dict:
@@ -55,8 +63,100 @@ def verify_token(event: dict):
         return None
 
 
+def get_s3():
+    return boto3.client(
+        's3',
+        endpoint_url='https://bucket.poehali.dev',
+        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+    )
+
+
+def get_db():
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+
+def cdn_url(key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+
+
+def is_upload_key(key: str) -> bool:
+    """Ключ, выданный при начале загрузки: <папка>/<uuid>.<расширение>"""
+    match = UPLOAD_KEY_RE.match(key or '')
+    return bool(match) and match.group(1) in ALLOWED_FOLDERS and match.group(2) in ALLOWED_EXTENSIONS
+
+
+def list_parts(s3, key: str, upload_id: str) -> list:
+    """Части multipart upload, уже принятые S3"""
+    parts = []
+    marker = 0
+    while True:
+        resp = s3.list_parts(Bucket=S3_BUCKET, Key=key, UploadId=upload_id, PartNumberMarker=marker)
+        parts.extend(resp.get('Parts', []))
+        if not resp.get('IsTruncated'):
+            return parts
+        marker = resp['NextPartNumberMarker']
+
+
+def complete_upload(s3, key: str, upload_id: str, total_chunks: int, file_name: str):
+    """
+    Завершает загрузку, если S3 приняты все части 1..total_chunks.
+    Сборка файла выполняется на стороне S3 (CompleteMultipartUpload), данные
+    через функцию повторно не проходят. Если частей не хватает — возвращает
+    ответ со списком недостающих. Собранный файл остаётся под ключом загрузки:
+    хэш всего файла S3 для multipart upload не проверяет, а скачивать файл
+    ради дедупликации дороже самой загрузки.
+    """
+    parts = list_parts(s3, key, upload_id)
+    received = {p['PartNumber']: p for p in parts}
+    missing = [n for n in range(1, total_chunks + 1) if n not in received]
+    if missing:
+        return make_response(200, {
+            'uploadId': upload_id,
+            'key': key,
+            'complete': False,
+            'missingChunks': [n - 1 for n in missing],
+        })
+
+    total_size = sum(received[n]['Size'] for n in range(1, total_chunks + 1))
+    if total_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+        s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=key, UploadId=upload_id)
+        return make_response(400, {'error': f'Размер файла превышает {MAX_FILE_SIZE_MB} МБ'})
+    small = [n - 1 for n in range(1, total_chunks) if received[n]['Size'] < MIN_PART_SIZE_BYTES]
+    if small:
+        return make_response(400, {
+            'error': f'Все части, кроме последней, должны быть не меньше {MIN_PART_SIZE_BYTES // 1024 // 1024} МБ',
+            'chunks': small,
+        })
+
+    s3.complete_multipart_upload(
+        Bucket=S3_BUCKET, Key=key, UploadId=upload_id,
+        MultipartUpload={'Parts': [
+            {'PartNumber': n, 'ETag': received[n]['ETag']} for n in range(1, total_chunks + 1)
+        ]},
+    )
+    return make_response(200, {
+        'url': cdn_url(key),
+        'key': key,
+        'fileName': file_name,
+        'size': total_size,
+        'deduplicated': False,
+        'message': 'Файл успешно загружен',
+        'complete': True,
+    })
+
+
 def handler(event: dict, context) -> dict:
-    """API для загрузки файлов в S3. Требует авторизацию. Только разрешённые типы файлов."""
+    """
+    API для загрузки файлов в S3. Требует авторизацию. Только разрешённые типы файлов.
+    Файл из одной части сохраняется сразу. Части большого файла становятся
+    частями S3 multipart upload (chunkIndex + 1 = номер части), поэтому их можно
+    отправлять параллельно и повторно; action=start начинает загрузку,
+    action=status возвращает принятые части, action=complete собирает файл
+    (после последней части это происходит автоматически), action=abort отменяет.
+    Файл из одной части хранится по хэшу содержимого (см. file_blobs): повторная
+    загрузка тех же байтов возвращает существующий файл.
+    """
     method = event.get('httpMethod', 'GET')
 
     if method == 'OPTIONS':
@@ -71,6 +171,8 @@ def handler(event: dict, context) -> dict:
 
     try:
         body = json.loads(event.get('body', '{}'))
+        params = event.get('queryStringParameters') or {}
+        action = params.get('action') or body.get('action') or 'chunk'
 
         chunk_data = body.get('chunk')
         chunk_index = int(body.get('chunkIndex', 0))
@@ -79,8 +181,31 @@ def handler(event: dict, context) -> dict:
         file_type = body.get('fileType', 'application/pdf')
         folder = body.get('folder', 'documents')
         upload_id = body.get('uploadId')
+        key = body.get('key')
+
+        if total_chunks < 1 or total_chunks > MAX_CHUNKS:
+            return make_response(400, {'error': 'Некорректное количество частей файла'})
+
+        s3 = get_s3()
 
-        if not chunk_data or not file_name:
+        if action in ('status', 'complete', 'abort'):
+            if not upload_id or not is_upload_key(key):
+                return make_response(400, {'error': 'Отсутствует uploadId или key'})
+            if action == 'abort':
+                s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=key, UploadId=upload_id)
+                return make_response(200, {'uploadId': upload_id, 'aborted': True})
+            if action == 'complete':
+                return complete_upload(s3, key, upload_id, total_chunks, file_name)
+            parts = list_parts(s3, key, upload_id)
+            return make_response(200, {
+                'uploadId': upload_id,
+                'key': key,
+                'receivedChunks': [
+                    {'chunkIndex': p['PartNumber'] - 1, 'size': p['Size'], 'etag': p['ETag']} for p in parts
+                ],
+            })
+
+        if (action == 'chunk' and not chunk_data) or not file_name:
             return make_response(400, {'error': 'Отсутствует chunk или fileName'})
 
         if '.' not in file_name:
@@ -96,8 +221,16 @@ def handler(event: dict, context) -> dict:
         if folder not in ALLOWED_FOLDERS:
             folder = 'documents'
 
-        if total_chunks < 1 or total_chunks > 100:
-            return make_response(400, {'error': 'Некорректное количество частей файла'})
+        if action == 'start' or (action == 'chunk' and not upload_id and total_chunks > 1):
+            key = f"{folder}/{uuid.uuid4()}.{file_extension}"
+            upload_id = s3.create_multipart_upload(Bucket=S3_BUCKET, Key=key, ContentType=file_type)['UploadId']
+            if action == 'start':
+                return make_response(200, {'uploadId': upload_id, 'key': key, 'complete': False})
+        elif action != 'chunk':
+            return make_response(400, {'error': 'Неизвестное действие'})
+
+        if chunk_index < 0 or chunk_index >= total_chunks:
+            return make_response(400, {'error': 'Некорректный номер части файла'})
 
         try:
             chunk_bytes = base64.b64decode(chunk_data)
@@ -108,60 +241,42 @@ def handler(event: dict, context) -> dict:
             return make_response(400, {'error': f'Размер части файла превышает допустимый ({MAX_CHUNK_SIZE_BYTES // 1024 // 1024} МБ)'})
 
         if not upload_id:
-            upload_id = str(uuid.uuid4())
-        upload_id = str(upload_id).replace('..', '').replace('/', '')[:64]
-
-        s3 = boto3.client(
-            's3',
-            endpoint_url='https://bucket.poehali.dev',
-            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-        )
-
-        temp_key = f"temp/{upload_id}_chunk_{chunk_index}"
-        s3.put_object(Bucket='files', Key=temp_key, Body=chunk_bytes)
-
-        if chunk_index == total_chunks - 1:
-            chunks = []
-            total_size = 0
-            for i in range(total_chunks):
-                chunk_key = f"temp/{upload_id}_chunk_{i}"
-                resp = s3.get_object(Bucket='files', Key=chunk_key)
-                data = resp['Body'].read()
-                total_size += len(data)
-                if total_size > MAX_FILE_SIZE_MB * 1024 * 1024:
-                    for j in range(total_chunks):
-                        try:
-                            s3.delete_object(Bucket='files', Key=f"temp/{upload_id}_chunk_{j}")
-                        except Exception:
-                            pass
-                    return make_response(400, {'error': f'Размер файла превышает {MAX_FILE_SIZE_MB} МБ'})
-                chunks.append(data)
-
-            final_data = b''.join(chunks)
-            safe_name = f"{uuid.uuid4()}.{file_extension}"
-            final_key = f"{folder}/{safe_name}"
-
-            s3.put_object(Bucket='files', Key=final_key, Body=final_data, ContentType=file_type)
-
-            for i in range(total_chunks):
-                try:
-                    s3.delete_object(Bucket='files', Key=f"temp/{upload_id}_chunk_{i}")
-                except Exception:
-                    pass
-
-            cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{final_key}"
-
+            # Файл из одной части — обычный PUT по ключу из хэша, без multipart upload
+            conn = get_db()
+            try:
+                with conn.cursor() as cur:
+                    final_key, duplicate = store_bytes(s3, cur, SCHEMA, chunk_bytes, file_extension, file_type)
+                conn.commit()
+            finally:
+                conn.close()
             return make_response(200, {
-                'url': cdn_url,
+                'url': cdn_url(final_key),
+                'key': final_key,
                 'fileName': file_name,
+                'size': len(chunk_bytes),
+                'deduplicated': duplicate,
                 'message': 'Файл успешно загружен',
                 'complete': True,
             })
 
+        if not is_upload_key(key):
+            return make_response(400, {'error': 'Отсутствует key загрузки'})
+        if chunk_index < total_chunks - 1 and len(chunk_bytes) < MIN_PART_SIZE_BYTES:
+            return make_response(400, {'error': f'Все части, кроме последней, должны быть не меньше {MIN_PART_SIZE_BYTES // 1024 // 1024} МБ'})
+
+        part = s3.upload_part(
+            Bucket=S3_BUCKET, Key=key, UploadId=upload_id,
+            PartNumber=chunk_index + 1, Body=chunk_bytes,
+        )
+
+        if chunk_index == total_chunks - 1:
+            return complete_upload(s3, key, upload_id, total_chunks, file_name)
+
         return make_response(200, {
             'uploadId': upload_id,
+            'key': key,
             'chunkIndex': chunk_index,
+            'etag': part['ETag'],
             'complete': False,
         })
 
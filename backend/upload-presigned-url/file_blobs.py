@@ -0,0 +1,114 @@
+"""
+Дедупликация загружаемых файлов по содержимому.
+Объект в S3 хранится по ключу из SHA-256 содержимого (blobs/<2 символа>/<хэш>.<расш>),
+таблица file_blobs связывает хэш с ключом и считает ссылки: повторная загрузка
+тех же байтов возвращает уже сохранённый файл и увеличивает ref_count,
+удаление уменьшает его, а объект удаляется из S3 только вместе с последней ссылкой.
+Хэш, по которому выдаётся ссылка на сохранённый файл, всегда проверен: посчитан
+по полученным байтам (store_bytes) или сверен S3 при загрузке (adopt_object).
+Модуль продублирован в backend/upload-file, backend/invoice-ocr и
+backend/payments-api — изменения вносить во все копии.
+"""
+import base64
+import hashlib
+from typing import Optional, Tuple
+
+S3_BUCKET = 'files'
+BLOB_PREFIX = 'blobs/'
+
+
+def blob_key(sha256: str, extension: str) -> str:
+    return f'{BLOB_PREFIX}{sha256[:2]}/{sha256}.{extension}'
+
+
+def checksum_sha256(sha256: str) -> str:
+    """Хэш в виде x-amz-checksum-sha256 (base64 от байтов дайджеста)"""
+    return base64.b64encode(bytes.fromhex(sha256)).decode()
+
+
+def _value(row, column: str):
+    return row[column] if isinstance(row, dict) else row[0]
+
+
+def acquire(cur, schema: str, sha256: str) -> Optional[str]:
+    """
+    Ключ уже сохранённого файла с таким хэшем (ссылка засчитывается) или None.
+    sha256 должен быть проверен по содержимому: заявленный клиентом хэш без
+    проверки дал бы ссылку на чужой файл.
+    """
+    cur.execute(
+        f"""UPDATE {schema}.file_blobs SET ref_count = ref_count + 1, last_used_at = NOW()
+            WHERE sha256 = %s RETURNING file_key""",
+        (sha256,)
+    )
+    row = cur.fetchone()
+    return _value(row, 'file_key') if row else None
+
+
+def register(cur, schema: str, sha256: str, file_key: str, size: int, content_type: Optional[str]) -> str:
+    """
+    Записывает новый файл с одной ссылкой. Если тот же файл параллельно
+    уже зарегистрирован, засчитывает ссылку на него и возвращает его ключ.
+    """
+    cur.execute(
+        f"""INSERT INTO {schema}.file_blobs (sha256, file_key, size, content_type)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (sha256) DO UPDATE
+            SET ref_count = file_blobs.ref_count + 1, last_used_at = NOW()
+            RETURNING file_key""",
+        (sha256, file_key, size, content_type)
+    )
+    return _value(cur.fetchone(), 'file_key')
+
+
+def release(cur, schema: str, file_key: str) -> bool:
+    """
+    Снимает одну ссылку с файла. True — ссылок не осталось (или файл не
+    учитывается в file_blobs) и объект можно удалять из S3.
+    """
+    cur.execute(
+        f"""UPDATE {schema}.file_blobs SET ref_count = ref_count - 1
+            WHERE file_key = %s RETURNING ref_count""",
+        (file_key,)
+    )
+    row = cur.fetchone()
+    if row is None:
+        return True
+    if _value(row, 'ref_count') > 0:
+        return False
+    cur.execute(f"DELETE FROM {schema}.file_blobs WHERE file_key = %s", (file_key,))
+    return True
+
+
+def store_bytes(s3, cur, schema: str, data: bytes, extension: str, content_type: str) -> Tuple[str, bool]:
+    """
+    Сохраняет файл по хэшу содержимого. Возвращает ключ и признак того,
+    что такой файл уже был и в S3 ничего не записывалось.
+    """
+    sha256 = hashlib.sha256(data).hexdigest()
+    existing = acquire(cur, schema, sha256)
+    if existing:
+        return existing, True
+    key = blob_key(sha256, extension)
+    s3.put_object(Bucket=S3_BUCKET, Key=key, Body=data, ContentType=content_type)
+    return register(cur, schema, sha256, key, len(data), content_type), False
+
+
+def adopt_object(s3, cur, schema: str, key: str, sha256: str, extension: str,
+                 size: int, content_type: Optional[str]) -> Tuple[str, bool]:
+    """
+    Переводит загруженный по подписанной ссылке объект на ключ по хэшу.
+    sha256 — хэш, который S3 проверил при загрузке (x-amz-checksum-sha256),
+    объект не скачивается. Если такой файл есть, новый объект удаляется, иначе
+    копируется на стороне S3 под ключ из хэша. Возвращает итоговый ключ и
+    признак дубликата.
+    """
+    existing = acquire(cur, schema, sha256)
+    if existing:
+        s3.delete_object(Bucket=S3_BUCKET, Key=key)
+        return existing, True
+    target = blob_key(sha256, extension)
+    if target != key:
+        s3.copy_object(Bucket=S3_BUCKET, Key=target, CopySource={'Bucket': S3_BUCKET, 'Key': key})
+        s3.delete_object(Bucket=S3_BUCKET, Key=key)
+    return register(cur, schema, sha256, target, size, content_type), False
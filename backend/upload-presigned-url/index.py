@@ -1,11 +1,18 @@
 import json
 import os
-import base64
+import re
+import sys
+import uuid
 import boto3
 import jwt
+import psycopg2
 from datetime import datetime
 from typing import Optional, Dict, Any
 
+from file_blobs import adopt_object, checksum_sha256
+
+SCHEMA = 't_p61788166_html_to_frontend'
+
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'POST, OPTIONS',
@@ -37,10 +44,163 @@ ALLOWED_TYPES = {
     'application/vnd.ms-excel',
     'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
 }
-MAX_FILE_SIZE_BYTES = 10 * 1024 * 1024
+MAX_FILE_SIZE_BYTES = 20 * 1024 * 1024
+UPLOAD_URL_TTL = 600
+S3_BUCKET = 'files'
+UPLOAD_PREFIX = 'invoices/'
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+def respond(status: int, body: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
+        'body': json.dumps(body, ensure_ascii=False)
+    }
+
+def get_s3():
+    return boto3.client('s3',
+        endpoint_url='https://bucket.poehali.dev',
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
+    )
+
+def cdn_url(file_key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ.get('AWS_ACCESS_KEY_ID')}/bucket/{file_key}"
+
+def handle_presign(conn, body: Dict[str, Any], user_id: Optional[int]) -> Dict[str, Any]:
+    """
+    Выдаёт подписанные ссылки для загрузки прямо в бакет: POST-политику
+    (тип и диапазон размера проверяет S3) и PUT-ссылку с подписанными
+    Content-Type и Content-Length. Файл через функцию не проходит.
+    Если передан sha256, обе ссылки подписаны с x-amz-checksum-sha256: S3 не
+    примет байты с другим хэшем, и при подтверждении файл можно дедуплицировать.
+    """
+    file_name = body.get('file_name')
+    file_type = body.get('file_type')
+    try:
+        file_size = int(body.get('file_size') or 0)
+    except (TypeError, ValueError):
+        file_size = 0
+
+    if not file_name or not file_type:
+        return respond(400, {'error': 'file_name and file_type are required'})
+    if file_type not in ALLOWED_TYPES:
+        return respond(400, {'error': 'Недопустимый тип файла'})
+    if file_size <= 0:
+        return respond(400, {'error': 'file_size is required'})
+    if file_size > MAX_FILE_SIZE_BYTES:
+        return respond(400, {'error': f'Файл слишком большой (максимум {MAX_FILE_SIZE_BYTES // 1024 // 1024} МБ)'})
+
+    sha256 = str(body.get('sha256') or '').lower()
+    if sha256 and not SHA256_RE.match(sha256):
+        return respond(400, {'error': 'Некорректный sha256'})
+
+    safe_name = re.sub(r'[^\w.\-]', '_', os.path.basename(file_name))[:100]
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    file_key = f'{UPLOAD_PREFIX}{timestamp}_{uuid.uuid4().hex[:8]}_{safe_name}'
+
+    fields = {'Content-Type': file_type, 'success_action_status': '201'}
+    put_params = {'Bucket': S3_BUCKET, 'Key': file_key, 'ContentType': file_type, 'ContentLength': file_size}
+    if sha256:
+        fields['x-amz-checksum-sha256'] = checksum_sha256(sha256)
+        put_params['ChecksumSHA256'] = checksum_sha256(sha256)
+
+    s3 = get_s3()
+    post = s3.generate_presigned_post(
+        Bucket=S3_BUCKET,
+        Key=file_key,
+        Fields=fields,
+        Conditions=[{name: value} for name, value in fields.items()] + [
+            ['content-length-range', 1, MAX_FILE_SIZE_BYTES],
+        ],
+        ExpiresIn=UPLOAD_URL_TTL
+    )
+    presigned_url = s3.generate_presigned_url('put_object', Params=put_params, ExpiresIn=UPLOAD_URL_TTL)
+
+    cur = conn.cursor()
+    cur.execute(
+        f"""INSERT INTO {SCHEMA}.uploaded_files (file_key, file_name, content_type, size, uploaded_by, sha256)
+            VALUES (%s, %s, %s, %s, %s, %s)""",
+        (file_key, file_name[:255], file_type, file_size, user_id, sha256 or None)
+    )
+    conn.commit()
+    cur.close()
+
+    return respond(200, {
+        'upload': post,
+        'presigned_url': presigned_url,
+        'file_key': file_key,
+        'file_url': cdn_url(file_key),
+        'expires_in': UPLOAD_URL_TTL,
+    })
+
+def handle_confirm(conn, body: Dict[str, Any], user_id: Optional[int]) -> Dict[str, Any]:
+    """
+    Подтверждает загрузку: объект должен существовать, а его тип и размер —
+    соответствовать выданной ссылке. Несоответствующий объект удаляется.
+    Если S3 подтвердил заявленный при presign хэш (ChecksumSHA256 объекта),
+    файл переносится под ключ из хэша; если такой файл уже был, загруженная
+    копия удаляется и возвращается ссылка на сохранённый. Без проверенного хэша
+    файл остаётся под своим ключом и не дедуплицируется.
+    """
+    file_key = body.get('file_key') or ''
+    cur = conn.cursor()
+    cur.execute(
+        f"""SELECT u.id, u.content_type, u.status, u.sha256,
+                   CASE WHEN u.sha256 IS NULL THEN u.file_key ELSE b.file_key END
+            FROM {SCHEMA}.uploaded_files u
+            LEFT JOIN {SCHEMA}.file_blobs b ON b.sha256 = u.sha256
+            WHERE u.file_key = %s AND u.uploaded_by IS NOT DISTINCT FROM %s""",
+        (file_key, user_id)
+    )
+    row = cur.fetchone()
+    if not row:
+        cur.close()
+        return respond(404, {'error': 'Загрузка не найдена'})
+    upload_id, content_type, status, sha256, stored_key = row
+
+    if status != 'confirmed':
+        s3 = get_s3()
+        try:
+            head = s3.head_object(Bucket=S3_BUCKET, Key=file_key, ChecksumMode='ENABLED')
+        except Exception:
+            cur.close()
+            return respond(409, {'error': 'Файл ещё не загружен в хранилище'})
+
+        size = head['ContentLength']
+        if size > MAX_FILE_SIZE_BYTES or head.get('ContentType') != content_type:
+            s3.delete_object(Bucket=S3_BUCKET, Key=file_key)
+            cur.execute(f"DELETE FROM {SCHEMA}.uploaded_files WHERE id = %s", (upload_id,))
+            conn.commit()
+            cur.close()
+            return respond(400, {'error': 'Загруженный файл не соответствует заявленному типу или размеру'})
+
+        if sha256 and head.get('ChecksumSHA256') == checksum_sha256(sha256.strip()):
+            extension = os.path.splitext(file_key)[1].lstrip('.').lower() or 'bin'
+            stored_key, duplicate = adopt_object(s3, cur, SCHEMA, file_key, sha256.strip(), extension, size, content_type)
+        else:
+            sha256, stored_key, duplicate = None, file_key, False
+        cur.execute(
+            f"""UPDATE {SCHEMA}.uploaded_files
+                SET status = 'confirmed', size = %s, confirmed_at = NOW(), sha256 = %s
+                WHERE id = %s""",
+            (size, sha256, upload_id)
+        )
+        conn.commit()
+    else:
+        duplicate = False
+    cur.close()
+    if not stored_key:
+        return respond(404, {'error': 'Файл удалён'})
+
+    return respond(200, {'file_url': cdn_url(stored_key), 'file_key': stored_key, 'deduplicated': duplicate})
 
 def handler(event: dict, context) -> dict:
-    '''Загрузка файла счёта в S3. Принимает base64-encoded файл, сохраняет в хранилище, возвращает публичный CDN-URL.'''
+    '''
+    Загрузка файлов счетов напрямую в S3 по подписанным ссылкам.
+    POST (action=presign) — выдаёт POST-политику и PUT-ссылку для браузера;
+    POST action=confirm — проверяет загруженный объект и возвращает публичный CDN-URL.
+    '''
 
     method = event.get('httpMethod', 'GET')
 
@@ -48,94 +208,31 @@ def handler(event: dict, context) -> dict:
         return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
     if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return respond(405, {'error': 'Method not allowed'})
 
     payload = verify_token(event)
     if not payload:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-            'body': json.dumps({'error': 'Требуется авторизация'})
-        }
+        return respond(401, {'error': 'Требуется авторизация'})
 
+    conn = None
     try:
-        body = json.loads(event.get('body', '{}'))
-
-        file_name = body.get('file_name')
-        file_type = body.get('file_type')
-        file_data = body.get('file_data')
-
-        if not file_name or not file_type:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-                'body': json.dumps({'error': 'file_name and file_type are required'})
-            }
-
-        if file_type not in ALLOWED_TYPES:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-                'body': json.dumps({'error': 'Недопустимый тип файла'})
-            }
-
-        import re
-        safe_name = re.sub(r'[^\w.\-]', '_', os.path.basename(file_name))[:100]
-
-        aws_access_key = os.environ.get('AWS_ACCESS_KEY_ID')
-        aws_secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
-
-        s3 = boto3.client('s3',
-            endpoint_url='https://bucket.poehali.dev',
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret_key
-        )
+        body = json.loads(event.get('body') or '{}')
+        params = event.get('queryStringParameters') or {}
+        action = params.get('action') or body.get('action') or 'presign'
 
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        unique_file_name = f"{timestamp}_{safe_name}"
-        file_key = f'invoices/{unique_file_name}'
-
-        if file_data:
-            # Прямая загрузка: принимаем base64, кладём в S3
-            if ',' in file_data:
-                file_data = file_data.split(',')[1]
-            file_bytes = base64.b64decode(file_data)
-            if len(file_bytes) > MAX_FILE_SIZE_BYTES:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-                    'body': json.dumps({'error': 'Файл слишком большой (максимум 10 МБ)'})
-                }
-            s3.put_object(Bucket='files', Key=file_key, Body=file_bytes, ContentType=file_type)
-            cdn_url = f"https://cdn.poehali.dev/projects/{aws_access_key}/bucket/{file_key}"
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-                'body': json.dumps({'file_url': cdn_url, 'file_key': file_key})
-            }
-        else:
-            # Fallback: возвращаем presigned URL для PUT с браузера
-            presigned_url = s3.generate_presigned_url(
-                'put_object',
-                Params={'Bucket': 'files', 'Key': file_key, 'ContentType': file_type},
-                ExpiresIn=600
-            )
-            cdn_url = f"https://cdn.poehali.dev/projects/{aws_access_key}/bucket/{file_key}"
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-                'body': json.dumps({'presigned_url': presigned_url, 'file_url': cdn_url, 'file_key': file_key})
-            }
+        if body.get('file_data'):
+            return respond(400, {'error': 'Файл загружается напрямую в хранилище по ссылке из action=presign'})
+
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        if action == 'presign':
+            return handle_presign(conn, body, payload.get('user_id'))
+        if action == 'confirm':
+            return handle_confirm(conn, body, payload.get('user_id'))
+        return respond(400, {'error': 'Неизвестное действие'})
 
     except Exception as e:
-        import sys
         print(f"[upload-presigned-url] Error: {e}", file=sys.stderr, flush=True)
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
-            'body': json.dumps({'error': 'Ошибка загрузки файла'})
-        }
\ No newline at end of file
+        return respond(500, {'error': 'Ошибка загрузки файла'})
+    finally:
+        if conn is not None:
+            conn.close()
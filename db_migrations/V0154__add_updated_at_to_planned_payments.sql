@@ -0,0 +1,11 @@
+-- Отметка последнего изменения запланированного платежа.
+-- Используется как отпечаток для инвалидации кэша прогноза движения средств.
+ALTER TABLE t_p61788166_html_to_frontend.planned_payments
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+
+UPDATE t_p61788166_html_to_frontend.planned_payments
+SET updated_at = COALESCE(converted_at, created_at, NOW())
+WHERE updated_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_planned_payments_clinic_active
+  ON t_p61788166_html_to_frontend.planned_payments(clinic_id, is_active, planned_date);
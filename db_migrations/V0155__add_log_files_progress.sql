@@ -0,0 +1,4 @@
+-- Прогресс потоковой загрузки лог-файлов
+ALTER TABLE log_files ADD COLUMN IF NOT EXISTS processed_lines INTEGER DEFAULT 0;
+ALTER TABLE log_files ADD COLUMN IF NOT EXISTS error_message TEXT;
+ALTER TABLE log_files ALTER COLUMN file_size TYPE BIGINT;
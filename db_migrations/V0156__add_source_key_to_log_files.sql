@@ -0,0 +1,4 @@
+-- Ключ объекта в бакете для лог-файлов, загруженных по presigned URL
+ALTER TABLE log_files ADD COLUMN IF NOT EXISTS source_key TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_log_files_source_key ON log_files(source_key);
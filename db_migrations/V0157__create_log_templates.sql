@@ -0,0 +1,35 @@
+-- Шаблоны сообщений логов. Текст версии неизменен; при обобщении кластера
+-- добавляется новая версия с тем же cluster_id
+CREATE TABLE IF NOT EXISTS log_templates (
+    id SERIAL PRIMARY KEY,
+    cluster_id INTEGER,
+    level VARCHAR(20) NOT NULL,
+    template TEXT NOT NULL,
+    token_count INTEGER NOT NULL,
+    count BIGINT DEFAULT 0,
+    first_seen TIMESTAMP,
+    last_seen TIMESTAMP,
+    example_line TEXT,
+    first_file_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_log_templates_cluster_id ON log_templates(cluster_id, id);
+CREATE INDEX IF NOT EXISTS idx_log_templates_first_seen ON log_templates(first_seen);
+
+-- Количество строк каждого кластера в файле
+CREATE TABLE IF NOT EXISTS log_file_templates (
+    file_id INTEGER NOT NULL,
+    cluster_id INTEGER NOT NULL,
+    count BIGINT DEFAULT 0,
+    PRIMARY KEY (file_id, cluster_id)
+);
+
+-- Записи, попавшие в шаблон, хранят id шаблона, параметры и префикс строки вместо текста
+ALTER TABLE log_entries ADD COLUMN IF NOT EXISTS template_id INTEGER;
+ALTER TABLE log_entries ADD COLUMN IF NOT EXISTS params TEXT[];
+ALTER TABLE log_entries ADD COLUMN IF NOT EXISTS raw_prefix TEXT;
+ALTER TABLE log_entries ALTER COLUMN message DROP NOT NULL;
+ALTER TABLE log_entries ALTER COLUMN raw_line DROP NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_log_entries_template_id ON log_entries(template_id);
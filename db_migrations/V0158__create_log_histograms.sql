@@ -0,0 +1,19 @@
+-- Предрассчитанные гистограммы логов: количество строк по уровню и кластеру
+-- шаблона за минуту и за час. cluster_id = 0 — строки без шаблона
+CREATE TABLE IF NOT EXISTS log_histogram_minute (
+    file_id INTEGER NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    level VARCHAR(20) NOT NULL,
+    cluster_id INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (file_id, bucket, level, cluster_id)
+);
+
+CREATE TABLE IF NOT EXISTS log_histogram_hour (
+    file_id INTEGER NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    level VARCHAR(20) NOT NULL,
+    cluster_id INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (file_id, bucket, level, cluster_id)
+);
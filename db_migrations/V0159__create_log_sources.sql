@@ -0,0 +1,13 @@
+-- Курсоры автоматического сбора логов: по каждому источнику хранится время
+-- последней сохранённой строки, хеши строк с этим временем (для отсечения
+-- повторов на границе) и текущий суточный файл, в который дописываются строки
+CREATE TABLE IF NOT EXISTS log_sources (
+    source VARCHAR(255) PRIMARY KEY,
+    file_id INTEGER,
+    file_date DATE,
+    last_timestamp TIMESTAMP,
+    last_offset BIGINT NOT NULL DEFAULT 0,
+    last_line_hashes TEXT[] NOT NULL DEFAULT '{}',
+    last_line_number INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
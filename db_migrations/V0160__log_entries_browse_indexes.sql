@@ -0,0 +1,10 @@
+-- Постраничный просмотр логов по курсору: (file_id, line_number) и с фильтром уровня.
+-- Одиночный индекс по file_id покрывается составными и больше не нужен
+CREATE INDEX IF NOT EXISTS idx_log_entries_file_line ON log_entries(file_id, line_number);
+CREATE INDEX IF NOT EXISTS idx_log_entries_file_level_line ON log_entries(file_id, level, line_number);
+DROP INDEX IF EXISTS idx_log_entries_file_id;
+
+-- Поиск подстроки (ILIKE '%...%') по тексту сообщений и шаблонов
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_log_entries_message_trgm ON log_entries USING gin(message gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_log_templates_template_trgm ON log_templates USING gin(template gin_trgm_ops);
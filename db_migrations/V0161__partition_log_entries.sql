@@ -0,0 +1,42 @@
+-- Секционирование log_entries по file_id: одна секция на файл, удаление файла
+-- по сроку хранения — DROP TABLE секции. Существующие записи переносятся
+-- в секции своих файлов, секция по умолчанию принимает строки без секции
+ALTER TABLE log_entries RENAME TO log_entries_legacy;
+
+CREATE TABLE log_entries (
+    id INTEGER NOT NULL DEFAULT nextval('log_entries_id_seq'),
+    file_id INTEGER NOT NULL,
+    line_number INTEGER NOT NULL,
+    timestamp TIMESTAMP,
+    level VARCHAR(20),
+    message TEXT,
+    raw_line TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    template_id INTEGER,
+    params TEXT[],
+    raw_prefix TEXT
+) PARTITION BY LIST (file_id);
+
+CREATE TABLE log_entries_default PARTITION OF log_entries DEFAULT;
+
+DO $$
+DECLARE
+    fid INTEGER;
+BEGIN
+    FOR fid IN SELECT DISTINCT file_id FROM log_entries_legacy LOOP
+        EXECUTE format('CREATE TABLE log_entries_f%s PARTITION OF log_entries FOR VALUES IN (%s)', fid, fid);
+    END LOOP;
+END $$;
+
+INSERT INTO log_entries (id, file_id, line_number, timestamp, level, message, raw_line, created_at, template_id, params, raw_prefix)
+SELECT id, file_id, line_number, timestamp, level, message, raw_line, created_at, template_id, params, raw_prefix
+FROM log_entries_legacy;
+
+ALTER SEQUENCE log_entries_id_seq OWNED BY log_entries.id;
+DROP TABLE log_entries_legacy;
+
+-- Индексы создаются на родительской таблице и наследуются каждой секцией
+CREATE INDEX IF NOT EXISTS idx_log_entries_file_line ON log_entries(file_id, line_number);
+CREATE INDEX IF NOT EXISTS idx_log_entries_file_level_line ON log_entries(file_id, level, line_number);
+CREATE INDEX IF NOT EXISTS idx_log_entries_template_id ON log_entries(template_id);
+CREATE INDEX IF NOT EXISTS idx_log_entries_message_trgm ON log_entries USING gin(message gin_trgm_ops);
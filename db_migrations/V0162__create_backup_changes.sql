@@ -0,0 +1,81 @@
+-- Журнал изменений для инкрементальных бэкапов: триггеры на таблицах с
+-- первичным ключом записывают ключ изменённой строки и номер транзакции.
+-- Инкремент выгружает строки из изменений, не видимых в снимке предыдущего бэкапа
+CREATE TABLE IF NOT EXISTS backup_changes (
+    id BIGSERIAL PRIMARY KEY,
+    table_name VARCHAR(100) NOT NULL,
+    op CHAR(1) NOT NULL,
+    row_pk JSONB,
+    tx_id BIGINT NOT NULL DEFAULT txid_current(),
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_backup_changes_table ON backup_changes(table_name, tx_id);
+CREATE INDEX IF NOT EXISTS idx_backup_changes_changed_at ON backup_changes(changed_at);
+
+-- Аргументы триггера — столбцы первичного ключа. TRUNCATE записывается без ключа:
+-- такая таблица в следующем инкременте выгружается целиком
+CREATE OR REPLACE FUNCTION record_backup_change() RETURNS trigger
+LANGUAGE plpgsql
+SET search_path FROM CURRENT
+AS $$
+DECLARE
+    new_pk JSONB := '{}';
+    old_pk JSONB := '{}';
+    col TEXT;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        INSERT INTO backup_changes (table_name, op) VALUES (TG_TABLE_NAME, 'T');
+        RETURN NULL;
+    END IF;
+
+    FOREACH col IN ARRAY TG_ARGV LOOP
+        IF TG_OP <> 'DELETE' THEN
+            new_pk := new_pk || jsonb_build_object(col, to_jsonb(NEW) -> col);
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            old_pk := old_pk || jsonb_build_object(col, to_jsonb(OLD) -> col);
+        END IF;
+    END LOOP;
+
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO backup_changes (table_name, op, row_pk) VALUES (TG_TABLE_NAME, left(TG_OP, 1), new_pk);
+    END IF;
+    -- При смене первичного ключа старый ключ тоже попадает в журнал и восстанавливается как удаление
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND old_pk <> new_pk) THEN
+        INSERT INTO backup_changes (table_name, op, row_pk) VALUES (TG_TABLE_NAME, 'D', old_pk);
+    END IF;
+    RETURN NULL;
+END $$;
+
+DO $$
+DECLARE
+    t RECORD;
+BEGIN
+    FOR t IN
+        SELECT c.relname, string_agg(quote_literal(a.attname), ', ' ORDER BY k.ord) AS pk_cols
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_index i ON i.indrelid = c.oid AND i.indisprimary
+        CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+        WHERE n.nspname = current_schema()
+          AND c.relkind = 'r'
+          AND NOT c.relispartition
+          AND c.relname <> 'backup_changes'
+        GROUP BY c.relname
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS backup_changes_trg ON %I', t.relname);
+        EXECUTE format(
+            'CREATE TRIGGER backup_changes_trg AFTER INSERT OR UPDATE OR DELETE ON %I '
+            'FOR EACH ROW EXECUTE FUNCTION record_backup_change(%s)',
+            t.relname, t.pk_cols
+        );
+        EXECUTE format('DROP TRIGGER IF EXISTS backup_changes_truncate_trg ON %I', t.relname);
+        EXECUTE format(
+            'CREATE TRIGGER backup_changes_truncate_trg AFTER TRUNCATE ON %I '
+            'FOR EACH STATEMENT EXECUTE FUNCTION record_backup_change()',
+            t.relname
+        );
+    END LOOP;
+END $$;
@@ -0,0 +1,20 @@
+-- Загрузки напрямую в бакет: запись создаётся при выдаче подписанной ссылки
+-- (pending) и подтверждается после проверки объекта в S3 (confirmed)
+CREATE TABLE IF NOT EXISTS uploaded_files (
+    id SERIAL PRIMARY KEY,
+    file_key VARCHAR(500) NOT NULL UNIQUE,
+    file_name VARCHAR(255),
+    content_type VARCHAR(255) NOT NULL,
+    size BIGINT,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    uploaded_by INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    confirmed_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_uploaded_files_status_created ON uploaded_files(status, created_at);
+
+CREATE TRIGGER backup_changes_trg AFTER INSERT OR UPDATE OR DELETE ON uploaded_files
+    FOR EACH ROW EXECUTE FUNCTION record_backup_change('id');
+CREATE TRIGGER backup_changes_truncate_trg AFTER TRUNCATE ON uploaded_files
+    FOR EACH STATEMENT EXECUTE FUNCTION record_backup_change();
@@ -0,0 +1,18 @@
+-- Загруженные файлы по хэшу содержимого: одинаковые байты хранятся в S3
+-- один раз, ref_count — число загрузок, ссылающихся на объект
+CREATE TABLE IF NOT EXISTS file_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    file_key VARCHAR(500) NOT NULL UNIQUE,
+    size BIGINT NOT NULL,
+    content_type VARCHAR(255),
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE uploaded_files ADD COLUMN IF NOT EXISTS sha256 CHAR(64);
+
+CREATE TRIGGER backup_changes_trg AFTER INSERT OR UPDATE OR DELETE ON file_blobs
+    FOR EACH ROW EXECUTE FUNCTION record_backup_change('sha256');
+CREATE TRIGGER backup_changes_truncate_trg AFTER TRUNCATE ON file_blobs
+    FOR EACH STATEMENT EXECUTE FUNCTION record_backup_change();
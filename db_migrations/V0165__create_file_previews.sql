@@ -0,0 +1,23 @@
+-- Превью документов платежей и работ галереи. Строка на каждый URL файла;
+-- сами картинки лежат в бакете по хэшу содержимого (previews/<2 символа>/<хэш>/<размер>.jpg),
+-- поэтому одинаковые файлы под разными URL рендерятся один раз
+CREATE TABLE IF NOT EXISTS file_previews (
+    source_url TEXT PRIMARY KEY,
+    sha256 CHAR(64),
+    status VARCHAR(20) NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'processing', 'ready', 'unsupported', 'failed')),
+    previews JSONB,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_file_previews_queue ON file_previews(created_at)
+    WHERE status IN ('pending', 'processing', 'failed');
+CREATE INDEX IF NOT EXISTS idx_file_previews_sha256 ON file_previews(sha256);
+
+CREATE TRIGGER backup_changes_trg AFTER INSERT OR UPDATE OR DELETE ON file_previews
+    FOR EACH ROW EXECUTE FUNCTION record_backup_change('source_url');
+CREATE TRIGGER backup_changes_truncate_trg AFTER TRUNCATE ON file_previews
+    FOR EACH STATEMENT EXECUTE FUNCTION record_backup_change();
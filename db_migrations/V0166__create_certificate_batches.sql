@@ -0,0 +1,15 @@
+-- Пакетная выдача справок: одно задание — один ZIP со справками конкурса
+-- или выбранных результатов. done обновляется по ходу рендера для отображения прогресса
+CREATE TABLE IF NOT EXISTS certificate_batches (
+    id SERIAL PRIMARY KEY,
+    contest_id INTEGER,
+    result_ids INTEGER[],
+    status VARCHAR(20) NOT NULL DEFAULT 'running'
+        CHECK (status IN ('running', 'done', 'failed')),
+    total INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    zip_key TEXT,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
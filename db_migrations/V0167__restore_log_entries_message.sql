@@ -0,0 +1,25 @@
+-- Шаблонизированные записи снова хранят message: поиск по фразе, захватывающей
+-- и текст шаблона, и параметры, идёт по триграммному индексу message.
+-- Для уже загруженных записей message собирается из шаблона и параметров
+-- так же, как render_template в log_templates.py
+CREATE OR REPLACE FUNCTION log_render_template(template TEXT, params TEXT[]) RETURNS TEXT AS $$
+DECLARE
+    tokens TEXT[] := string_to_array(template, ' ');
+    n INTEGER := 0;
+BEGIN
+    FOR i IN 1..COALESCE(array_length(tokens, 1), 0) LOOP
+        IF tokens[i] = '<*>' THEN
+            n := n + 1;
+            tokens[i] := COALESCE(params[n], '');
+        END IF;
+    END LOOP;
+    RETURN array_to_string(tokens, ' ');
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+UPDATE log_entries e
+SET message = log_render_template(t.template, e.params)
+FROM log_templates t
+WHERE e.message IS NULL AND e.template_id = t.id;
+
+DROP FUNCTION log_render_template(TEXT, TEXT[]);
@@ -0,0 +1,5 @@
+-- Пакет справок собирается по шагам (action=batch_step), а не в одном запросе:
+-- issued_on фиксирует дату выдачи для всех шагов, updated_at — время последнего
+-- шага; задания, по которым шагов давно не было, помечаются failed
+ALTER TABLE certificate_batches ADD COLUMN IF NOT EXISTS issued_on DATE NOT NULL DEFAULT CURRENT_DATE;
+ALTER TABLE certificate_batches ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL;
@@ -0,0 +1,5 @@
+-- Текст шаблонизированной записи хранится один раз — в message (по нему идёт
+-- поиск через триграммный индекс); params его дублировали. Параметры
+-- выделяются из message и шаблона при чтении (extract_params в log_templates.py)
+UPDATE log_entries SET params = NULL
+WHERE template_id IS NOT NULL AND message IS NOT NULL AND params IS NOT NULL;
@@ -0,0 +1,25 @@
+-- Таблицы анализатора логов, которые пересчитываются при загрузке (шаблоны,
+-- статистика, гистограммы, курсоры источников), не ведут журнал backup_changes:
+-- ingest_lines обновляет их на каждой пачке COPY, и триггер добавлял запись журнала
+-- на каждую строку. В инкрементальный бэкап они попадают по файлам (log_statistics,
+-- log_file_templates, гистограммы — как log_entries) или целиком (log_templates, log_sources)
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'log_templates', 'log_file_templates', 'log_statistics',
+        'log_histogram_minute', 'log_histogram_hour', 'log_sources'
+    ] LOOP
+        IF to_regclass(t) IS NOT NULL THEN
+            EXECUTE format('DROP TRIGGER IF EXISTS backup_changes_trg ON %I', t);
+            EXECUTE format('DROP TRIGGER IF EXISTS backup_changes_truncate_trg ON %I', t);
+        END IF;
+    END LOOP;
+END $$;
+
+DELETE FROM backup_changes
+WHERE table_name IN (
+    'log_templates', 'log_file_templates', 'log_statistics',
+    'log_histogram_minute', 'log_histogram_hour', 'log_sources'
+);
@@ -221,9 +221,10 @@ const ApplicationEditModal = ({
                     setWorkFileUploadProgress(0);
                     setNewWorkFileUrl(null);
                     try {
-                      const CHUNK_SIZE = 2 * 1024 * 1024;
+                      const CHUNK_SIZE = 5 * 1024 * 1024;
                       const totalChunks = Math.ceil(file.size / CHUNK_SIZE);
                       let uploadId = '';
+                      let uploadKey = '';
                       let fileUrl = '';
                       for (let chunkIndex = 0; chunkIndex < totalChunks; chunkIndex++) {
                         const start = chunkIndex * CHUNK_SIZE;
@@ -245,11 +246,13 @@ const ApplicationEditModal = ({
                             fileName: file.name,
                             fileType: file.type,
                             folder: 'works',
-                            uploadId: uploadId || undefined
+                            uploadId: uploadId || undefined,
+                            key: uploadKey || undefined
                           })
                         });
                         const data = await response.json();
                         if (data.uploadId) uploadId = data.uploadId;
+                        if (data.key) uploadKey = data.key;
                         if (data.url) fileUrl = data.url;
                         setWorkFileUploadProgress(Math.round(((chunkIndex + 1) / totalChunks) * 100));
                       }
@@ -10,6 +10,8 @@ interface LogFile {
   total_lines: number;
   status: string;
   statistics: Array<{ level: string; count: number }>;
+  partition_size?: number | null;
+  expires_at?: string | null;
 }
 
 interface LogFilesListProps {
@@ -72,6 +74,8 @@ const LogFilesList = ({
                     file.file_size / 1024
                   ).toFixed(2)}{' '}
                   KB
+                  {file.partition_size ? ` • в БД ${(file.partition_size / 1024 / 1024).toFixed(2)} MB` : ''}
+                  {file.expires_at ? ` • хранится до ${formatTimestamp(file.expires_at)}` : ''}
                 </p>
               </div>
               <Badge variant={file.status === 'completed' ? 'default' : 'secondary'}>
@@ -4,7 +4,7 @@ import { API_ENDPOINTS } from '@/config/api';
 import Icon from '@/components/ui/icon';
 import { useAuth } from '@/contexts/AuthContext';
 import { useToast } from '@/hooks/use-toast';
-import FUNC2URL from '@/../backend/func2url.json';
+import { uploadFileDirect } from '@/utils/directUpload';
 import {
   EditPayment,
   EditPaymentModalProps,
@@ -135,25 +135,7 @@ const EditPaymentModal = ({ payment, onClose, onSuccess }: EditPaymentModalProps
     }
   };
 
-  const uploadToStorage = async (file: File): Promise<string> => {
-    const uploadUrl = (FUNC2URL as Record<string, string>)['upload-presigned-url'];
-    if (!uploadUrl) throw new Error('Сервис загрузки недоступен');
-    const base64 = await new Promise<string>((resolve, reject) => {
-      const reader = new FileReader();
-      reader.onloadend = () => resolve(reader.result as string);
-      reader.onerror = () => reject(new Error('Не удалось прочитать файл'));
-      reader.readAsDataURL(file);
-    });
-    const res = await fetch(uploadUrl, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token || '' },
-      body: JSON.stringify({ file_name: file.name, file_type: file.type, file_data: base64 }),
-    });
-    if (!res.ok) throw new Error('Ошибка загрузки файла в хранилище');
-    const data = await res.json();
-    if (!data.file_url) throw new Error('Сервер не вернул ссылку на файл');
-    return data.file_url as string;
-  };
+  const uploadToStorage = (file: File): Promise<string> => uploadFileDirect(file, token);
 
   const callInvoiceFiles = async (body: Record<string, unknown>) => {
     if (!payment) throw new Error('Платёж не выбран');
@@ -258,56 +240,9 @@ const EditPaymentModal = ({ payment, onClose, onSuccess }: EditPaymentModalProps
     const file = e.target.files?.[0];
     if (!file) return;
 
-    const uploadUrl = (FUNC2URL as Record<string, string>)['upload-presigned-url'];
-    if (!uploadUrl) {
-      toast({
-        title: 'Сервис загрузки недоступен',
-        description: 'Обновите страницу и попробуйте снова. Если ошибка повторится — обратитесь к администратору.',
-        variant: 'destructive',
-      });
-      e.target.value = '';
-      return;
-    }
-
     setIsUploadingFile(true);
     try {
-      const fileBase64 = await new Promise<string>((resolve) => {
-        const reader = new FileReader();
-        reader.onloadend = () => resolve(reader.result as string);
-        reader.readAsDataURL(file);
-      });
-
-      const uploadRes = await fetch(uploadUrl, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token || '' },
-        body: JSON.stringify({ file_name: file.name, file_type: file.type, file_data: fileBase64 }),
-      });
-
-      if (!uploadRes.ok) {
-        let serverError = '';
-        try {
-          const errData = await uploadRes.json();
-          serverError = (errData && (errData.error || errData.message)) || '';
-        } catch {
-          /* non-JSON response */
-        }
-        toast({
-          title: 'Не удалось сохранить файл',
-          description: serverError || `Ошибка сервера (${uploadRes.status}). Попробуйте ещё раз или выберите другой файл.`,
-          variant: 'destructive',
-        });
-        return;
-      }
-
-      const { file_url } = await uploadRes.json();
-      if (!file_url) {
-        toast({
-          title: 'Ошибка загрузки',
-          description: 'Сервер не вернул ссылку на файл. Попробуйте ещё раз.',
-          variant: 'destructive',
-        });
-        return;
-      }
+      const file_url = await uploadFileDirect(file, token);
 
       setFormData(prev => ({ ...prev, invoice_file_url: file_url }));
       setUploadedFileName(file.name);
@@ -318,8 +253,8 @@ const EditPaymentModal = ({ payment, onClose, onSuccess }: EditPaymentModalProps
     } catch (err) {
       console.error('File upload failed:', err);
       toast({
-        title: 'Ошибка сети',
-        description: 'Не удалось загрузить файл. Проверьте подключение и попробуйте снова.',
+        title: 'Не удалось сохранить файл',
+        description: translateFetchError(err, 'Не удалось загрузить файл. Проверьте подключение и попробуйте снова.'),
         variant: 'destructive',
       });
     } finally {
@@ -1,6 +1,6 @@
 import { useState, useCallback } from 'react';
-import FUNC2URL from '@/../backend/func2url.json';
-import { fileToDataUrl } from './pdfUtils';
+import { uploadFileDirect } from '@/utils/directUpload';
+import { translateFetchError } from '@/utils/api';
 
 export type AdditionalFileStatus = 'pending' | 'uploading' | 'attaching' | 'done' | 'error';
 
@@ -113,49 +113,20 @@ export const useInvoiceFileUpload = ({ token, onUrlReady, onToast, onAfterUpload
       description: 'Сохраняю документ и начинаю распознавание...',
     });
 
-    // Загружаем файл через backend (base64) — без CORS-проблем presigned PUT
+    // Файл загружается прямо в S3 по подписанной ссылке, минуя функции
     setIsUploadingInvoice(true);
     try {
-      const fileBase64 = await fileToDataUrl(file);
-      const uploadRes = await fetch(FUNC2URL['upload-presigned-url'], {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token || '' },
-        body: JSON.stringify({ file_name: file.name, file_type: file.type, file_data: fileBase64 }),
+      const fileUrl = await uploadFileDirect(file, token);
+      onUrlReady(fileUrl);
+      onToast({
+        title: 'Файл счёта сохранён',
+        description: 'Документ прикреплён к платежу',
       });
-      if (uploadRes.ok) {
-        const { file_url } = await uploadRes.json();
-        if (file_url) {
-          onUrlReady(file_url);
-          onToast({
-            title: 'Файл счёта сохранён',
-            description: 'Документ прикреплён к платежу',
-          });
-        } else {
-          onToast({
-            title: 'Ошибка загрузки',
-            description: 'Сервер не вернул ссылку на файл. Попробуйте выбрать файл ещё раз.',
-            variant: 'destructive',
-          });
-        }
-      } else {
-        let serverError = '';
-        try {
-          const errData = await uploadRes.json();
-          serverError = (errData && (errData.error || errData.message)) || '';
-        } catch {
-          /* non-JSON response */
-        }
-        onToast({
-          title: 'Не удалось сохранить файл',
-          description: serverError || `Ошибка сервера (${uploadRes.status}). Попробуйте ещё раз или выберите другой файл.`,
-          variant: 'destructive',
-        });
-      }
     } catch (err) {
       console.error('Direct upload failed', err);
       onToast({
-        title: 'Ошибка сети',
-        description: 'Не удалось загрузить файл. Проверьте подключение и попробуйте снова.',
+        title: 'Не удалось сохранить файл',
+        description: translateFetchError(err, 'Не удалось загрузить файл. Проверьте подключение и попробуйте снова.'),
         variant: 'destructive',
       });
     } finally {
@@ -1,7 +1,7 @@
 import { useState } from 'react';
 import FUNC2URL from '@/../backend/func2url.json';
 import { translateFetchError } from '@/utils/api';
-import { convertPdfToImage, fileToDataUrl } from './pdfUtils';
+import { fileToDataUrl } from './pdfUtils';
 
 interface UseInvoiceOCRParams {
   token: string | null;
@@ -45,7 +45,8 @@ export const useInvoiceOCR = ({
         description: 'Сохраняю документ на сервер...',
       });
 
-      const base64: string = isPdf ? await convertPdfToImage(file) : await fileToDataUrl(file);
+      // PDF отправляется как есть: счета из 1С сервер разбирает по текстовому слою без GPT
+      const base64: string = await fileToDataUrl(file);
 
       onToast({
         title: 'Шаг 2: Анализ документа',
@@ -59,6 +60,7 @@ export const useInvoiceOCR = ({
           file: base64,
           fileName: file.name,
           user_id: userId || null,
+          extract: true,
         }),
       });
 
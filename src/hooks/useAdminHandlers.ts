@@ -254,9 +254,10 @@ export const useAdminHandlers = ({
       const formEl = e.currentTarget as HTMLFormElement;
       const fd = new FormData(formEl);
 
-      const CHUNK_SIZE = 2 * 1024 * 1024;
+      const CHUNK_SIZE = 5 * 1024 * 1024;
       const totalChunks = Math.ceil(manualAppFile.size / CHUNK_SIZE);
       let uploadId = '';
+      let uploadKey = '';
       let file_url = '';
 
       for (let chunkIndex = 0; chunkIndex < totalChunks; chunkIndex++) {
@@ -287,7 +288,8 @@ export const useAdminHandlers = ({
             fileName: manualAppFile.name,
             fileType: manualAppFile.type,
             folder: 'works',
-            uploadId: uploadId || undefined
+            uploadId: uploadId || undefined,
+            key: uploadKey || undefined
           })
         });
 
@@ -295,6 +297,7 @@ export const useAdminHandlers = ({
 
         const result = await uploadResponse.json();
         if (!uploadId) uploadId = result.uploadId;
+        if (!uploadKey) uploadKey = result.key;
         if (result.complete) file_url = result.url;
       }
 
@@ -2,11 +2,10 @@ import { useState } from 'react';
 import { useAuth } from '@/contexts/AuthContext';
 import { useToast } from '@/hooks/use-toast';
 import { API_ENDPOINTS } from '@/config/api';
-import FUNC2URL from '@/../backend/func2url.json';
 import { usePaymentFormState, CustomFieldDefinition } from './paymentForm/usePaymentFormState';
 import { useInvoiceFileUpload } from './paymentForm/useInvoiceFileUpload';
 import { useInvoiceOCR } from './paymentForm/useInvoiceOCR';
-import { fileToDataUrl } from './paymentForm/pdfUtils';
+import { uploadFileDirect } from '@/utils/directUpload';
 import { validatePaymentForm } from './paymentForm/validators';
 
 export const usePaymentForm = (
@@ -113,7 +112,6 @@ export const usePaymentForm = (
         }
 
         if (createdPaymentId && additionalFiles.length > 0) {
-          const uploadUrl = (FUNC2URL as Record<string, string>)['upload-presigned-url'];
           const paymentId = createdPaymentId;
 
           // Сбрасываем прошлые статусы (если был повтор) и ставим всем «в очереди»
@@ -122,57 +120,14 @@ export const usePaymentForm = (
             setProgressFor(i, { status: 'pending', percent: 0, errorMessage: undefined });
           });
 
-          const xhrSendBase64 = (index: number, file: File, base64: string): Promise<string> =>
-            new Promise((resolve, reject) => {
-              const xhr = new XMLHttpRequest();
-              xhr.open('POST', uploadUrl, true);
-              xhr.setRequestHeader('Content-Type', 'application/json');
-              xhr.setRequestHeader('X-Auth-Token', token || '');
-
-              xhr.upload.onprogress = (evt) => {
-                if (evt.lengthComputable) {
-                  const percent = Math.min(99, Math.round((evt.loaded / evt.total) * 100));
-                  setProgressFor(index, { status: 'uploading', percent });
-                }
-              };
-              xhr.upload.onloadstart = () => {
-                setProgressFor(index, { status: 'uploading', percent: 1 });
-              };
-              xhr.onload = () => {
-                if (xhr.status >= 200 && xhr.status < 300) {
-                  try {
-                    const data = JSON.parse(xhr.responseText || '{}');
-                    if (data.file_url) {
-                      setProgressFor(index, { status: 'attaching', percent: 100 });
-                      resolve(data.file_url as string);
-                    } else {
-                      reject(new Error('Сервер не вернул ссылку'));
-                    }
-                  } catch (e) {
-                    reject(e instanceof Error ? e : new Error('Ошибка разбора ответа'));
-                  }
-                } else {
-                  reject(new Error(`Ошибка сервера (${xhr.status})`));
-                }
-              };
-              xhr.onerror = () => reject(new Error('Ошибка сети'));
-              xhr.onabort = () => reject(new Error('Загрузка прервана'));
-
-              xhr.send(JSON.stringify({
-                file_name: file.name,
-                file_type: file.type,
-                file_data: base64,
-              }));
-            });
-
-          const xhrUpload = async (index: number, file: File): Promise<string> => {
-            const base64 = await fileToDataUrl(file);
-            return xhrSendBase64(index, file, base64);
-          };
-
           const uploadSingle = async (index: number, file: File): Promise<boolean> => {
             try {
-              const fileUrl = await xhrUpload(index, file);
+              setProgressFor(index, { status: 'uploading', percent: 1 });
+              const fileUrl = await uploadFileDirect(file, token, (percent) => {
+                setProgressFor(index, percent < 100
+                  ? { status: 'uploading', percent }
+                  : { status: 'attaching', percent: 100 });
+              });
               const attachRes = await fetch(`${API_ENDPOINTS.paymentsApi}?action=invoice_files`, {
                 method: 'PATCH',
                 headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token || '' },
@@ -1,9 +1,10 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useSidebarTouch } from '@/hooks/useSidebarTouch';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
 import Icon from '@/components/ui/icon';
 import PaymentsSidebar from '@/components/payments/PaymentsSidebar';
 import { useToast } from '@/hooks/use-toast';
+import { useAuth } from '@/contexts/AuthContext';
 import LogAnalyzerHeader from '@/components/log-analyzer/LogAnalyzerHeader';
 import LogFilesList from '@/components/log-analyzer/LogFilesList';
 import LogFilters from '@/components/log-analyzer/LogFilters';
@@ -17,6 +18,8 @@ interface LogFile {
   total_lines: number;
   status: string;
   statistics: Array<{ level: string; count: number }>;
+  partition_size?: number | null;
+  expires_at?: string | null;
 }
 
 interface LogEntry {
@@ -33,6 +36,7 @@ const API_URL = 'https://functions.poehali.dev/dd221a88-cc33-4a30-a59f-830b0a418
 const COLLECT_API_URL = 'https://functions.poehali.dev/acbb6915-96bf-4e7f-ab66-c34c3fa4b26c';
 
 const LogAnalyzer = () => {
+  const { token } = useAuth();
   const [files, setFiles] = useState<LogFile[]>([]);
   const [selectedFile, setSelectedFile] = useState<LogFile | null>(null);
   const [entries, setEntries] = useState<LogEntry[]>([]);
@@ -45,6 +49,8 @@ const LogAnalyzer = () => {
   const [levelFilter, setLevelFilter] = useState<string>('');
   const [total, setTotal] = useState(0);
   const [offset, setOffset] = useState(0);
+  // Курсор начала каждой страницы: номер последней строки предыдущей страницы
+  const pageCursors = useRef<number[]>([0]);
   const limit = 100;
   const { toast } = useToast();
 
@@ -94,8 +100,14 @@ const LogAnalyzer = () => {
         action: 'entries',
         file_id: selectedFile.id.toString(),
         limit: limit.toString(),
-        offset: offset.toString(),
       });
+      const page = Math.floor(offset / limit);
+      const after = pageCursors.current[page];
+      if (after !== undefined) {
+        params.append('after', after.toString());
+      } else {
+        params.append('offset', offset.toString());
+      }
       
       if (levelFilter) params.append('level', levelFilter);
       if (searchQuery) params.append('search', searchQuery);
@@ -106,6 +118,9 @@ const LogAnalyzer = () => {
       const data = await response.json();
       setEntries(data.entries);
       setTotal(data.total);
+      if (data.next_after !== null && data.next_after !== undefined) {
+        pageCursors.current[page + 1] = data.next_after;
+      }
     } catch (error) {
       console.error('Failed to load entries:', error);
       toast({
@@ -137,7 +152,7 @@ const LogAnalyzer = () => {
       
       const response = await fetch(COLLECT_API_URL, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token || '' },
         body: JSON.stringify({
           sources,
           limit: 1000
@@ -242,16 +257,19 @@ const LogAnalyzer = () => {
 
   const handleSelectFile = (file: LogFile) => {
     setSelectedFile(file);
+    pageCursors.current = [0];
     setOffset(0);
   };
 
   const handleSearchChange = (query: string) => {
     setSearchQuery(query);
+    pageCursors.current = [0];
     setOffset(0);
   };
 
   const handleLevelChange = (level: string) => {
     setLevelFilter(level);
+    pageCursors.current = [0];
     setOffset(0);
   };
 
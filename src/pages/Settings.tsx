@@ -8,7 +8,7 @@ import { API_ENDPOINTS } from '@/config/api';
 import ManualBackupCard from './settings/ManualBackupCard';
 import AutoBackupCard from './settings/AutoBackupCard';
 import BackupHistoryCard from './settings/BackupHistoryCard';
-import { BackupHistoryItem, S3Backup, SCHEDULE_LABELS } from './settings/types';
+import { BackupHistoryItem, PendingRestore, S3Backup, SCHEDULE_LABELS } from './settings/types';
 
 const Settings = () => {
   const [dictionariesOpen, setDictionariesOpen] = useState(true);
@@ -17,7 +17,7 @@ const Settings = () => {
   const [importing, setImporting] = useState(false);
   const [restoreConfirmText, setRestoreConfirmText] = useState('');
   const fileInputRef = useRef<HTMLInputElement>(null);
-  const [pendingFile, setPendingFile] = useState<File | null>(null);
+  const [pendingRestore, setPendingRestore] = useState<PendingRestore | null>(null);
   const [history, setHistory] = useState<BackupHistoryItem[]>([]);
   const [historyLoading, setHistoryLoading] = useState(false);
 
@@ -108,7 +108,7 @@ const Settings = () => {
       if (resp.ok) {
         const data = await resp.json();
         toast({
-          title: 'Бэкап создан',
+          title: data.kind === 'incremental' ? 'Инкрементальный бэкап создан' : 'Бэкап создан',
           description: `${data.tables} таблиц, ${data.rows} записей (${data.size_mb} МБ)`,
         });
         loadAutoSettings();
@@ -131,14 +131,24 @@ const Settings = () => {
   const handleDeleteBackup = async (key: string) => {
     setDeletingKey(key);
     try {
-      const resp = await fetch(`${API_ENDPOINTS.autoBackup}?action=delete`, {
+      const request = (cascade: boolean) => fetch(`${API_ENDPOINTS.autoBackup}?action=delete`, {
         method: 'DELETE',
         headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token || '' },
-        body: JSON.stringify({ key }),
+        body: JSON.stringify({ key, cascade }),
       });
+      let resp = await request(false);
+      if (resp.status === 409) {
+        // От бэкапа зависят инкременты — без него их не восстановить
+        const data = await resp.json();
+        const count = (data.dependents || []).length;
+        if (!window.confirm(`От этой копии зависят инкрементальные копии (${count}). Удалить их вместе с ней?`)) return;
+        resp = await request(true);
+      }
       if (resp.ok) {
+        const data = await resp.json();
+        const deleted: string[] = data.deleted || [key];
         toast({ title: 'Удалено' });
-        setS3Backups(prev => prev.filter(b => b.key !== key));
+        setS3Backups(prev => prev.filter(b => !deleted.includes(b.key)));
       }
     } catch {
       toast({ title: 'Ошибка', variant: 'destructive' });
@@ -155,25 +165,20 @@ const Settings = () => {
       });
       if (!resp.ok) {
         const err = await resp.json().catch(() => ({ error: 'Ошибка сервера' }));
-        throw new Error(err.error || 'Не удалось скачать бэкап');
+        throw new Error(err.error || 'Не удалось создать бэкап');
       }
       const data = await resp.json();
-      const blob = new Blob([JSON.stringify(data, null, 2)], { type: 'application/json' });
-      const url = URL.createObjectURL(blob);
-      const a = document.createElement('a');
-      const date = new Date().toISOString().slice(0, 10);
-      a.href = url;
-      a.download = `backup_${date}.json`;
-      document.body.appendChild(a);
-      a.click();
-      document.body.removeChild(a);
-      URL.revokeObjectURL(url);
-      toast({ title: 'Готово', description: 'Резервная копия скачана' });
+      const manifest = data.manifest;
+      toast({
+        title: 'Готово',
+        description: `Резервная копия сохранена в хранилище: ${Object.keys(manifest.tables).length} таблиц, ${manifest.rows} записей`,
+      });
+      loadAutoSettings();
       loadHistory();
     } catch (error) {
       toast({
         title: 'Ошибка',
-        description: error instanceof Error ? error.message : 'Не удалось скачать бэкап',
+        description: error instanceof Error ? error.message : 'Не удалось создать бэкап',
         variant: 'destructive',
       });
     } finally {
@@ -184,21 +189,28 @@ const Settings = () => {
   const handleFileSelect = (e: React.ChangeEvent<HTMLInputElement>) => {
     const file = e.target.files?.[0];
     if (!file) return;
-    setPendingFile(file);
+    setPendingRestore({ name: file.name, file });
     setRestoreConfirmText('');
     if (fileInputRef.current) fileInputRef.current.value = '';
   };
 
+  const handleRestoreFromS3 = (backup: S3Backup) => {
+    setPendingRestore({ name: backup.name, key: backup.key });
+    setRestoreConfirmText('');
+  };
+
   const handleRestoreBackup = async () => {
-    if (restoreConfirmText !== 'ВОССТАНОВИТЬ' || !pendingFile) return;
+    if (restoreConfirmText !== 'ВОССТАНОВИТЬ' || !pendingRestore) return;
     setImporting(true);
     try {
-      const text = await pendingFile.text();
-      const backup = JSON.parse(text);
+      // Бэкап из облака восстанавливается на сервере потоково, файл прежнего формата передаётся целиком
+      const payload = pendingRestore.key
+        ? { key: pendingRestore.key }
+        : { backup: JSON.parse(await pendingRestore.file!.text()) };
       const resp = await fetch(`${API_ENDPOINTS.dbBackup}?action=import`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token || '' },
-        body: JSON.stringify({ backup }),
+        body: JSON.stringify(payload),
       });
       if (!resp.ok) {
         const err = await resp.json().catch(() => ({ error: 'Ошибка сервера' }));
@@ -209,7 +221,7 @@ const Settings = () => {
         title: 'Данные восстановлены',
         description: `Таблиц: ${result.tables_restored}, записей: ${result.rows_restored}`,
       });
-      setPendingFile(null);
+      setPendingRestore(null);
       setRestoreConfirmText('');
       setTimeout(() => { window.location.href = '/'; }, 2000);
     } catch (error) {
@@ -260,8 +272,8 @@ const Settings = () => {
             <ManualBackupCard
               exporting={exporting}
               importing={importing}
-              pendingFile={pendingFile}
-              setPendingFile={setPendingFile}
+              pendingRestore={pendingRestore}
+              setPendingRestore={setPendingRestore}
               restoreConfirmText={restoreConfirmText}
               setRestoreConfirmText={setRestoreConfirmText}
               fileInputRef={fileInputRef}
@@ -283,6 +295,7 @@ const Settings = () => {
               handleSaveSchedule={handleSaveSchedule}
               handleRunBackupNow={handleRunBackupNow}
               handleDeleteBackup={handleDeleteBackup}
+              handleRestoreFromS3={handleRestoreFromS3}
             />
           )}
 
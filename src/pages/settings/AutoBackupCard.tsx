@@ -21,6 +21,7 @@ interface AutoBackupCardProps {
   handleSaveSchedule: (value: string) => void;
   handleRunBackupNow: () => void;
   handleDeleteBackup: (key: string) => void;
+  handleRestoreFromS3: (backup: S3Backup) => void;
 }
 
 const AutoBackupCard = ({
@@ -34,6 +35,7 @@ const AutoBackupCard = ({
   handleSaveSchedule,
   handleRunBackupNow,
   handleDeleteBackup,
+  handleRestoreFromS3,
 }: AutoBackupCardProps) => (
   <Card className="border border-border">
     <CardHeader>
@@ -55,6 +57,7 @@ const AutoBackupCard = ({
             </SelectTrigger>
             <SelectContent>
               <SelectItem value="off">Отключено</SelectItem>
+              <SelectItem value="hourly">Ежечасно</SelectItem>
               <SelectItem value="daily">Ежедневно</SelectItem>
               <SelectItem value="weekly">Еженедельно</SelectItem>
               <SelectItem value="monthly">Ежемесячно</SelectItem>
@@ -107,6 +110,9 @@ const AutoBackupCard = ({
                     <p className="text-sm font-medium truncate">{backup.name}</p>
                     <p className="text-xs text-muted-foreground">
                       {formatDate(backup.created_at)} · {backup.size_mb} МБ
+                      {backup.kind === 'incremental' && backup.parent && (
+                        <> · инкремент к {backup.parent.replace(/^backups\//, '').replace(/\/$/, '')}</>
+                      )}
                     </p>
                   </div>
                 </div>
@@ -119,6 +125,13 @@ const AutoBackupCard = ({
                     <Icon name="Download" size={14} />
                     Скачать
                   </a>
+                  <button
+                    onClick={() => handleRestoreFromS3(backup)}
+                    className="inline-flex items-center gap-1.5 px-3 py-1.5 text-xs font-medium rounded-md bg-amber-500/10 text-amber-500 hover:bg-amber-500/20 transition-colors"
+                  >
+                    <Icon name="RotateCcw" size={14} />
+                    Восстановить
+                  </button>
                   <button
                     onClick={() => handleDeleteBackup(backup.key)}
                     disabled={deletingKey === backup.key}
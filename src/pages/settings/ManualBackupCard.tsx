@@ -13,12 +13,13 @@ import {
   AlertDialogTitle,
 } from '@/components/ui/alert-dialog';
 import { Input } from '@/components/ui/input';
+import { PendingRestore } from './types';
 
 interface ManualBackupCardProps {
   exporting: boolean;
   importing: boolean;
-  pendingFile: File | null;
-  setPendingFile: (file: File | null) => void;
+  pendingRestore: PendingRestore | null;
+  setPendingRestore: (restore: PendingRestore | null) => void;
   restoreConfirmText: string;
   setRestoreConfirmText: (text: string) => void;
   fileInputRef: RefObject<HTMLInputElement>;
@@ -30,8 +31,8 @@ interface ManualBackupCardProps {
 const ManualBackupCard = ({
   exporting,
   importing,
-  pendingFile,
-  setPendingFile,
+  pendingRestore,
+  setPendingRestore,
   restoreConfirmText,
   setRestoreConfirmText,
   fileInputRef,
@@ -46,16 +47,16 @@ const ManualBackupCard = ({
         Ручное копирование
       </CardTitle>
       <CardDescription>
-        Скачайте копию на устройство или восстановите из файла
+        Создайте копию в хранилище или восстановите из файла
       </CardDescription>
     </CardHeader>
     <CardContent className="space-y-4">
       <div className="flex flex-col sm:flex-row gap-3">
         <Button onClick={handleExportBackup} disabled={exporting} className="bg-[#7551e9] hover:bg-[#6341d4] text-white">
           {exporting ? (
-            <><Icon name="Loader2" size={18} className="mr-2 animate-spin" />Скачивание...</>
+            <><Icon name="Loader2" size={18} className="mr-2 animate-spin" />Создание...</>
           ) : (
-            <><Icon name="Download" size={18} className="mr-2" />Скачать резервную копию</>
+            <><Icon name="Download" size={18} className="mr-2" />Создать резервную копию</>
           )}
         </Button>
 
@@ -71,8 +72,8 @@ const ManualBackupCard = ({
         </Button>
       </div>
 
-      {pendingFile && (
-        <AlertDialog open={!!pendingFile} onOpenChange={(open) => { if (!open) { setPendingFile(null); setRestoreConfirmText(''); } }}>
+      {pendingRestore && (
+        <AlertDialog open={!!pendingRestore} onOpenChange={(open) => { if (!open) { setPendingRestore(null); setRestoreConfirmText(''); } }}>
           <AlertDialogContent>
             <AlertDialogHeader>
               <AlertDialogTitle className="flex items-center gap-2">
@@ -80,9 +81,9 @@ const ManualBackupCard = ({
                 Восстановление из резервной копии
               </AlertDialogTitle>
               <AlertDialogDescription>
-                Файл: <strong>{pendingFile.name}</strong>
+                {pendingRestore.key ? 'Копия' : 'Файл'}: <strong>{pendingRestore.name}</strong>
                 <br /><br />
-                Все текущие данные будут заменены на данные из файла. Это действие необратимо.
+                Все текущие данные будут заменены на данные из копии. Это действие необратимо.
                 <br /><br />
                 Для подтверждения введите: <strong>ВОССТАНОВИТЬ</strong>
               </AlertDialogDescription>
@@ -96,7 +97,7 @@ const ManualBackupCard = ({
               />
             </div>
             <AlertDialogFooter>
-              <AlertDialogCancel onClick={() => { setPendingFile(null); setRestoreConfirmText(''); }}>Отмена</AlertDialogCancel>
+              <AlertDialogCancel onClick={() => { setPendingRestore(null); setRestoreConfirmText(''); }}>Отмена</AlertDialogCancel>
               <AlertDialogAction
                 onClick={handleRestoreBackup}
                 disabled={importing || restoreConfirmText !== 'ВОССТАНОВИТЬ'}
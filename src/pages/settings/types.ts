@@ -11,10 +11,19 @@ export interface S3Backup {
   size_mb: number;
   created_at: string;
   url: string;
+  kind?: 'full' | 'incremental' | null;
+  parent?: string | null;
+}
+
+export interface PendingRestore {
+  name: string;
+  file?: File;
+  key?: string;
 }
 
 export const SCHEDULE_LABELS: Record<string, string> = {
   off: 'Отключено',
+  hourly: 'Ежечасно',
   daily: 'Ежедневно',
   weekly: 'Еженедельно',
   monthly: 'Ежемесячно',
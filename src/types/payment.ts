@@ -6,6 +6,9 @@ export interface CustomField {
   options?: string;
 }
 
+/** Ссылки на превью файла по размерам (наибольшая сторона 160 / 480 / 1024 px) */
+export type FilePreviews = Partial<Record<'sm' | 'md' | 'lg', string>>;
+
 export interface PaymentDocument {
   id: number;
   payment_id: number;
@@ -13,6 +16,7 @@ export interface PaymentDocument {
   file_url: string;
   document_type: string;
   uploaded_at: string;
+  previews?: FilePreviews | null;
 }
 
 export interface CashReceipt {
@@ -20,6 +24,7 @@ export interface CashReceipt {
   file_url: string;
   file_name?: string;
   uploaded_at: string;
+  previews?: FilePreviews | null;
 }
 
 /**
@@ -65,9 +70,11 @@ export interface Payment {
   invoice_date?: string;
   invoice_file_url?: string;
   invoice_file_uploaded_at?: string;
+  invoice_file_previews?: FilePreviews | null;
   payment_type?: string;
   cash_receipt_url?: string;
   cash_receipt_uploaded_at?: string;
+  cash_receipt_previews?: FilePreviews | null;
   cash_receipts?: CashReceipt[];
   created_at?: string;
   submitted_at?: string;
@@ -77,5 +84,5 @@ export interface Payment {
   rejected_at?: string;
   custom_fields?: CustomField[];
   documents?: PaymentDocument[];
-  [key: string]: string | number | boolean | undefined | CustomField[] | PaymentDocument[] | CashReceipt[] | null;
+  [key: string]: string | number | boolean | undefined | CustomField[] | PaymentDocument[] | CashReceipt[] | FilePreviews | null;
 }
\ No newline at end of file
@@ -0,0 +1,86 @@
+import FUNC2URL from '@/../backend/func2url.json';
+
+interface PresignedPost {
+  url: string;
+  fields: Record<string, string>;
+}
+
+const readError = async (res: Response, fallback: string): Promise<string> => {
+  try {
+    const data = await res.json();
+    return (data && (data.error || data.message)) || fallback;
+  } catch {
+    return fallback;
+  }
+};
+
+/**
+ * Отправка формы в бакет. multipart/form-data POST — «простой» CORS-запрос
+ * без preflight: файл доходит до S3, даже если бакет не отдаёт CORS-заголовки
+ * и ответ прочитать нельзя. Результат проверяет confirm на сервере.
+ */
+const postToBucket = (post: PresignedPost, file: File): Promise<void> =>
+  new Promise((resolve) => {
+    const form = new FormData();
+    Object.entries(post.fields).forEach(([name, value]) => form.append(name, value));
+    form.append('file', file);
+    const xhr = new XMLHttpRequest();
+    xhr.open('POST', post.url, true);
+    xhr.onloadend = () => resolve();
+    xhr.send(form);
+  });
+
+const sha256Hex = async (file: File): Promise<string | undefined> => {
+  if (!window.crypto?.subtle) return undefined;
+  const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+};
+
+/**
+ * Загружает файл прямо в S3 по подписанной POST-политике из upload-presigned-url
+ * и подтверждает загрузку. Хэш содержимого отправляется заранее и подписывается
+ * в политике: S3 сверяет его с байтами, и при подтверждении сервер заменяет
+ * загрузку уже сохранённым файлом с тем же хэшем. Возвращает публичный CDN-URL файла.
+ */
+export const uploadFileDirect = async (
+  file: File,
+  token: string | null,
+  onStage?: (percent: number) => void,
+): Promise<string> => {
+  const uploadUrl = (FUNC2URL as Record<string, string>)['upload-presigned-url'];
+  if (!uploadUrl) throw new Error('Сервис загрузки недоступен');
+  const headers = { 'Content-Type': 'application/json', 'X-Auth-Token': token || '' };
+
+  const presignRes = await fetch(uploadUrl, {
+    method: 'POST',
+    headers,
+    body: JSON.stringify({
+      action: 'presign',
+      file_name: file.name,
+      file_type: file.type,
+      file_size: file.size,
+      sha256: await sha256Hex(file),
+    }),
+  });
+  if (!presignRes.ok) {
+    throw new Error(await readError(presignRes, `Ошибка сервера (${presignRes.status})`));
+  }
+  const { upload, file_key } = await presignRes.json();
+  onStage?.(10);
+
+  await postToBucket(upload as PresignedPost, file);
+  onStage?.(90);
+
+  const confirmRes = await fetch(uploadUrl, {
+    method: 'POST',
+    headers,
+    body: JSON.stringify({ action: 'confirm', file_key }),
+  });
+  if (!confirmRes.ok) {
+    throw new Error(await readError(confirmRes, 'Не удалось загрузить файл в хранилище'));
+  }
+  const data = await confirmRes.json();
+  if (!data.file_url) throw new Error('Сервер не вернул ссылку на файл');
+  onStage?.(100);
+  return data.file_url as string;
+};